@@ -1,7 +1,8 @@
 """A package to specifically handle crystal structures and microstructures.
 
-   The crystal package has three main modules:
+   The crystal package has four main modules:
 
+   * :py:mod:`~pymicro.crystal.elasticity`
    * :py:mod:`~pymicro.crystal.lattice`
    * :py:mod:`~pymicro.crystal.microstructure`
    * :py:mod:`~pymicro.crystal.texture`
@@ -0,0 +1,375 @@
+"""The elasticity module define a class to handle the anisotropic elastic properties of single crystals.
+
+The stiffness of a crystal is described by a 6x6 matrix in Voigt notation, whose form depends on the crystal system.
+It is expressed in the crystal frame and can be rotated into the sample frame for a whole array of orientations at
+once. This gives access to the directional Young's modulus and to the elastic properties of textured polycrystals::
+
+  ni = ElasticTensor.cubic(249., 155., 114.)  # GPa
+  E = ni.young_modulus([[1., 0., 0.], [1., 1., 1.]])
+  C_hill = ni.hill_average(micro)  # stiffness of the textured polycrystal in the sample frame
+
+The shear components follow the Voigt convention (engineering shear strains) unless the Mandel notation is
+requested; in Mandel notation, the shear components of the stress and strain vectors are multiplied by
+:math:`\\sqrt{2}` so that the rotations of the 6x6 matrices are orthogonal.
+"""
+import numpy as np
+
+# indices (i, j) of the tensor components in Voigt order: 11, 22, 33, 23, 13, 12
+_voigt_pairs = np.array([(0, 0), (1, 1), (2, 2), (1, 2), (0, 2), (0, 1)])
+
+# weights to go from the Voigt to the Mandel notation
+_mandel_weights = np.array([1., 1., 1., np.sqrt(2), np.sqrt(2), np.sqrt(2)])
+
+
+def bond_matrix(R):
+    '''Compute the Bond matrix transforming a stiffness matrix in Voigt notation with a rotation.
+
+    If the rotation R transforms the coordinates of vectors (:math:`v'=Rv`),
+    the stiffness matrix in the new frame is :math:`C'=MCM^T`. The entries
+    of the matrix are
+    :math:`M_{IJ}=R_{ik}R_{jl}+R_{il}R_{jk}` (the second term only for
+    :math:`k\\neq l`), with (i, j) and (k, l) the tensor indices of the Voigt
+    indices I and J.
+
+    :param R: a (3, 3) or (..., 3, 3) array of rotation matrices.
+    :returns: a (6, 6) or (..., 6, 6) array.
+    '''
+    R = np.asarray(R, dtype=np.float64)
+    i = _voigt_pairs[:, 0][:, np.newaxis]
+    j = _voigt_pairs[:, 1][:, np.newaxis]
+    k = _voigt_pairs[:, 0][np.newaxis, :]
+    l = _voigt_pairs[:, 1][np.newaxis, :]
+    return R[..., i, k] * R[..., j, l] + (k != l) * R[..., i, l] * R[..., j, k]
+
+
+def rotate_stiffness(C, R):
+    '''Rotate a stiffness matrix in Voigt notation.
+
+    :param C: the (6, 6) stiffness matrix.
+    :param R: a (3, 3) or (..., 3, 3) array of rotation matrices (see :py:func:`bond_matrix`).
+    :returns: a (6, 6) or (..., 6, 6) array of the rotated stiffness matrices.
+    '''
+    M = bond_matrix(R)
+    return np.matmul(np.matmul(M, np.asarray(C, dtype=np.float64)), np.swapaxes(M, -1, -2))
+
+
+def voigt_to_mandel(C, compliance=False):
+    '''Convert a stiffness (or compliance) matrix from the Voigt to the Mandel notation.
+
+    :param C: a (..., 6, 6) array.
+    :param bool compliance: True if the matrix is a compliance matrix.
+    :returns: a (..., 6, 6) array.
+    '''
+    w = _mandel_weights if not compliance else 1. / _mandel_weights
+    return np.asarray(C) * w[:, np.newaxis] * w
+
+
+def mandel_to_voigt(C, compliance=False):
+    '''Convert a stiffness (or compliance) matrix from the Mandel to the Voigt notation.
+
+    :param C: a (..., 6, 6) array.
+    :param bool compliance: True if the matrix is a compliance matrix.
+    :returns: a (..., 6, 6) array.
+    '''
+    w = 1. / _mandel_weights if not compliance else _mandel_weights
+    return np.asarray(C) * w[:, np.newaxis] * w
+
+
+def _orientation_matrices(orientations, weights=None):
+    '''Return the orientation matrices and the normalized weights of a set of orientations.
+
+    The orientations can be a :py:class:`~pymicro.crystal.microstructure.Microstructure` (the grain volumes are
+    used as weights if they are all known), a list of orientations or grains, a (3, 3) orientation matrix, a
+    (N, 3, 3) array of orientation matrices or a (N, 3) array of Euler angles in degrees. A (3, 3) array is
+    always taken as a single orientation matrix, three sets of Euler angles must be given as a list of orientations.
+    '''
+    from pymicro.crystal.microstructure import Orientation, Microstructure
+    if isinstance(orientations, Microstructure):
+        grains = orientations.grains
+        if weights is None:
+            volumes = np.array([grain.volume for grain in grains], dtype=np.float64)
+            if np.all(volumes > 0):
+                weights = volumes
+        orientations = grains
+    if isinstance(orientations, np.ndarray) and orientations.shape == (3, 3):
+        # a single orientation matrix
+        g = orientations[np.newaxis].astype(np.float64)
+    elif isinstance(orientations, np.ndarray) and orientations.ndim == 2 and orientations.shape[1] == 3:
+        g = Orientation.Euler2OrientationMatrix(orientations)
+    else:
+        g = Orientation.orientation_matrices(orientations)
+    if weights is None:
+        weights = np.ones(len(g))
+    weights = np.asarray(weights, dtype=np.float64)
+    return g, weights / weights.sum()
+
+
+class ElasticTensor:
+    '''A class to handle the elastic stiffness of a single crystal.
+
+    The stiffness matrix is stored in Voigt notation in the crystal frame.
+    The instances are created with one of the static methods corresponding
+    to the crystal systems, for instance for titanium::
+
+      ti = ElasticTensor.hexagonal(162., 92., 69., 180., 46.7)
+    '''
+
+    def __init__(self, C, crystal_structure='triclinic'):
+        '''Create a new elastic tensor.
+
+        :param C: the (6, 6) symmetric stiffness matrix in Voigt notation.
+        :param str crystal_structure: a string describing the crystal structure.
+        :raise ValueError: if the stiffness matrix is not symmetric.
+        '''
+        C = np.array(C, dtype=np.float64).reshape((6, 6))
+        if not np.allclose(C, C.T):
+            raise ValueError('the stiffness matrix must be symmetric')
+        self._C = C
+        self._S = None
+        self.crystal_structure = crystal_structure
+
+    def __repr__(self):
+        s = 'ElasticTensor (%s)\n' % self.crystal_structure
+        s += str(self._C)
+        return s
+
+    @staticmethod
+    def isotropic(E, nu):
+        '''Create an isotropic elastic tensor.
+
+        :param float E: the Young's modulus.
+        :param float nu: the Poisson's ratio.
+        '''
+        lam = E * nu / ((1 + nu) * (1 - 2 * nu))
+        mu = E / (2 * (1 + nu))
+        return ElasticTensor.cubic(lam + 2 * mu, lam, mu, crystal_structure='isotropic')
+
+    @staticmethod
+    def cubic(c11, c12, c44, crystal_structure='cubic'):
+        '''Create an elastic tensor with cubic symmetry.'''
+        C = np.zeros((6, 6))
+        C[:3, :3] = c12
+        C[range(3), range(3)] = c11
+        C[range(3, 6), range(3, 6)] = c44
+        return ElasticTensor(C, crystal_structure)
+
+    @staticmethod
+    def hexagonal(c11, c12, c13, c33, c44):
+        '''Create an elastic tensor with hexagonal symmetry (the c axis is along Z).
+
+        The last constant is given by :math:`c_{66}=(c_{11}-c_{12})/2`.
+        '''
+        return ElasticTensor.tetragonal(c11, c12, c13, c33, c44, 0.5 * (c11 - c12), crystal_structure='hexagonal')
+
+    @staticmethod
+    def tetragonal(c11, c12, c13, c33, c44, c66, c16=0., crystal_structure='tetragonal'):
+        '''Create an elastic tensor with tetragonal symmetry (the c axis is along Z).
+
+        The constant c16 is only non zero for the tetragonal classes 4, -4 and 4/m.
+        '''
+        C = ElasticTensor.orthorhombic(c11, c12, c13, c11, c13, c33, c44, c44, c66)._C
+        C[0, 5] = C[5, 0] = c16
+        C[1, 5] = C[5, 1] = -c16
+        return ElasticTensor(C, crystal_structure)
+
+    @staticmethod
+    def trigonal(c11, c12, c13, c14, c33, c44, c15=0.):
+        '''Create an elastic tensor with trigonal symmetry (the c axis is along Z).
+
+        The constant c15 is only non zero for the trigonal classes 3 and -3.
+        '''
+        C = ElasticTensor.hexagonal(c11, c12, c13, c33, c44)._C
+        C[0, 3] = C[3, 0] = c14
+        C[1, 3] = C[3, 1] = -c14
+        C[4, 5] = C[5, 4] = c14
+        C[0, 4] = C[4, 0] = c15
+        C[1, 4] = C[4, 1] = -c15
+        C[3, 5] = C[5, 3] = -c15
+        return ElasticTensor(C, 'trigonal')
+
+    @staticmethod
+    def orthorhombic(c11, c12, c13, c22, c23, c33, c44, c55, c66):
+        '''Create an elastic tensor with orthorhombic symmetry.'''
+        C = np.array([[c11, c12, c13, 0., 0., 0.],
+                      [c12, c22, c23, 0., 0., 0.],
+                      [c13, c23, c33, 0., 0., 0.],
+                      [0., 0., 0., c44, 0., 0.],
+                      [0., 0., 0., 0., c55, 0.],
+                      [0., 0., 0., 0., 0., c66]])
+        return ElasticTensor(C, 'orthorhombic')
+
+    @staticmethod
+    def monoclinic(c11, c12, c13, c15, c22, c23, c25, c33, c35, c44, c46, c55, c66):
+        '''Create an elastic tensor with monoclinic symmetry (the 2-fold axis is along Y).'''
+        C = ElasticTensor.orthorhombic(c11, c12, c13, c22, c23, c33, c44, c55, c66)._C
+        for (i, j, c) in [(0, 4, c15), (1, 4, c25), (2, 4, c35), (3, 5, c46)]:
+            C[i, j] = C[j, i] = c
+        return ElasticTensor(C, 'monoclinic')
+
+    @staticmethod
+    def triclinic(C):
+        '''Create an elastic tensor from the 21 independent constants given as a symmetric (6, 6) matrix.'''
+        return ElasticTensor(C, 'triclinic')
+
+    def stiffness(self, notation='voigt'):
+        '''Return the stiffness matrix in the crystal frame.
+
+        :param str notation: 'voigt' (default) or 'mandel'.
+        :returns: a (6, 6) numpy array.
+        '''
+        if notation == 'mandel':
+            return voigt_to_mandel(self._C)
+        return self._C.copy()
+
+    def compliance(self, notation='voigt'):
+        '''Return the compliance matrix in the crystal frame.
+
+        In Voigt notation, the compliance relates the stress to the
+        engineering strains, it is simply the inverse of the stiffness matrix.
+
+        :param str notation: 'voigt' (default) or 'mandel'.
+        :returns: a (6, 6) numpy array.
+        '''
+        if self._S is None:
+            self._S = np.linalg.inv(self._C)
+        if notation == 'mandel':
+            return voigt_to_mandel(self._S, compliance=True)
+        return self._S.copy()
+
+    def rotated_stiffness(self, orientations, notation='voigt'):
+        '''Compute the stiffness matrices in the sample frame for a series of orientations.
+
+        The orientation matrix g transforms the sample coordinates into the
+        crystal coordinates so the rotation applied to the stiffness is
+        :math:`g^T` (see :py:func:`rotate_stiffness`).
+
+        :param orientations: the orientations, an :py:class:`~pymicro.crystal.microstructure.Orientation` or
+            :py:class:`~pymicro.crystal.microstructure.Grain` instance, a list of orientations or grains, a (3, 3)
+            orientation matrix, a (N, 3, 3) array of orientation matrices or a (N, 3) array of Euler angles in
+            degrees.
+        :param str notation: 'voigt' (default) or 'mandel'.
+        :returns: a (N, 6, 6) numpy array.
+        '''
+        from pymicro.crystal.microstructure import Orientation, Grain
+        if isinstance(orientations, (Orientation, Grain)):
+            orientations = [orientations]
+        (g, weights) = _orientation_matrices(orientations)
+        C = rotate_stiffness(self._C, np.swapaxes(g, -1, -2))
+        if notation == 'mandel':
+            return voigt_to_mandel(C)
+        return C
+
+    def young_modulus(self, directions, orientations=None):
+        '''Compute the Young's modulus along some directions.
+
+        The Young's modulus along the unit vector n is given by
+        :math:`1/E = b^TSb` with S the compliance matrix in Voigt notation
+        and :math:`b=(n_1^2, n_2^2, n_3^2, n_2n_3, n_1n_3, n_1n_2)`.
+
+        :param directions: a (3,) or (D, 3) array of directions (they are normalized), in the crystal frame or in
+            the sample frame if the orientations are given.
+        :param orientations: the orientations of the crystals (see :py:meth:`rotated_stiffness`), None by default.
+        :returns: a (D,) array of the Young's moduli, or a (N, D) array if the orientations are given.
+        '''
+        n = np.atleast_2d(np.asarray(directions, dtype=np.float64))
+        n = n / np.linalg.norm(n, axis=-1)[:, np.newaxis]
+        if orientations is not None:
+            (g, weights) = _orientation_matrices(orientations)
+            # directions in the crystal frames, (N, D, 3)
+            n = np.einsum('nij,dj->ndi', g, n)
+        b = n[..., _voigt_pairs[:, 0]] * n[..., _voigt_pairs[:, 1]]
+        return 1. / np.einsum('...i,ij,...j->...', b, self.compliance(), b)
+
+    def young_modulus_map(self, n_azimuth=181, n_polar=91):
+        '''Compute the Young's modulus on a regular grid of directions of the crystal frame.
+
+        The direction of azimuth :math:`\\varphi` and polar angle
+        :math:`\\theta` is :math:`(\\cos\\varphi\\sin\\theta,
+        \\sin\\varphi\\sin\\theta, \\cos\\theta)`.
+
+        :param int n_azimuth: the number of azimuth values in [0, 360] degrees.
+        :param int n_polar: the number of polar angle values in [0, 180] degrees.
+        :returns tuple (azimuth, polar, E): three (n_polar, n_azimuth) arrays, the angles being in degrees.
+        '''
+        (azimuth, polar) = np.meshgrid(np.linspace(0., 360., n_azimuth), np.linspace(0., 180., n_polar))
+        (phi, theta) = (np.radians(azimuth), np.radians(polar))
+        n = np.stack((np.cos(phi) * np.sin(theta), np.sin(phi) * np.sin(theta), np.cos(theta)), axis=-1)
+        E = self.young_modulus(n.reshape((-1, 3))).reshape(azimuth.shape)
+        return azimuth, polar, E
+
+    def _average(self, matrix, orientations, weights, chunk_size):
+        '''Compute the weighted average of a matrix in Mandel notation rotated with a series of orientations.
+
+        In Mandel notation, the same orthogonal matrix :math:`Q=WMW^{-1}` rotates
+        both the stiffness and the compliance. The orientations are processed
+        by chunks to limit the memory use.
+        '''
+        (g, weights) = _orientation_matrices(orientations, weights)
+        w = _mandel_weights
+        average = np.zeros((6, 6))
+        for start in range(0, len(g), chunk_size):
+            Q = bond_matrix(np.swapaxes(g[start:start + chunk_size], -1, -2)) * w[:, np.newaxis] / w
+            QC = np.matmul(Q * weights[start:start + chunk_size, np.newaxis, np.newaxis], matrix)
+            average += np.tensordot(QC, Q, axes=([0, 2], [0, 2]))
+        return average
+
+    def voigt_average(self, orientations, weights=None, chunk_size=100000):
+        '''Compute the Voigt (uniform strain) average of the stiffness over a set of orientations.
+
+        :param orientations: the orientations, a :py:class:`~pymicro.crystal.microstructure.Microstructure` (the
+            grain volumes are used as weights when they are known), a list of orientations or grains, a (N, 3, 3)
+            array of orientation matrices or a (N, 3) array of Euler angles in degrees.
+        :param weights: an optional (N,) array of weights (volume fractions).
+        :param int chunk_size: the number of orientations processed at once.
+        :returns: the (6, 6) average stiffness matrix in Voigt notation in the sample frame.
+        '''
+        C = self._average(self.stiffness('mandel'), orientations, weights, chunk_size)
+        return mandel_to_voigt(C)
+
+    def reuss_average(self, orientations, weights=None, chunk_size=100000):
+        '''Compute the Reuss (uniform stress) average of the stiffness over a set of orientations.
+
+        The rotated compliance matrices are averaged and the result is inverted.
+        See :py:meth:`voigt_average` for the parameters.
+
+        :returns: the (6, 6) average stiffness matrix in Voigt notation in the sample frame.
+        '''
+        S = self._average(self.compliance('mandel'), orientations, weights, chunk_size)
+        return mandel_to_voigt(np.linalg.inv(S))
+
+    def hill_average(self, orientations, weights=None, chunk_size=100000):
+        '''Compute the Hill average (mean of the Voigt and Reuss averages) of the stiffness.
+
+        See :py:meth:`voigt_average` for the parameters.
+
+        :returns: the (6, 6) average stiffness matrix in Voigt notation in the sample frame.
+        '''
+        return 0.5 * (self.voigt_average(orientations, weights, chunk_size) +
+                      self.reuss_average(orientations, weights, chunk_size))
+
+    def isotropic_moduli(self, method='hill'):
+        '''Compute the bulk and shear moduli of an untextured polycrystal.
+
+        The Voigt bounds are given by
+        :math:`9K_V=(C_{11}+C_{22}+C_{33})+2(C_{12}+C_{23}+C_{13})` and
+        :math:`15G_V=(C_{11}+C_{22}+C_{33})-(C_{12}+C_{23}+C_{13})+3(C_{44}+C_{55}+C_{66})`
+        and the Reuss bounds by
+        :math:`1/K_R=(S_{11}+S_{22}+S_{33})+2(S_{12}+S_{23}+S_{13})` and
+        :math:`15/G_R=4(S_{11}+S_{22}+S_{33})-4(S_{12}+S_{23}+S_{13})+3(S_{44}+S_{55}+S_{66})`.
+
+        :param str method: 'voigt', 'reuss' or 'hill' (default).
+        :raise ValueError: if the method is unknown.
+        :returns tuple (K, G): the bulk and shear moduli.
+        '''
+        (C, S) = (self._C, self.compliance())
+        K_V = (np.trace(C[:3, :3]) + 2 * (C[0, 1] + C[1, 2] + C[0, 2])) / 9.
+        G_V = (np.trace(C[:3, :3]) - (C[0, 1] + C[1, 2] + C[0, 2]) + 3 * np.trace(C[3:, 3:])) / 15.
+        K_R = 1. / (np.trace(S[:3, :3]) + 2 * (S[0, 1] + S[1, 2] + S[0, 2]))
+        G_R = 15. / (4 * np.trace(S[:3, :3]) - 4 * (S[0, 1] + S[1, 2] + S[0, 2]) + 3 * np.trace(S[3:, 3:]))
+        if method == 'voigt':
+            return K_V, G_V
+        elif method == 'reuss':
+            return K_R, G_R
+        elif method == 'hill':
+            return 0.5 * (K_V + K_R), 0.5 * (G_V + G_R)
+        raise ValueError('unknown averaging method %s, choose among voigt, reuss or hill' % method)
@@ -1,11 +1,84 @@
 """The lattice module define the class to handle 3D crystal lattices (the 14 Bravais lattices).
 """
 import os
-from pymicro.external import CifFile
+import re
 import itertools
+from collections import OrderedDict
 import numpy as np
 from numpy import pi, dot, transpose, radians
-from matplotlib import pyplot as plt
+from pymicro.lazy import lazy_import
+
+plt = lazy_import('matplotlib.pyplot')
+
+
+# lattice parameters (a, b, c in angstrom, alpha, beta, gamma in degrees) of the CIF files in crystal/cif
+_bundled_cif_parameters = {'Al': (4.04958, 4.04958, 4.04958, 90, 90, 90),
+                           'Be': (2.2866, 2.2866, 3.5833, 90, 90, 120),
+                           'C': (3.56679, 3.56679, 3.56679, 90, 90, 90),
+                           'Co': (2.5071, 2.5071, 4.0686, 90, 90, 120),
+                           'Cr': (2.8839, 2.8839, 2.8839, 90, 90, 90),
+                           'Cu': (3.61496, 3.61496, 3.61496, 90, 90, 90),
+                           'Fe': (2.8665, 2.8665, 2.8665, 90, 90, 90),
+                           'Ga': (4.5107, 4.5167, 7.6448, 90, 90, 90),
+                           'Ge': (5.65735, 5.65735, 5.65735, 90, 90, 90),
+                           'Li': (3.5093, 3.5093, 3.5093, 90, 90, 90),
+                           'Mg': (3.20927, 3.20927, 5.21033, 90, 90, 120),
+                           'Nb': (3.3004, 3.3004, 3.3004, 90, 90, 90),
+                           'Ni': (3.52387, 3.52387, 3.52387, 90, 90, 90),
+                           'Pb': (4.9505, 4.9505, 4.9505, 90, 90, 90),
+                           'Ti': (2.950, 2.950, 4.686, 90, 90, 120),
+                           'V': (3.0240, 3.0240, 3.0240, 90, 90, 90),
+                           'Zn': (2.6648, 2.6648, 4.9467, 90, 90, 120),
+                           }
+
+# lattice parameters read from CIF files, indexed by (absolute path, modification time)
+_cif_parameters = {}
+
+
+def _read_cif_parameters(file_path):
+    '''Read the lattice parameters from a CIF file.
+
+    The parameters are cached in memory and on the disk, the CIF parser is
+    only used if the file has not been read before or has been modified.
+
+    :param str file_path: the path to the CIF file.
+    :returns: a tuple (a, b, c, alpha, beta, gamma) with the lengths in angstrom and the angles in degrees.
+    '''
+    import json
+    from pymicro.file.file_utils import get_cache_dir
+    file_path = os.path.abspath(file_path)
+    key = (file_path, os.path.getmtime(file_path))
+    if key in _cif_parameters:
+        return _cif_parameters[key]
+    try:
+        cache_path = os.path.join(get_cache_dir(), 'cif_parameters.json')
+    except OSError:
+        cache_path = None  # the cache directory cannot be created
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as f:
+                cache = json.load(f)
+        except ValueError:
+            cache = {}  # corrupted cache file
+    entry = cache.get(file_path)
+    if entry is not None and entry['mtime'] == key[1]:
+        parameters = tuple(entry['parameters'])
+    else:
+        from pymicro.external import CifFile
+        crystal = CifFile.ReadCif(file_path).first_block()
+        parameters = tuple(float(crystal[field]) for field in
+                           ['_cell_length_a', '_cell_length_b', '_cell_length_c',
+                            '_cell_angle_alpha', '_cell_angle_beta', '_cell_angle_gamma'])
+        cache[file_path] = {'mtime': key[1], 'parameters': parameters}
+        if cache_path:
+            try:
+                with open(cache_path, 'w') as f:
+                    json.dump(cache, f)
+            except IOError:
+                pass  # caching is not possible, the file will be parsed again next time
+    _cif_parameters[key] = parameters
+    return parameters
 
 
 class Crystal:
@@ -18,6 +91,9 @@ class Crystal:
      * a point basis (or motif)
     '''
 
+    # number of sets of reflections for which the structure factors are kept in memory
+    max_cached_structure_factors = 8
+
     def __init__(self, lattice, basis=None, basis_labels=None, basis_sizes=None, basis_colors=None):
         '''
         Create a Crystal instance with the given lattice and basis.
@@ -44,6 +120,127 @@ class Crystal:
             self._labels = basis_labels
             self._sizes = basis_sizes
             self._colors = basis_colors
+        # structure factors are cached for the last sets of reflections
+        self._structure_factors = OrderedDict()
+
+    def basis_positions(self):
+        '''Compute the fractional coordinates of all the atoms in the unit cell.
+
+        Each atom of the basis is attached to every lattice point of the
+        cell, so that the centering translations of the lattice are applied
+        to the basis positions.
+
+        :returns: a tuple with a (n, 3) numpy array of the atomic positions
+            and the list of the n corresponding labels.
+        '''
+        translations = self._lattice.centering_translations()
+        basis = np.array(self._basis, dtype=np.float64).reshape((-1, 3))
+        positions = (basis[np.newaxis, :, :] + translations[:, np.newaxis, :]).reshape((-1, 3))
+        labels = list(self._labels) * len(translations)
+        return positions % 1., labels
+
+    def structure_factors(self, hkl, debye_waller=None):
+        '''Compute the squared structure factors for a set of reflections.
+
+        The structure factor of reflection (hkl) is given by:
+
+        .. math::
+
+          F_{hkl}=\\sum_j f_j(s)\\exp(-B_j s^2)\\exp\\left(2i\\pi(hx_j+ky_j+lz_j)\\right)
+
+        where the sum runs over all the atoms of the unit cell (see
+        :py:meth:`~pymicro.crystal.lattice.Crystal.basis_positions`),
+        :math:`f_j` are the atomic scattering factors and
+        :math:`s=\\sin\\theta/\\lambda=1/2d_{hkl}`. The atom labels of the
+        basis are used to get the chemical element of each atom (e.g. 'Ni' or
+        'Fe2+').
+
+        Anomalous scattering is neglected so the structure factors do not
+        depend on the X-ray energy; the (read only) result is cached for the
+        last sets of reflections and Debye-Waller factors used.
+
+        .. note::
+
+          For this calculation to work properly, the lattice spacing needs
+          to be in nm units.
+
+        :param hkl: a :py:class:`~pymicro.crystal.lattice.HklPlaneArray` instance or a (N, 3) array of Miller indices.
+        :param debye_waller: the isotropic Debye-Waller factor B in angstrom^2,
+            either a scalar, a dictionary with one value per element, or a
+            sequence with one value per basis atom (None by default).
+        :raise ValueError: if the scattering factor of one basis atom is unknown.
+        :returns: a (N,) numpy array of the squared structure factors :math:`|F_{hkl}|^2`.
+        '''
+        from pymicro.xray.xray_utils import atomic_scattering_factor
+        if isinstance(hkl, HklPlaneArray):
+            hkl = hkl.miller_indices()
+        hkl = np.asarray(hkl, dtype=int).reshape((-1, 3))
+        if isinstance(debye_waller, dict):
+            dw_key = tuple(sorted(debye_waller.items()))
+        elif debye_waller is not None:
+            dw_key = tuple(np.atleast_1d(debye_waller).tolist())
+        else:
+            dw_key = None
+        key = (hkl.tostring(), dw_key)
+        if key in self._structure_factors:
+            # move the entry to the end so that it is removed last
+            self._structure_factors[key] = self._structure_factors.pop(key)
+            return self._structure_factors[key]
+        elements = []
+        for label in self._labels:
+            match = re.match('[A-Z][a-z]?', label)
+            if match is None:
+                raise ValueError('cannot find the scattering factor of atom %s' % label)
+            elements.append(match.group())
+        if debye_waller is None:
+            B = np.zeros(len(elements))
+        elif isinstance(debye_waller, dict):
+            B = np.array([debye_waller.get(element, 0.) for element in elements])
+        else:
+            B = np.ones(len(elements)) * np.asarray(debye_waller, dtype=np.float64)
+        # sin(theta)/lambda = 1/2d in angstrom^-1
+        s = 0.05 / HklPlaneArray(hkl, self._lattice).interplanar_spacings()
+        f = np.empty((len(hkl), len(elements)))
+        for j, element in enumerate(elements):
+            f[:, j] = atomic_scattering_factor(element, s) * np.exp(-B[j] * s ** 2)
+        positions, _ = self.basis_positions()
+        # each basis atom is repeated for each lattice point
+        f = np.tile(f, (1, len(positions) // len(elements)))
+        phase = 2 * pi * np.dot(hkl, positions.T)
+        F2 = np.sum(f * np.cos(phase), axis=1) ** 2 + np.sum(f * np.sin(phase), axis=1) ** 2
+        F2.flags.writeable = False
+        self._structure_factors[key] = F2
+        while len(self._structure_factors) > Crystal.max_cached_structure_factors:
+            self._structure_factors.popitem(last=False)
+        return F2
+
+    def intensities(self, hkl, lambda_keV, debye_waller=None, lorentz_polarization=True):
+        '''Compute the kinematic diffracted intensities for a set of reflections.
+
+        The intensity is the squared structure factor (see
+        :py:meth:`~pymicro.crystal.lattice.Crystal.structure_factors`)
+        multiplied, if requested, by the Lorentz-polarization factor for an
+        unpolarized beam:
+
+        .. math::
+
+          LP(\\theta)=\\frac{1+\\cos^2 2\\theta}{\\sin^2\\theta\\cos\\theta}
+
+        :param hkl: a :py:class:`~pymicro.crystal.lattice.HklPlaneArray` instance.
+        :param lambda_keV: the X-ray energy in keV, either a scalar or an array broadcastable to (N,).
+        :param debye_waller: the isotropic Debye-Waller factors (see `structure_factors`).
+        :param bool lorentz_polarization: apply the Lorentz-polarization factor (True by default).
+        :returns: a (N,) numpy array of the intensities, zero for reflections which cannot diffract at this energy.
+        '''
+        if not isinstance(hkl, HklPlaneArray):
+            hkl = HklPlaneArray(hkl, self._lattice)
+        I = np.array(self.structure_factors(hkl, debye_waller))
+        theta = hkl.bragg_angles(lambda_keV) * np.ones(len(hkl))
+        if lorentz_polarization:
+            with np.errstate(invalid='ignore'):
+                I *= (1 + np.cos(2 * theta) ** 2) / (np.sin(theta) ** 2 * np.cos(theta))
+        I[np.isnan(theta)] = 0.
+        return I
 
 
 class Lattice:
@@ -97,6 +294,10 @@ class Lattice:
         self._lengths = lengths
         self._matrix = m
         self._centering = centering
+        # lattice metrics are computed on demand and cached (the matrix is never modified)
+        self._reciprocal_matrix = None
+        self._metric = None
+        self._reciprocal_metric = None
 
     def __eq__(self, other):
         """Override the default Equals behavior.
@@ -138,12 +339,55 @@ class Lattice:
          * b.b^* = 1
          * c.c^* = 1
         '''
-        [a, b, c] = self._matrix
-        V = self.volume()
-        astar = np.cross(b, c) / V
-        bstar = np.cross(c, a) / V
-        cstar = np.cross(a, b) / V
-        return [astar, bstar, cstar]
+        [astar, bstar, cstar] = self._get_reciprocal_matrix()
+        return [astar.copy(), bstar.copy(), cstar.copy()]
+
+    def _get_reciprocal_matrix(self):
+        '''Return the cached 3x3 array whose rows are the reciprocal lattice vectors.
+
+        The array is computed only once and shared by all the
+        :py:class:`~pymicro.crystal.lattice.HklPlane` objects using this
+        lattice so it must not be modified.
+        '''
+        if self._reciprocal_matrix is None:
+            [a, b, c] = self._matrix
+            V = self.volume()
+            self._reciprocal_matrix = np.array([np.cross(b, c), np.cross(c, a), np.cross(a, b)]) / V
+        return self._reciprocal_matrix
+
+    def metric_tensor(self):
+        '''Compute the metric tensor of the lattice.
+
+        The metric tensor is defined by :math:`G_{ij}=\\mathbf{a_i}.\\mathbf{a_j}`
+        and allows to compute lengths and angles directly from the Miller
+        indices of crystallographic directions.
+
+        :returns: a 3x3 numpy array.
+        '''
+        if self._metric is None:
+            self._metric = np.dot(self._matrix, self._matrix.T)
+        return self._metric.copy()
+
+    def reciprocal_metric_tensor(self):
+        '''Compute the metric tensor of the reciprocal lattice.
+
+        This is the inverse of the metric tensor and is used to compute the
+        interplanar spacing of any hkl plane:
+
+        .. math::
+
+           1/d_{hkl}^2 = (h, k, l).G^*.(h, k, l)^T
+
+        :returns: a 3x3 numpy array.
+        '''
+        return self._get_reciprocal_metric().copy()
+
+    def _get_reciprocal_metric(self):
+        '''Return the cached reciprocal metric tensor (must not be modified).'''
+        if self._reciprocal_metric is None:
+            r = self._get_reciprocal_matrix()
+            self._reciprocal_metric = np.dot(r, r.T)
+        return self._reciprocal_metric
 
     @property
     def matrix(self):
@@ -164,7 +408,7 @@ class Lattice:
          * 8 possible 120 degrees rotations around <111> axes
 
         :param str crystal_structure: a string describing the crystal structure.
-        :raise ValueError: if the given crystal structure is not cubic or none.
+        :raise ValueError: if the given crystal structure is not cubic, hexagonal, tetragonal or none.
         :returns array: A numpy array of shape (n, 3, 3) where n is the \
         number of symmetries of the given crystal structure.
         '''
@@ -204,6 +448,16 @@ class Lattice:
             sym[5] = np.array([[-1., 0., 0.], [0., 1., 0.], [0., 0., -1.]])
             sym[6] = np.array([[0., 1., 0.], [1., 0., 0.], [0., 0., -1.]])
             sym[7] = np.array([[0., -1., 0.], [-1., 0., 0.], [0., 0., -1.]])
+        elif crystal_structure == 'hexagonal':
+            # 6 rotations around the c axis and 6 two fold axes lying in the basal plane
+            sym = np.zeros((12, 3, 3), dtype=np.float)
+            for i in range(6):
+                (c, s) = (np.cos(i * pi / 3), np.sin(i * pi / 3))
+                sym[i] = np.array([[c, -s, 0.], [s, c, 0.], [0., 0., 1.]])
+                # two fold rotation around the axis lying at i * 30 degrees from X in the basal plane
+                sym[6 + i] = np.array([[c, s, 0.], [s, -c, 0.], [0., 0., -1.]])
+            # remove rounding errors
+            sym[np.abs(sym) < 1.e-12] = 0.
         elif crystal_structure == 'none':
             sym = np.zeros((1, 3, 3), dtype=np.float)
             sym[0] = np.array([[1., 0., 0.], [0., 1., 0.], [0., 0., 1.]])
@@ -228,19 +482,15 @@ class Lattice:
            Lattice constants are given in Angstrom in CIF files and so
            converted to nanometer.
 
+        The lattice parameters are cached on the disk (see
+        :py:func:`~pymicro.file.file_utils.get_cache_dir`) so that a given
+        file is only parsed again when it has been modified.
+
         :param str file_path: The path to the CIF file representing the crystal structure.
         :returns: A `Lattice` instance corresponding to the given CIF file.
         '''
-        cf = CifFile.ReadCif(file_path)
-        # crystal = eval('cf[\'%s\']' % symbol)
-        crystal = cf.first_block()
-        a = 0.1 * float(crystal['_cell_length_a'])
-        b = 0.1 * float(crystal['_cell_length_b'])
-        c = 0.1 * float(crystal['_cell_length_c'])
-        alpha = float(crystal['_cell_angle_alpha'])
-        beta = float(crystal['_cell_angle_beta'])
-        gamma = float(crystal['_cell_angle_gamma'])
-        return Lattice.from_parameters(a, b, c, alpha, beta, gamma)
+        (a, b, c, alpha, beta, gamma) = _read_cif_parameters(file_path)
+        return Lattice.from_parameters(0.1 * a, 0.1 * b, 0.1 * c, alpha, beta, gamma)
 
     @staticmethod
     def from_symbol(symbol):
@@ -254,7 +504,15 @@ class Lattice:
         *Returns*
 
         A `Lattice` instance corresponding to the given element.
+
+        .. note::
+
+          The lattice parameters of the CIF files bundled with pymicro are
+          precompiled so this does not require to parse any file.
         '''
+        if symbol in _bundled_cif_parameters:
+            (a, b, c, alpha, beta, gamma) = _bundled_cif_parameters[symbol]
+            return Lattice.from_parameters(0.1 * a, 0.1 * b, 0.1 * c, alpha, beta, gamma)
         path = os.path.dirname(__file__)
         return Lattice.from_cif(os.path.join(path, 'cif', '%s.cif' % symbol))
 
@@ -527,6 +785,45 @@ class Lattice:
         m = self._matrix
         return abs(np.dot(np.cross(m[0], m[1]), m[2]))
 
+    def centering_translations(self):
+        '''Returns the fractional coordinates of the lattice points of the unit cell.
+
+        :raise ValueError: if the centering is not supported.
+        :returns: a (n, 3) numpy array with n=1 (P), 2 (I, A, B, C) or 4 (F).
+        '''
+        translations = {'P': [[0., 0., 0.]],
+                        'I': [[0., 0., 0.], [0.5, 0.5, 0.5]],
+                        'F': [[0., 0., 0.], [0., 0.5, 0.5], [0.5, 0., 0.5], [0.5, 0.5, 0.]],
+                        'A': [[0., 0., 0.], [0., 0.5, 0.5]],
+                        'B': [[0., 0., 0.], [0.5, 0., 0.5]],
+                        'C': [[0., 0., 0.], [0.5, 0.5, 0.]]}
+        if self._centering not in translations:
+            raise ValueError('unsupported lattice centering: %s' % self._centering)
+        return np.array(translations[self._centering])
+
+    def guess_crystal_structure(self, tol=1.e-6):
+        '''Guess the crystal structure of this lattice from its parameters.
+
+        The returned string can be used with the
+        :py:meth:`~pymicro.crystal.lattice.Lattice.symmetry` method. Lattices
+        which do not correspond to one of the supported structures are
+        considered as 'none' (only the identity).
+
+        :param float tol: relative tolerance used to compare the lattice parameters.
+        :returns str: 'cubic', 'hexagonal', 'tetragonal' or 'none'.
+        '''
+        (a, b, c) = self._lengths
+        (alpha, beta, gamma) = self._angles
+        right = lambda x: abs(x - 90.) < tol * 90.
+        same = lambda x, y: abs(x - y) < tol * max(x, y)
+        if right(alpha) and right(beta) and right(gamma) and same(a, b):
+            if same(a, c):
+                return 'cubic'
+            return 'tetragonal'
+        if right(alpha) and right(beta) and abs(gamma - 120.) < tol * 120. and same(a, b):
+            return 'hexagonal'
+        return 'none'
+
     def get_hkl_family(self, hkl):
         '''Get a list of the hkl planes composing the given family for
         this crystal lattice.
@@ -619,6 +916,28 @@ class SlipSystem:
         return slip_systems
 
 
+# cache for the last zone tables, see HklDirection.zone_table
+_zone_tables = OrderedDict()
+_max_cached_zone_tables = 4
+
+
+def _gcd(a, b):
+    '''Compute element wise the greatest common divisor of two integer arrays.
+
+    Use the Euclid algorithm on the whole arrays at once; the gcd of 0 and
+    0 is 0 by convention.
+    '''
+    a = np.abs(np.asarray(a))
+    b = np.abs(np.asarray(b))
+    while np.any(b):
+        nz = b != 0
+        r = np.zeros_like(a)
+        r[nz] = a[nz] % b[nz]
+        a = np.where(nz, b, a)
+        b = r
+    return a
+
+
 class HklObject:
     def __init__(self, h, k, l, lattice=None):
         '''Create a new hkl object with the given Miller indices and
@@ -646,39 +965,38 @@ class HklObject:
         :returns list: A new list of :py:class:`~pymicro.crystal.lattice.HklObject` without any multiple reflection.
         """
         # create array with all the miller indices
-        hkl_array = np.empty((len(hkl_list), 3), dtype=int)
-        for i in range(len(hkl_list)):
-            hkl = hkl_list[i]
-            hkl_array[i] = np.array(hkl.miller_indices())
+        hkl_array = np.array([hkl.miller_indices() for hkl in hkl_list], dtype=int).reshape((-1, 3))
+        # reduce each object to its primitive direction (up to the sign) and the corresponding order
+        order = _gcd(_gcd(hkl_array[:, 0], hkl_array[:, 1]), hkl_array[:, 2])
+        primitive = hkl_array // np.maximum(order, 1)[:, np.newaxis]
+        first_nonzero = primitive[np.arange(len(primitive)), np.argmax(primitive != 0, axis=1)]
+        primitive *= np.where(first_nonzero < 0, -1, 1)[:, np.newaxis]
         # first start by ordering the HklObjects by ascending miller indices sum
         hkl_sum = np.sum(np.abs(hkl_array), axis=1)
         hkl_sum_sort = np.argsort(hkl_sum)
-        first_order_list = [hkl_list[hkl_sum_sort[0]]]
-        for i in range(1, len(hkl_sum_sort)):
-            hkl_next = hkl_sum_sort[i]
+        first_order_list = []
+        retained_orders = {}  # orders of the retained objects for each primitive direction
+        for hkl_next in hkl_sum_sort:
             hkl = hkl_list[hkl_next]
             (h, k, l) = hkl.miller_indices()
             if verbose:
                 print('trying hkl object (%d, %d, %d)' % (h, k, l))
+            # only colinear objects need to be checked, hkl is a multiple of uvw if its order is a multiple
+            key = tuple(primitive[hkl_next])
+            orders = retained_orders.setdefault(key, [])
             lower = False
-            # check if a hkl object already exist in the list
-            for uvw in first_order_list:
-                # try to assess the multiple from the sum of miller indices
-                (u, v, w) = uvw.miller_indices()
-                if verbose:
-                    print('looking at: (%d, %d, %d)' % (u, v, w))
-                n = hkl_sum[hkl_next] / np.sum(np.abs(np.array((u, v, w))), axis=0)
-                for order in [-n, n]:
-                    if (u * order == h) and (v * order == k) and (w * order) == l:
-                        if verbose:
-                            print('lower order reflexion was found: (%d, %d, %d) with n=%d' % (u, v, w, order))
-                        lower = True
-                        break
+            for n in orders:
+                if order[hkl_next] % n == 0:
+                    if verbose:
+                        print('lower order reflexion was found with n=%d' % (order[hkl_next] // n))
+                    lower = True
+                    break
             # if no lower order reflexion was found, add the hkl object to the list
             if not lower:
                 if verbose:
                     print('adding hkl object (%d, %d, %d) to the list' % (h, k, l))
                 first_order_list.append(hkl)
+                orders.append(order[hkl_next])
         return first_order_list
 
 
@@ -731,17 +1049,63 @@ class HklDirection(HklObject):
         :returns list: A list of :py:class:`~pymicro.crystal.lattice.HklPlane` objects \
         describing all the planes in zone with the direction.
         '''
-        (u, v, w) = self.miller_indices()
-        indices = range(-max_miller, max_miller + 1)
-        hklplanes_in_zone = []
-        for h in indices:
-            for k in indices:
-                for l in indices:
-                    if h == k == l == 0:  # skip (0, 0, 0)
-                        continue
-                    if np.dot(np.array([h, k, l]), np.array([u, v, w])) == 0:
-                        hklplanes_in_zone.append(HklPlane(h, k, l, self._lattice))
-        return hklplanes_in_zone
+        hkl = HklPlaneArray.from_max_miller(max_miller, self._lattice)
+        return hkl[hkl.zone_mask(self.miller_indices())[0]].to_list()
+
+    @staticmethod
+    def find_planes_in_zones(uvw, lattice=None, max_miller=5):
+        '''Find the hkl planes in zone with several crystallographic directions at once.
+
+        This is the vectorized version of
+        :py:meth:`~pymicro.crystal.lattice.HklDirection.find_planes_in_zone`.
+
+        :param uvw: an integer array of shape (M, 3) with the Miller indices of the zone axes.
+        :param Lattice lattice: The crystal lattice, will default to cubic if not specified.
+        :param int max_miller: The maximum miller index to limit the search.
+        :returns list: a list of M :py:class:`~pymicro.crystal.lattice.HklPlaneArray` instances.
+        '''
+        hkl = HklPlaneArray.from_max_miller(max_miller, lattice)
+        return [hkl[mask] for mask in hkl.zone_mask(uvw)]
+
+    @staticmethod
+    def zone_table(lattice=None, max_miller=5, max_uvw=3, first_order=False):
+        '''Build the table of the low index zone axes and their member reflections.
+
+        All primitive zone axes [uvw] (with the first non zero index
+        positive since [uvw] and [-u-v-w] define the same zone) with
+        indices in [-max_uvw, max_uvw] are considered. The reflections are
+        generated with
+        :py:meth:`~pymicro.crystal.lattice.HklPlaneArray.generate` so the
+        reflections forbidden by the lattice centering are excluded.
+
+        The tables of the last lattices and sets of parameters used are
+        cached so that subsequent calls are immediate; each call returns a
+        new dictionary (the reflection arrays are read only and shared).
+
+        :param Lattice lattice: The crystal lattice, will default to cubic if not specified.
+        :param int max_miller: The maximum miller index of the reflections.
+        :param int max_uvw: The maximum miller index of the zone axes.
+        :param bool first_order: retain only first order reflections (False by default).
+        :returns dict: a dictionary with the (u, v, w) tuples as keys and
+            :py:class:`~pymicro.crystal.lattice.HklPlaneArray` instances as values.
+        '''
+        if lattice == None:
+            lattice = Lattice.cubic(1.0)
+        key = (tuple(lattice._lengths), tuple(lattice._angles), lattice._centering, max_miller, max_uvw, first_order)
+        if key in _zone_tables:
+            # move the entry to the end so that it is removed last
+            _zone_tables[key] = _zone_tables.pop(key)
+        else:
+            hkl = HklPlaneArray.generate(lattice, max_miller=max_miller, first_order=first_order)
+            uvw = HklPlaneArray.generate(lattice, max_miller=max_uvw, extinctions=False, first_order=True,
+                                         include_friedel_pair=False).miller_indices()
+            table = {}
+            for (u, v, w), mask in zip(uvw, hkl.zone_mask(uvw)):
+                table[(int(u), int(v), int(w))] = hkl[mask]
+            _zone_tables[key] = table
+            while len(_zone_tables) > _max_cached_zone_tables:
+                _zone_tables.popitem(last=False)
+        return dict(_zone_tables[key])
 
 
 class HklPlane(HklObject):
@@ -803,7 +1167,7 @@ class HklPlane(HklObject):
 
         :returns: a numpy vector expressed in the cartesian coordinate system of the crystal.
         '''
-        [astar, bstar, cstar] = self._lattice.reciprocal_lattice()
+        [astar, bstar, cstar] = self._lattice._get_reciprocal_matrix()
         (h, k, l) = self.miller_indices()
         # express (h, k, l) in the cartesian crystal CS
         Gc = h * astar + k * bstar + l * cstar
@@ -836,21 +1200,15 @@ class HklPlane(HklObject):
            d = a / \sqrt{h^2 + k^2 + l^2}
 
         The general formula comes from 'Introduction to Crystallography'
-        p. 68 by Donald E. Sands.
+        p. 68 by Donald E. Sands. It is evaluated here using the (cached)
+        reciprocal metric tensor of the lattice:
+
+        .. math::
+
+           d = 1 / \sqrt{(h, k, l).G^*.(h, k, l)^T}
         '''
-        (a, b, c) = self._lattice._lengths
-        (h, k, l) = self.miller_indices()
-        (alpha, beta, gamma) = radians(self._lattice._angles)
-        # d = a / np.sqrt(h**2 + k**2 + l**2) # for cubic structure only
-        d = self._lattice.volume() / np.sqrt(h ** 2 * b ** 2 * c ** 2 * np.sin(alpha) ** 2 + \
-                                             k ** 2 * a ** 2 * c ** 2 * np.sin(
-                                                 beta) ** 2 + l ** 2 * a ** 2 * b ** 2 * np.sin(gamma) ** 2 + \
-                                             2 * h * l * a * b ** 2 * c * (
-                                                 np.cos(alpha) * np.cos(gamma) - np.cos(beta)) + \
-                                             2 * h * k * a * b * c ** 2 * (
-                                                 np.cos(alpha) * np.cos(beta) - np.cos(gamma)) + \
-                                             2 * k * l * a ** 2 * b * c * (
-                                                 np.cos(beta) * np.cos(gamma) - np.cos(alpha)))
+        hkl = np.array(self.miller_indices(), dtype=np.float64)
+        d = 1. / np.sqrt(np.dot(hkl, np.dot(self._lattice._get_reciprocal_metric(), hkl)))
         return d
 
     def bragg_angle(self, lambda_keV, verbose=False):
@@ -1114,3 +1472,326 @@ class HklPlane(HklObject):
         HklPlane.plot_slip_traces(orientation, hkl=hkl, n_int=np.array([0, -1, 0]), \
                                   view_up=np.array([0, 0, 1]), title=title, legend=legend, \
                                   trans=trans, verbose=verbose, str_plane='XZ')
+
+
+class HklPlaneArray:
+    '''
+    This class handles a collection of crystallographic planes sharing the
+    same crystal lattice.
+
+    The Miller indices are stored in a (N, 3) integer numpy array and all
+    quantities (scattering vectors, interplanar spacings, Bragg angles...)
+    are computed in a vectorized way using the cached metrics of the
+    lattice. This is much faster than working with lists of
+    :py:class:`~pymicro.crystal.lattice.HklPlane` objects when dealing with
+    large reflection lists (typically for diffraction pattern simulations).
+
+    ::
+
+      ni = Lattice.from_symbol('Ni')
+      hkl = HklPlaneArray.from_max_miller(8, lattice=ni)
+      d = hkl.interplanar_spacings()
+      theta = hkl.bragg_angles(40.)  # Bragg angles at 40 keV
+
+    .. note::
+
+      The Miller indices array is read only, use the selection mechanism
+      (``hkl[mask]``) to create a new array with a subset of the planes.
+    '''
+
+    def __init__(self, hkl, lattice=None):
+        '''Create a new array of hkl planes.
+
+        :param hkl: a sequence of Miller indices triplets (or an array of shape (N, 3)).
+        :param Lattice lattice: the crystal lattice, will default to cubic if not specified.
+        '''
+        if lattice == None:
+            lattice = Lattice.cubic(1.0)
+        self._lattice = lattice
+        self._hkl = np.array(hkl, dtype=int).reshape((-1, 3))
+        self._hkl.flags.writeable = False
+        self._scattering_vectors = None
+        self._spacings = None
+
+    def __len__(self):
+        return self._hkl.shape[0]
+
+    def __getitem__(self, index):
+        '''Access the planes of the array.
+
+        An integer index returns the corresponding
+        :py:class:`~pymicro.crystal.lattice.HklPlane` object while a slice,
+        a list of indices or a boolean mask returns a new `HklPlaneArray`.
+        '''
+        if isinstance(index, (int, np.integer)):
+            (h, k, l) = self._hkl[index]
+            return HklPlane(int(h), int(k), int(l), self._lattice)
+        return HklPlaneArray(self._hkl[index], self._lattice)
+
+    def __repr__(self):
+        out = ['HKL Plane array',
+               ' number of planes : %d' % len(self),
+               ' crystal lattice : ' + str(self._lattice)]
+        return '\n'.join(out)
+
+    @staticmethod
+    def from_list(hkl_list, lattice=None):
+        '''Create a new array from a list of `HklPlane` objects.
+
+        :param list hkl_list: a list of :py:class:`~pymicro.crystal.lattice.HklPlane` instances.
+        :param Lattice lattice: the crystal lattice, if None, the lattice of the first plane is used.
+        :returns: a new `HklPlaneArray` instance.
+        '''
+        if lattice == None and len(hkl_list) > 0:
+            lattice = hkl_list[0]._lattice
+        return HklPlaneArray([hkl.miller_indices() for hkl in hkl_list], lattice)
+
+    @staticmethod
+    def from_max_miller(max_miller, lattice=None):
+        '''Create the array of all hkl planes with Miller indices in [-max_miller, max_miller].
+
+        The (0, 0, 0) triplet is excluded and the planes are ordered like in
+        :py:func:`~pymicro.xray.laue.build_list` (h varies slowest).
+
+        :param int max_miller: the maximum absolute value of the Miller indices.
+        :param Lattice lattice: the crystal lattice, will default to cubic if not specified.
+        :returns: a new `HklPlaneArray` instance.
+        '''
+        n = 2 * max_miller + 1
+        hkl = np.mgrid[-max_miller:max_miller + 1, -max_miller:max_miller + 1, -max_miller:max_miller + 1]
+        hkl = hkl.reshape((3, n ** 3)).T
+        return HklPlaneArray(hkl[np.any(hkl != 0, axis=1)], lattice)
+
+    @staticmethod
+    def generate(lattice=None, max_miller=None, d_min=None, extinctions=True, first_order=False,
+                 include_friedel_pair=True):
+        '''Generate a list of reflections for the given crystal lattice.
+
+        The reflections are enumerated up to a maximum Miller index and/or
+        down to a minimum interplanar spacing. When d_min is given, the
+        bound on each Miller index is derived from the lattice parameters
+        (:math:`|h| \\leq a/d_{min}`) so that no reflection is missed.
+
+        The systematic absences due to the lattice centering (I, F, A, B or
+        C) can be removed and the list can be reduced to first order
+        reflections, see
+        :py:meth:`~pymicro.crystal.lattice.HklPlaneArray.first_order_mask`.
+
+        ::
+
+          al = Lattice.face_centered_cubic(0.405)
+          hkl = HklPlaneArray.generate(al, d_min=0.05, first_order=True)
+
+        :param Lattice lattice: the crystal lattice, will default to cubic if not specified.
+        :param int max_miller: the maximum absolute value of the Miller indices.
+        :param float d_min: the minimum interplanar spacing (same unit as the lattice).
+        :param bool extinctions: remove the reflections forbidden by the lattice centering (True by default).
+        :param bool first_order: retain only the first allowed order of each reflection (False by default).
+        :param bool include_friedel_pair: keep both (h, k, l) and (-h, -k, -l) (True by default).
+        :raise ValueError: if neither max_miller nor d_min is specified.
+        :returns: a new `HklPlaneArray` instance.
+        '''
+        if lattice == None:
+            lattice = Lattice.cubic(1.0)
+        if max_miller is None and d_min is None:
+            raise ValueError('max_miller or d_min must be specified to generate a reflection list')
+        bounds = np.array([max_miller] * 3 if max_miller is not None else [np.inf] * 3)
+        if d_min is not None:
+            bounds = np.minimum(bounds, np.floor(lattice._lengths / d_min))
+        (hm, km, lm) = bounds.astype(int)
+        hkl = np.mgrid[-hm:hm + 1, -km:km + 1, -lm:lm + 1].reshape((3, -1)).T
+        hkl = hkl[np.any(hkl != 0, axis=1)]
+        if not include_friedel_pair:
+            # keep the triplets with the first non zero index positive
+            first_nonzero = hkl[np.arange(len(hkl)), np.argmax(hkl != 0, axis=1)]
+            hkl = hkl[first_nonzero > 0]
+        planes = HklPlaneArray(hkl, lattice)
+        mask = np.ones(len(planes), dtype=bool)
+        if d_min is not None:
+            mask &= planes.interplanar_spacings() >= d_min
+        if extinctions:
+            mask &= planes.centering_mask()
+        if first_order:
+            mask &= planes.first_order_mask(extinctions)
+        return planes[mask]
+
+    @staticmethod
+    def centering_allowed(hkl, centering='P'):
+        '''Apply the reflection conditions associated with a lattice centering.
+
+        The conditions for the reflection to be allowed are:
+
+         * P: none
+         * I: h + k + l even
+         * F: h, k, l all even or all odd
+         * A: k + l even
+         * B: h + l even
+         * C: h + k even
+
+        :param hkl: an integer array of shape (N, 3) of Miller indices.
+        :param str centering: the lattice centering ('P' by default).
+        :raise ValueError: if the centering is not supported.
+        :returns: a boolean array of shape (N,), True where the reflection is allowed.
+        '''
+        hkl = np.asarray(hkl).reshape((-1, 3))
+        (h, k, l) = (hkl[:, 0], hkl[:, 1], hkl[:, 2])
+        if centering == 'P':
+            return np.ones(len(hkl), dtype=bool)
+        elif centering == 'I':
+            return (h + k + l) % 2 == 0
+        elif centering == 'F':
+            return ((h + k) % 2 == 0) & ((k + l) % 2 == 0)
+        elif centering == 'A':
+            return (k + l) % 2 == 0
+        elif centering == 'B':
+            return (h + l) % 2 == 0
+        elif centering == 'C':
+            return (h + k) % 2 == 0
+        raise ValueError('unsupported lattice centering: %s' % centering)
+
+    def centering_mask(self):
+        '''Compute the mask of the reflections allowed by the centering of the lattice.
+
+        See :py:meth:`~pymicro.crystal.lattice.HklPlaneArray.centering_allowed`.
+
+        :returns: a (N,) boolean numpy array.
+        '''
+        return HklPlaneArray.centering_allowed(self._hkl, self._lattice._centering)
+
+    def orders(self):
+        '''Compute the diffraction order of each reflection.
+
+        The order is the greatest common divisor of the three Miller
+        indices, for instance 2 for (2, 2, 0).
+
+        :returns: a (N,) integer numpy array.
+        '''
+        return _gcd(_gcd(self._hkl[:, 0], self._hkl[:, 1]), self._hkl[:, 2])
+
+    def first_order_mask(self, extinctions=True):
+        '''Compute the mask of the first order reflections.
+
+        A reflection (h, k, l) of order n is a higher order reflection if
+        there exist a divisor m > 1 of n such that (h/m, k/m, l/m) is a
+        reflection. When extinctions is True, only the allowed reflections
+        are considered as lower orders so that (2, 0, 0) is the first order
+        along [100] in a face centered cubic lattice.
+
+        :param bool extinctions: account for the lattice centering (True by default).
+        :returns: a (N,) boolean numpy array.
+        '''
+        n = self.orders()
+        mask = np.ones(len(self), dtype=bool)
+        for m in range(2, n.max() + 1):
+            divisible = (n % m == 0)
+            if not np.any(divisible):
+                continue
+            lower = self._hkl[divisible] // m
+            if extinctions:
+                mask[divisible] &= ~HklPlaneArray.centering_allowed(lower, self._lattice._centering)
+            else:
+                mask[divisible] = False
+        return mask
+
+    def zone_mask(self, uvw):
+        '''Compute which planes are in zone with the given crystallographic directions.
+
+        If (u, v, w) denotes the zone axis, the planes in zone verify
+        :math:`h.u + k.v + l.w = 0`.
+
+        :param uvw: the Miller indices of one or several zone axes (array of shape (3,) or (M, 3)).
+        :returns: a (M, N) boolean numpy array.
+        '''
+        uvw = np.asarray(uvw, dtype=int).reshape((-1, 3))
+        return np.dot(uvw, self._hkl.T) == 0
+
+    def lattice(self):
+        '''Returns the crystal lattice of this array of planes.'''
+        return self._lattice
+
+    def miller_indices(self):
+        '''Returns the (read only) (N, 3) array of the Miller indices.'''
+        return self._hkl
+
+    def to_list(self):
+        '''Convert this array into a list of :py:class:`~pymicro.crystal.lattice.HklPlane` objects.'''
+        return [HklPlane(int(h), int(k), int(l), self._lattice) for (h, k, l) in self._hkl]
+
+    def scattering_vectors(self):
+        '''Compute the scattering vectors of all the planes.
+
+        See :py:meth:`~pymicro.crystal.lattice.HklPlane.scattering_vector`.
+
+        :returns: a (N, 3) numpy array expressed in the cartesian coordinate system of the crystal.
+        '''
+        if self._scattering_vectors is None:
+            self._scattering_vectors = np.dot(self._hkl, self._lattice._get_reciprocal_matrix())
+            self._scattering_vectors.flags.writeable = False
+        return self._scattering_vectors
+
+    def normals(self):
+        '''Compute the unit vectors normal to all the planes.
+
+        :returns: a (N, 3) numpy array expressed in the cartesian coordinate system of the crystal.
+        '''
+        return self.scattering_vectors() * self.interplanar_spacings()[:, np.newaxis]
+
+    def interplanar_spacings(self):
+        '''Compute the interplanar spacings of all the planes.
+
+        See :py:meth:`~pymicro.crystal.lattice.HklPlane.interplanar_spacing`.
+
+        :returns: a (N,) numpy array in the unit of the lattice parameters.
+        '''
+        if self._spacings is None:
+            hkl = self._hkl.astype(np.float64)
+            inv_d2 = np.sum(np.dot(hkl, self._lattice._get_reciprocal_metric()) * hkl, axis=1)
+            self._spacings = 1. / np.sqrt(inv_d2)
+            self._spacings.flags.writeable = False
+        return self._spacings
+
+    def bragg_angles(self, lambda_keV):
+        '''Compute the Bragg angles of all the planes at the given energy.
+
+        Planes which cannot diffract at this energy (when
+        :math:`\\lambda > 2d`) are assigned a NaN value.
+
+        .. note::
+
+          For this calculation to work properly, the lattice spacing needs
+          to be in nm units.
+
+        :param lambda_keV: the X-ray energy in keV, either a scalar or an array broadcastable to (N,).
+        :returns: a (N,) numpy array of the Bragg angles in radians.
+        '''
+        lambda_nm = 1.2398 / np.asarray(lambda_keV, dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            theta = np.arcsin(lambda_nm / (2 * self.interplanar_spacings()))
+        return theta
+
+    def multiplicities(self, crystal_structure=None, include_friedel_pair=True):
+        '''Compute the multiplicity of each plane.
+
+        The multiplicity is the number of distinct planes obtained by
+        applying the symmetry operators of the crystal to a given plane. By
+        default, the Friedel pair (-h, -k, -l) is considered as a distinct
+        reflection so that the multiplicity of {100} planes in a cubic
+        crystal is 6.
+
+        :param str crystal_structure: the crystal structure used to get the
+            symmetry operators, guessed from the lattice parameters if None.
+        :param bool include_friedel_pair: count the Friedel pairs (True by default).
+        :returns: a (N,) integer numpy array.
+        '''
+        if crystal_structure is None:
+            crystal_structure = self._lattice.guess_crystal_structure()
+        sym = Lattice.symmetry(crystal_structure)
+        if include_friedel_pair:
+            sym = np.concatenate((sym, -sym), axis=0)
+        # express the symmetry operators acting on the Miller indices: hkl' = M.S.R^T.hkl
+        T = np.rint(np.einsum('ij,sjk,lk->sil', self._lattice._matrix, sym,
+                              self._lattice._get_reciprocal_matrix())).astype(int)
+        # the multiplicity is the order of the group divided by the order of the stabilizer of each plane
+        equivalents = np.dot(self._hkl, T.transpose((2, 0, 1)).reshape((3, -1))).reshape((-1, len(T), 3))
+        n_invariant = np.sum(np.all(equivalents == self._hkl[:, np.newaxis, :], axis=2), axis=1)
+        return len(T) // n_invariant
@@ -12,9 +12,14 @@ orientation:
  * :py:class:`~pymicro.crystal.microstructure.Orientation`
 """
 import numpy as np
-import os, vtk
-from matplotlib import pyplot as plt, colors, cm
+import os
 from xml.dom.minidom import Document, parse
+from pymicro.lazy import lazy_import
+
+vtk = lazy_import('vtk')
+plt = lazy_import('matplotlib.pyplot')
+colors = lazy_import('matplotlib.colors')
+cm = lazy_import('matplotlib.cm')
 
 
 class Orientation:
@@ -494,6 +499,19 @@ class Orientation:
         o = Orientation(g)
         return o
 
+    @staticmethod
+    def orientation_matrices(orientations):
+        '''Gather the orientation matrices of several orientations in a single array.
+
+        :param orientations: a list of :py:class:`~pymicro.crystal.microstructure.Orientation`
+            or :py:class:`~pymicro.crystal.microstructure.Grain` instances, or an array of
+            orientation matrices.
+        :returns: a (N, 3, 3) numpy array of the orientation matrices.
+        '''
+        if isinstance(orientations, np.ndarray):
+            return orientations.reshape((-1, 3, 3)).astype(np.float64)
+        return np.array([o.orientation_matrix() for o in orientations], dtype=np.float64).reshape((-1, 3, 3))
+
         # @staticmethod
         # def from_Zrot(axes):
         # g = Orientation.Zrot2OrientationMatrix()
@@ -505,8 +523,13 @@ class Orientation:
         '''
         Compute the orientation matrix associated with the 3 Euler angles
         (given in degrees).
+
+        The computation is vectorized: an array of Euler angles of shape
+        (N, 3) gives an array of N orientation matrices of shape (N, 3, 3),
+        which is much faster than creating N `Orientation` instances.
         '''
-        (rphi1, rPhi, rphi2) = np.radians(euler)
+        euler = np.radians(np.asarray(euler, dtype=np.float64))
+        (rphi1, rPhi, rphi2) = (euler[..., 0], euler[..., 1], euler[..., 2])
         c1 = np.cos(rphi1)
         s1 = np.sin(rphi1)
         c = np.cos(rPhi)
@@ -524,7 +547,9 @@ class Orientation:
         b31 = s1 * s
         b32 = -c1 * s
         b33 = c
-        B = np.array([[b11, b12, b13], [b21, b22, b23], [b31, b32, b33]])
+        B = np.stack((np.stack((b11, b12, b13), axis=-1),
+                      np.stack((b21, b22, b23), axis=-1),
+                      np.stack((b31, b32, b33), axis=-1)), axis=-2)
         return B
 
     @staticmethod
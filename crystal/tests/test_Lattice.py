@@ -1,6 +1,53 @@
 import unittest
 import numpy as np
-from pymicro.crystal.lattice import Lattice, HklObject, HklDirection, HklPlane, SlipSystem
+from pymicro.crystal.lattice import Crystal, Lattice, HklObject, HklDirection, HklPlane, HklPlaneArray, SlipSystem
+
+
+class CrystalTests(unittest.TestCase):
+    def setUp(self):
+        print('testing the Crystal class')
+        self.al = Crystal(Lattice.face_centered_cubic(0.40495), basis=[(0., 0., 0.)], basis_labels=['Al'])
+        self.si = Crystal(Lattice.face_centered_cubic(0.54310), basis=[(0., 0., 0.), (0.25, 0.25, 0.25)],
+                          basis_labels=['Si', 'Si'])
+
+    def test_basis_positions(self):
+        positions, labels = self.si.basis_positions()
+        self.assertEqual(positions.shape, (8, 3))
+        self.assertEqual(labels, 8 * ['Si'])
+
+    def test_structure_factors_fcc(self):
+        from pymicro.xray.xray_utils import atomic_scattering_factor
+        hkl = HklPlaneArray([[1, 1, 1], [1, 0, 0], [2, 0, 0]], self.al._lattice)
+        F2 = self.al.structure_factors(hkl)
+        f = atomic_scattering_factor('Al', 0.05 / hkl.interplanar_spacings()[0])
+        self.assertAlmostEqual(F2[0], (4 * f) ** 2)
+        self.assertAlmostEqual(F2[1], 0.)
+        self.assertTrue(F2[2] > 0.)
+        # the result is cached for the last sets of reflections only
+        self.assertTrue(self.al.structure_factors(hkl) is F2)
+        for h in range(1, Crystal.max_cached_structure_factors + 1):
+            self.al.structure_factors([[h, 1, 1]])
+        self.assertEqual(len(self.al._structure_factors), Crystal.max_cached_structure_factors)
+        self.assertFalse(self.al.structure_factors(hkl) is F2)
+        self.assertTrue(np.array_equal(self.al.structure_factors(hkl), F2))
+        # the Debye-Waller factor reduces the intensities
+        self.assertTrue(np.all(self.al.structure_factors(hkl, debye_waller=0.8)[[0, 2]] < F2[[0, 2]]))
+
+    def test_structure_factors_diamond(self):
+        from pymicro.xray.xray_utils import atomic_scattering_factor
+        hkl = HklPlaneArray([[1, 1, 1], [2, 0, 0], [2, 2, 0], [2, 2, 2]], self.si._lattice)
+        F2 = self.si.structure_factors(hkl)
+        f = atomic_scattering_factor('Si', 0.05 / hkl.interplanar_spacings())
+        self.assertAlmostEqual(F2[0], 32 * f[0] ** 2)
+        self.assertAlmostEqual(F2[1], 0.)
+        self.assertAlmostEqual(F2[2], 64 * f[2] ** 2)
+        self.assertAlmostEqual(F2[3], 0.)
+
+    def test_intensities(self):
+        hkl = HklPlaneArray([[1, 1, 1], [8, 8, 8]], self.al._lattice)
+        I = self.al.intensities(hkl, 20.)
+        self.assertTrue(I[0] > 0.)
+        self.assertEqual(I[1], 0.)  # lambda > 2d
 
 
 class LatticeTests(unittest.TestCase):
@@ -34,6 +81,21 @@ class LatticeTests(unittest.TestCase):
             self.assertAlmostEqual(al._lengths[i], 0.40495, 4)
             self.assertEqual(al._angles[i], 90.0)
 
+    def test_from_cif(self):
+        import os, shutil, tempfile
+        cache_dir = tempfile.mkdtemp()
+        os.environ['PYMICRO_CACHE_DIR'] = cache_dir
+        try:
+            cif_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'cif')
+            for symbol in ['Al', 'Ti', 'Ga']:
+                lattice = Lattice.from_cif(os.path.join(cif_dir, '%s.cif' % symbol))
+                # the precompiled parameters must match the content of the bundled files
+                self.assertEqual(lattice, Lattice.from_symbol(symbol))
+            self.assertTrue(os.path.exists(os.path.join(cache_dir, 'cif_parameters.json')))
+        finally:
+            del os.environ['PYMICRO_CACHE_DIR']
+            shutil.rmtree(cache_dir)
+
     def test_reciprocal_lattice(self):
         Mg2Si = Lattice.from_parameters(1.534, 0.405, 0.683, 90., 106., 90.)
         [astar, bstar, cstar] = Mg2Si.reciprocal_lattice()
@@ -101,6 +163,27 @@ class HklDirectionTests(unittest.TestCase):
         hkl_planes2 = HklObject.skip_higher_order(hkl_planes)
         self.assertEqual(len(hkl_planes2), 7)
 
+    def test_find_planes_in_zones(self):
+        zones = HklDirection.find_planes_in_zones([(3, 3, 1), (1, 0, 0)], max_miller=3)
+        self.assertEqual(len(zones[0]), 18)
+        self.assertEqual(len(zones[1]), 48)
+        self.assertEqual(zones[0].to_list(), HklDirection(3, 3, 1).find_planes_in_zone(max_miller=3))
+
+    def test_zone_table(self):
+        al = Lattice.face_centered_cubic(0.405)
+        table = HklDirection.zone_table(al, max_miller=3, max_uvw=2)
+        self.assertTrue((1, 1, 0) in table)
+        self.assertFalse((-1, -1, 0) in table)
+        self.assertFalse((2, 2, 0) in table)
+        hkl = table[(1, 1, 0)].miller_indices()
+        self.assertTrue(np.all(hkl.dot([1, 1, 0]) == 0))
+        self.assertTrue(np.all(table[(1, 1, 0)].centering_mask()))
+        # the cached table cannot be modified by the caller
+        del table[(1, 1, 0)]
+        other = HklDirection.zone_table(al, max_miller=3, max_uvw=2)
+        self.assertTrue((1, 1, 0) in other)
+        self.assertTrue(other[(1, 0, 0)] is table[(1, 0, 0)])
+
 
 class HklPlaneTests(unittest.TestCase):
     def setUp(self):
@@ -185,6 +268,51 @@ class HklPlaneTests(unittest.TestCase):
         self.assertAlmostEqual(hkl.bragg_angle(8), 0.5704164)
 
 
+class HklPlaneArrayTests(unittest.TestCase):
+    def setUp(self):
+        print('testing the HklPlaneArray class')
+
+    def test_from_max_miller(self):
+        hkl = HklPlaneArray.from_max_miller(3)
+        self.assertEqual(len(hkl), 7 ** 3 - 1)
+        self.assertEqual(hkl[0].miller_indices(), (-3, -3, -3))
+
+    def test_compare_with_HklPlane(self):
+        Mg2Si = Lattice.from_parameters(1.534, 0.405, 0.683, 90., 106., 90.)
+        hkl = HklPlaneArray.from_max_miller(2, Mg2Si)
+        d = hkl.interplanar_spacings()
+        Gc = hkl.scattering_vectors()
+        theta = hkl.bragg_angles(40.)
+        for i in range(len(hkl)):
+            p = hkl[i]
+            self.assertAlmostEqual(d[i], p.interplanar_spacing())
+            self.assertAlmostEqual(theta[i], p.bragg_angle(40.))
+            for j in range(3):
+                self.assertAlmostEqual(Gc[i, j], p.scattering_vector()[j])
+
+    def test_generate_fcc(self):
+        al = Lattice.face_centered_cubic(0.405)
+        hkl = HklPlaneArray.generate(al, max_miller=2, first_order=True)
+        families = set([tuple(sorted(np.abs(m))) for m in hkl.miller_indices()])
+        self.assertEqual(families, set([(0, 0, 2), (0, 2, 2), (1, 1, 1)]))
+        self.assertEqual(len(hkl), 6 + 12 + 8)
+        hkl = HklPlaneArray.generate(al, d_min=0.1)
+        self.assertTrue(np.all(hkl.interplanar_spacings() >= 0.1))
+        self.assertTrue(np.all(hkl.centering_mask()))
+
+    def test_first_order_mask(self):
+        hkl = HklPlaneArray([(1, 0, 0), (2, 0, 0), (3, 0, 0), (4, 0, 0), (2, 2, 2)], Lattice.body_centered_cubic(0.287))
+        self.assertListEqual(hkl.orders().tolist(), [1, 2, 3, 4, 2])
+        self.assertListEqual(hkl.first_order_mask().tolist(), [True, True, True, False, True])
+        self.assertListEqual(hkl.first_order_mask(extinctions=False).tolist(), [True, False, False, False, False])
+
+    def test_multiplicities(self):
+        hkl = HklPlaneArray([(1, 0, 0), (1, 1, 0), (1, 1, 1), (1, 1, 2), (1, 2, 3)], Lattice.cubic(0.405))
+        self.assertListEqual(hkl.multiplicities().tolist(), [6, 12, 8, 24, 48])
+        hkl = HklPlaneArray([(1, 0, 0), (0, 0, 1), (1, 0, 1)], Lattice.hexagonal(0.295, 0.468))
+        self.assertListEqual(hkl.multiplicities().tolist(), [6, 2, 12])
+
+
 class SlipSystemTests(unittest.TestCase):
     def setUp(self):
         print 'testing the SlipSystem class'
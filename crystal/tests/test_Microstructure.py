@@ -14,6 +14,13 @@ class OrientationTests(unittest.TestCase):
         self.assertAlmostEqual(o.phi1(), 45.)
         self.assertAlmostEqual(o.Phi(), 45.)
 
+    def test_Euler2OrientationMatrix_vectorized(self):
+        euler = np.array([[0., 0., 0.], [45., 30., 10.], [300., 120., 250.]])
+        g = Orientation.Euler2OrientationMatrix(euler)
+        self.assertEqual(g.shape, (3, 3, 3))
+        for i in range(3):
+            self.assertTrue(np.allclose(g[i], Orientation.from_euler(euler[i]).orientation_matrix()))
+
     def test_SchimdFactor(self):
         o = Orientation.from_euler([0., 0., 0.])
         ss = SlipSystem(HklPlane(1, 1, 1), HklDirection(0, 1, -1))
@@ -111,5 +118,27 @@ class OrientationTests(unittest.TestCase):
                 self.assertAlmostEqual(col[i], target[i])
 
 
+class ImportTests(unittest.TestCase):
+    def setUp(self):
+        print 'testing the import of the microstructure module'
+
+    def test_import_time(self):
+        """Import the microstructure module in a fresh interpreter and check it stays fast.
+
+        The time budget (in seconds) can be adjusted with the PYMICRO_IMPORT_BUDGET environment variable.
+        """
+        import os, subprocess, sys
+        budget = float(os.environ.get('PYMICRO_IMPORT_BUDGET', 1.0))
+        code = '; '.join(['import sys, time',
+                          't = time.time()',
+                          'import pymicro.crystal.microstructure',
+                          'print(time.time() - t)',
+                          'print(int(\'vtk\' in sys.modules or \'matplotlib.pyplot\' in sys.modules))'])
+        out = subprocess.check_output([sys.executable, '-c', code]).split()
+        self.assertLess(float(out[-2]), budget)
+        # heavy dependencies must not be loaded at import
+        self.assertEqual(int(out[-1]), 0)
+
+
 if __name__ == '__main__':
     unittest.main()
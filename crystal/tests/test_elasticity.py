@@ -0,0 +1,99 @@
+import unittest
+import numpy as np
+from pymicro.crystal.microstructure import Orientation, Microstructure
+from pymicro.crystal.elasticity import ElasticTensor
+
+
+def random_euler(n, seed=13):
+    np.random.seed(seed)
+    u = np.random.rand(n, 3)
+    return np.column_stack((360. * u[:, 0], np.degrees(np.arccos(2 * u[:, 1] - 1)), 360. * u[:, 2]))
+
+
+class ElasticTensorTests(unittest.TestCase):
+    def setUp(self):
+        print 'testing the elasticity module'
+        self.ni = ElasticTensor.cubic(249., 155., 114.)
+        self.ti = ElasticTensor.hexagonal(162., 92., 69., 180., 46.7)
+
+    def test_cubic_young_modulus(self):
+        (s11, s12, s44) = self.ni.compliance()[[0, 0, 3], [0, 1, 3]]
+        n = np.array([[1., 0., 0.], [1., 1., 0.], [1., 1., 1.], [1., 2., 3.]])
+        n = n / np.linalg.norm(n, axis=1)[:, np.newaxis]
+        J = (n[:, 0] * n[:, 1]) ** 2 + (n[:, 1] * n[:, 2]) ** 2 + (n[:, 0] * n[:, 2]) ** 2
+        E = 1. / (s11 - (2 * (s11 - s12) - s44) * J)
+        self.assertTrue(np.allclose(self.ni.young_modulus(n), E))
+        self.assertAlmostEqual(self.ni.young_modulus([0., 0., 1.])[0], 1. / s11)
+
+    def test_mandel(self):
+        C_M = self.ni.stiffness('mandel')
+        S_M = self.ni.compliance('mandel')
+        self.assertTrue(np.allclose(np.dot(C_M, S_M), np.eye(6)))
+        self.assertAlmostEqual(C_M[3, 3], 2 * 114.)
+
+    def test_isotropic_invariance(self):
+        iso = ElasticTensor.isotropic(200., 0.3)
+        euler = random_euler(20)
+        C = iso.rotated_stiffness(euler)
+        self.assertTrue(np.allclose(C, iso.stiffness()))
+        self.assertTrue(np.allclose(iso.young_modulus([[1., 2., 3.], [0., 0., 1.]], euler), 200.))
+        self.assertTrue(np.allclose(iso.hill_average(euler), iso.stiffness()))
+
+    def test_hexagonal_invariance(self):
+        # rotations about the c axis leave a hexagonal tensor unchanged
+        euler = np.column_stack((np.linspace(0., 360., 13), np.zeros(13), np.zeros(13)))
+        C = self.ti.rotated_stiffness(euler)
+        self.assertTrue(np.allclose(C, self.ti.stiffness()))
+        C = self.ti.rotated_stiffness(Orientation.from_euler([0., 90., 0.]))
+        self.assertAlmostEqual(C[0, 1, 1], 180.)
+
+    def test_single_orientation_matrix(self):
+        # a (3, 3) array is a single orientation matrix and not three sets of Euler angles
+        C = self.ti.rotated_stiffness(np.eye(3))
+        self.assertEqual(C.shape, (1, 6, 6))
+        self.assertTrue(np.allclose(C[0], self.ti.stiffness()))
+        o = Orientation.from_euler([10., 50., 70.])
+        self.assertTrue(np.allclose(self.ti.rotated_stiffness(o.orientation_matrix()), self.ti.rotated_stiffness(o)))
+
+    def test_rotated_young_modulus(self):
+        # the Young's modulus along X of a crystal is the one along the crystal direction g.X
+        euler = random_euler(10)
+        g = Orientation.Euler2OrientationMatrix(euler)
+        E = self.ni.young_modulus([1., 0., 0.], euler)[:, 0]
+        self.assertTrue(np.allclose(E, self.ni.young_modulus(g[:, :, 0])))
+
+    def test_averages(self):
+        euler = random_euler(20000)
+        C_V = self.ni.voigt_average(euler, chunk_size=3000)
+        C_R = self.ni.reuss_average(euler, chunk_size=3000)
+        C_H = self.ni.hill_average(euler)
+        # Voigt >= Hill >= Reuss (in the sense of quadratic forms)
+        self.assertTrue(np.all(np.linalg.eigvalsh(C_V - C_H) > -1e-9))
+        self.assertTrue(np.all(np.linalg.eigvalsh(C_H - C_R) > -1e-9))
+        # a random texture tends to the isotropic bounds
+        for (C, method) in [(C_V, 'voigt'), (C_R, 'reuss')]:
+            (K, G) = self.ni.isotropic_moduli(method)
+            self.assertAlmostEqual(C[0, 0] / (K + 4. * G / 3), 1., 2)
+            self.assertAlmostEqual(C[3, 3] / G, 1., 2)
+            self.assertAlmostEqual(C[0, 1] / (K - 2. * G / 3), 1., 2)
+        # the bulk modulus of a cubic crystal does not depend on the texture
+        self.assertAlmostEqual(np.sum(C_R[:3, :3]) / 9., (249. + 2 * 155.) / 3)
+
+    def test_microstructure_average(self):
+        micro = Microstructure.random_texture(n=10)
+        C = self.ti.voigt_average(micro)
+        self.assertTrue(np.allclose(C, np.mean(self.ti.rotated_stiffness(micro.grains), axis=0)))
+        # the grain volumes are used as weights when known
+        for i, grain in enumerate(micro.grains):
+            grain.volume = 1. if i == 0 else 1.e-12
+        C = self.ti.voigt_average(micro)
+        self.assertTrue(np.allclose(C, self.ti.rotated_stiffness(micro.grains[0])[0]))
+
+    def test_symmetric(self):
+        C = np.eye(6)
+        C[0, 1] = 1.
+        self.assertRaises(ValueError, ElasticTensor, C)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,11 @@
 import numpy as np
 from pymicro.crystal.lattice import Lattice, SlipSystem
 from pymicro.crystal.microstructure import Orientation, Grain, Microstructure
-from matplotlib import pyplot as plt, colors, cm
+from pymicro.lazy import lazy_import
+
+plt = lazy_import('matplotlib.pyplot')
+colors = lazy_import('matplotlib.colors')
+cm = lazy_import('matplotlib.cm')
 
 
 class PoleFigure:
@@ -1,6 +1,7 @@
 from mpl_toolkits.mplot3d import Axes3D
 from matplotlib import pyplot as plt, cm
 import os, numpy as np
+from pymicro.crystal.elasticity import ElasticTensor
 
 print 'plotting hexagonal elasticity...'
 fig = plt.figure(figsize=(8, 8))
@@ -13,36 +14,24 @@ c12 = 92000.
 c13 = 69000.
 c33 = 180000.
 c44 = 46700.
-c66 = 0.5 * (c11 - c12)
-s11 = (-c13 ** 2 + c11 * c33) / ((c11 - c12) * (-2 * c13 ** 2 + (c11 + c12) * c33))
-s12 = (c13 ** 2 - c12 * c33) / ((c11 - c12) * (-2 * c13 ** 2 + (c11 + c12) * c33))
-s13 = c13 / (2 * c13 ** 2 - (c11 + c12) * c33)
-s33 = (c11 + c12) / (-2 * c13 ** 2 + (c11 + c12) * c33)
-s44 = 1. / c44
-s66 = 2 * (s11 - s12)
-print 'elastic stiffness s11 =', s11
-print 'elastic stiffness s12 =', s12
-print 'elastic stiffness s13 =', s13
-print 'elastic stiffness s33 =', s33
-print 'elastic stiffness s44 =', s44
-print 'elastic stiffness s66 =', s66
+elasticity = ElasticTensor.hexagonal(c11, c12, c13, c33, c44)
+S = elasticity.compliance()
+print 'elastic compliance s11 =', S[0, 0]
+print 'elastic compliance s12 =', S[0, 1]
+print 'elastic compliance s13 =', S[0, 2]
+print 'elastic compliance s33 =', S[2, 2]
+print 'elastic compliance s44 =', S[3, 3]
+print 'elastic compliance s66 =', S[5, 5]
 
-# theta = np.linspace(0, np.pi*2, 46)
-# phi = np.linspace(-np.pi*2, np.pi/2, 91)
-theta = np.linspace(0, np.pi * 2, 181)
-phi = np.linspace(-np.pi * 2, np.pi / 2, 361)
-theta, phi = np.meshgrid(theta, phi)
+# directional Young's modulus in GPa
+theta, phi, rho = elasticity.young_modulus_map(n_azimuth=181, n_polar=181)
+theta = np.radians(theta)
+phi = np.radians(phi)
+rho = 0.001 * rho
 
-n1 = np.cos(theta) * np.sin(phi)
-n2 = np.sin(theta) * np.sin(phi)
-n3 = np.cos(phi)
-
-rho = s11 - ((s11 - s33) * n3 ** 2 + (2 * s11 - 2 * s13 - s44) * (n1 ** 2 + n2 ** 2)) * n3 ** 2
-rho = 0.001 / rho;
-
-x = rho * np.sin(phi) * np.cos(theta);
-y = rho * np.sin(phi) * np.sin(theta);
-z = rho * np.cos(phi);
+x = rho * np.sin(phi) * np.cos(theta)
+y = rho * np.sin(phi) * np.sin(theta)
+z = rho * np.cos(phi)
 
 ax.plot_surface(x, y, z, rstride=2, cstride=2, cmap=cm.jet, \
                 linewidth=0.5, antialiased=True)
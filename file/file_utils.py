@@ -3,6 +3,26 @@ import numpy as np
 import struct
 
 
+def get_cache_dir(create=True):
+    '''Get the directory used by pymicro to cache data on the disk.
+
+    The directory can be set with the `PYMICRO_CACHE_DIR` environment
+    variable and defaults to `~/.cache/pymicro`.
+
+    :param bool create: create the directory if it does not exist (True by default).
+    :returns str: the path to the cache directory.
+    '''
+    cache_dir = os.environ.get('PYMICRO_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'pymicro'))
+    if create and not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # the directory may have been created concurrently
+            if not os.path.isdir(cache_dir):
+                raise
+    return cache_dir
+
+
 def read_image_sequence(data_dir, prefix, num_images, start_index=0, image_format='png', zero_padding=0, crop=None, verbose=False):
     # build the numbering pattern
     pat = '0%dd' % zero_padding
@@ -280,6 +300,200 @@ def HST_read(scan_name, zrange=None, data_type=np.uint8, verbose=False,
     return data_xyz
 
 
+class HDF5FrameSource(object):
+    '''Lazy access to a stack of detector frames stored in a HDF5 (or NeXus) file.
+
+    The frames are read from the disk only when needed, so that scans
+    larger than the memory can be processed. The first axis of the dataset
+    is the frame index. The source can be indexed like a numpy array,
+    iterated frame by frame or chunk by chunk, and reduced over the frames
+    (median, mean, max...) slab by slab within a memory limit::
+
+      with HDF5FrameSource('scan_138.nxs', '/root_1/scan_data/data_02') as frames:
+          print(frames.shape)
+          first = frames[0]
+          for start, chunk in frames.iter_chunks():
+              process(chunk)
+          median = frames.median()
+
+    .. note::
+
+      The h5py package is needed to read the HDF5 files.
+    '''
+
+    def __init__(self, file_path, dataset_path=None, memory_limit=256):
+        '''Open a stack of frames.
+
+        :param file_path: the path to the HDF5 file or an open h5py File instance (which is closed with the source).
+        :param str dataset_path: the path of the dataset in the file; if None, the largest dataset with 3 dimensions
+            is used.
+        :param float memory_limit: the maximum amount of memory in MB used to read the frames (256 by default).
+        '''
+        import h5py
+        if isinstance(file_path, h5py.File):
+            self.h5file = file_path
+            self.file_path = file_path.filename
+        else:
+            self.file_path = file_path
+            self.h5file = h5py.File(file_path, 'r')
+        try:
+            if dataset_path is None:
+                dataset_path = HDF5FrameSource.find_frames(self.h5file)
+                if dataset_path is None:
+                    raise ValueError('no 3D dataset found in file %s' % self.file_path)
+            self.dataset_path = dataset_path
+            self.dataset = self.h5file[dataset_path]
+            if self.dataset.ndim != 3:
+                raise ValueError('dataset %s must have 3 dimensions, got shape %s' % (dataset_path, self.dataset.shape))
+        except:
+            # do not leave the file open if it was opened here
+            if not isinstance(file_path, h5py.File):
+                self.h5file.close()
+            raise
+        self.memory_limit = memory_limit
+
+    @staticmethod
+    def find_frames(h5file):
+        '''Find the path of the largest dataset with 3 dimensions in a HDF5 file.
+
+        :param h5file: an open h5py File instance.
+        :returns str: the path of the dataset or None if the file does not contain any 3D dataset.
+        '''
+        candidates = []
+
+        def visit(name, node):
+            if hasattr(node, 'shape') and len(node.shape) == 3:
+                candidates.append((np.prod(node.shape), name))
+
+        h5file.visititems(visit)
+        if not candidates:
+            return None
+        return '/' + max(candidates)[1]
+
+    @property
+    def shape(self):
+        return self.dataset.shape
+
+    @property
+    def dtype(self):
+        return self.dataset.dtype
+
+    @property
+    def frame_shape(self):
+        return self.dataset.shape[1:]
+
+    def __len__(self):
+        return self.dataset.shape[0]
+
+    def __getitem__(self, index):
+        '''Read some frames (or part of frames) from the file.
+
+        Integers, slices and tuples of those are passed directly to h5py.
+        Arrays of frame indices can be given in any order.
+        '''
+        if isinstance(index, (list, np.ndarray)):
+            # h5py needs increasing indices
+            index = np.asarray(index)
+            (unique, inverse) = np.unique(index, return_inverse=True)
+            return self.dataset[list(unique)][inverse]
+        return self.dataset[index]
+
+    def __iter__(self):
+        for (start, chunk) in self.iter_chunks():
+            for frame in chunk:
+                yield frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        '''Close the HDF5 file.'''
+        self.h5file.close()
+
+    def reopen(self):
+        '''Open again the HDF5 file of a closed source.'''
+        import h5py
+        self.h5file = h5py.File(self.file_path, 'r')
+        self.dataset = self.h5file[self.dataset_path]
+
+    def chunk_size(self, memory_limit=None, item_size=None):
+        '''Return the number of frames which can be read at once within the memory limit.
+
+        :param float memory_limit: the memory limit in MB (the one of the instance by default).
+        :param int item_size: the size in bytes of a value (the size of the dataset type by default).
+        :returns int: the number of frames (at least 1).
+        '''
+        if memory_limit is None:
+            memory_limit = self.memory_limit
+        if item_size is None:
+            item_size = self.dtype.itemsize
+        frame_bytes = np.prod(self.frame_shape) * item_size
+        return int(max(1, min(len(self), memory_limit * 1024 ** 2 // frame_bytes)))
+
+    def iter_chunks(self, chunk_size=None, start=0, stop=None):
+        '''Iterate over the frames by chunks.
+
+        :param int chunk_size: the number of frames in each chunk (determined by the memory limit by default).
+        :param int start: the index of the first frame (0 by default).
+        :param int stop: the index after the last frame (the number of frames by default).
+        :returns: a generator of tuples (index of the first frame, array of the frames in the chunk).
+        '''
+        if chunk_size is None:
+            chunk_size = self.chunk_size()
+        if stop is None:
+            stop = len(self)
+        for i in range(start, stop, chunk_size):
+            yield i, self.dataset[i:min(i + chunk_size, stop)]
+
+    def reduce(self, operation='mean', memory_limit=None):
+        '''Reduce the stack of frames along the frame axis, without loading the whole stack.
+
+        The mean, sum, min and max are accumulated chunk of frames by chunk of
+        frames. The median needs all the values of each pixel so it is
+        computed by slabs of the frames (all the frames for a range of rows).
+
+        :param str operation: one of 'mean', 'sum', 'min', 'max' or 'median' ('mean' by default).
+        :param float memory_limit: the memory limit in MB (the one of the instance by default).
+        :returns: the reduced frame.
+        '''
+        if operation == 'median':
+            # the values are converted to float64 to compute the median
+            rows_per_slab = self.chunk_size(memory_limit, item_size=8) * self.frame_shape[0] // len(self)
+            rows_per_slab = max(1, rows_per_slab)
+            result = np.empty(self.frame_shape, dtype=np.float64)
+            for r in range(0, self.frame_shape[0], rows_per_slab):
+                result[r:r + rows_per_slab] = np.median(self.dataset[:, r:r + rows_per_slab], axis=0)
+            return result
+        reductions = {'mean': np.sum, 'sum': np.sum, 'min': np.min, 'max': np.max}
+        if operation not in reductions:
+            raise ValueError('unknown operation %s, use one of mean, sum, min, max or median' % operation)
+        func = reductions[operation]
+        result = None
+        for (start, chunk) in self.iter_chunks(self.chunk_size(memory_limit)):
+            if operation in ['mean', 'sum']:
+                chunk = chunk.astype(np.float64)
+            partial = func(chunk, axis=0)
+            result = partial if result is None else func([result, partial], axis=0)
+        if operation == 'mean':
+            result /= len(self)
+        return result
+
+    def median(self, memory_limit=None):
+        '''Compute the median frame (see :py:meth:`reduce`).'''
+        return self.reduce('median', memory_limit)
+
+    def mean(self, memory_limit=None):
+        '''Compute the mean frame (see :py:meth:`reduce`).'''
+        return self.reduce('mean', memory_limit)
+
+    def max(self, memory_limit=None):
+        '''Compute the maximum frame (see :py:meth:`reduce`).'''
+        return self.reduce('max', memory_limit)
+
+
 def rawmar_read(image_name, size, verbose=False):
     '''Read a square 2D image plate MAR image.
 
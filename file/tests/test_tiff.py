@@ -34,6 +34,53 @@ class file_utils_Tests(unittest.TestCase):
         os.remove('temp_20x30x10_uint8.raw.info')
 
 
+class HDF5FrameSourceTests(unittest.TestCase):
+    def setUp(self):
+        print 'testing the HDF5FrameSource class'
+        import h5py
+        self.frames = (1000 * np.random.rand(30, 40, 50)).astype(np.float32)
+        f = h5py.File('temp_frames.h5', 'w')
+        f.create_dataset('/entry/scan_data/data_02', data=self.frames)
+        f.create_dataset('/entry/scan_data/small', data=np.zeros((2, 3, 4)))
+        f.create_dataset('/entry/delta', data=np.arange(30))
+        f.close()
+
+    def test_frames(self):
+        with HDF5FrameSource('temp_frames.h5') as source:
+            # the largest 3d dataset is used by default
+            self.assertEqual(source.dataset_path, '/entry/scan_data/data_02')
+            self.assertEqual(len(source), 30)
+            self.assertEqual(source.frame_shape, (40, 50))
+            np.testing.assert_array_equal(source[3], self.frames[3])
+            np.testing.assert_array_equal(source[[7, 2, 7]], self.frames[[7, 2, 7]])
+            self.assertEqual(len(list(source)), 30)
+            # the frames are read by chunks fitting in the memory limit
+            chunks = list(source.iter_chunks(chunk_size=7))
+            self.assertEqual([start for (start, block) in chunks], [0, 7, 14, 21, 28])
+            np.testing.assert_array_equal(np.concatenate([block for (start, block) in chunks]), self.frames)
+            self.assertEqual(source.chunk_size(memory_limit=0.05), 6)
+
+    def test_reduce(self):
+        source = HDF5FrameSource('temp_frames.h5', '/entry/scan_data/data_02', memory_limit=0.05)
+        self.assertTrue(np.allclose(source.mean(), self.frames.mean(axis=0)))
+        self.assertTrue(np.allclose(source.median(), np.median(self.frames, axis=0)))
+        np.testing.assert_array_equal(source.max(), self.frames.max(axis=0))
+        self.assertRaises(ValueError, source.reduce, 'std')
+        source.close()
+        self.assertRaises(ValueError, HDF5FrameSource, 'temp_frames.h5', '/entry/delta')
+        # the file opened by the constructor is closed on error, otherwise it could not be truncated
+        import h5py
+        h5py.File('temp_frames.h5', 'w').close()
+        # an open file given to the constructor is left to the caller on error
+        f = h5py.File('temp_frames.h5', 'r')
+        self.assertRaises(ValueError, HDF5FrameSource, f)
+        self.assertTrue(bool(f.id.valid))
+        f.close()
+
+    def tearDown(self):
+        os.remove('temp_frames.h5')
+
+
 class TiffTests(unittest.TestCase):
     def setUp(self):
         print 'testing the Tifffile module'
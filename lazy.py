@@ -0,0 +1,62 @@
+"""The lazy module provides a way to defer the import of heavy dependencies.
+
+Modules like vtk, matplotlib.pyplot or scipy.ndimage take a significant
+time to import while they are only needed by a few functions. Instead of
+importing them at the top of a module, a lazy module can be bound to the
+same name::
+
+  from pymicro.lazy import lazy_import
+  plt = lazy_import('matplotlib.pyplot')
+
+The actual import happens the first time an attribute of the module is
+accessed (for instance when calling ``plt.figure()``), so the rest of the
+code does not need to be modified.
+"""
+import importlib
+
+
+class LazyModule(object):
+    '''A proxy object standing for a module which is imported on first use.'''
+
+    def __init__(self, name):
+        '''Create a new lazy module.
+
+        :param str name: the fully qualified name of the module (eg 'matplotlib.pyplot').
+        '''
+        # bypass __setattr__ which would trigger the import
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        '''Import the module if needed and return it.'''
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        if self._module is None:
+            return "<lazy module '%s' (not loaded)>" % self._name
+        return repr(self._module)
+
+
+def lazy_import(name):
+    '''Create a lazy module for the given module name.
+
+    If the module has already been imported, it is returned directly.
+
+    :param str name: the fully qualified name of the module.
+    :returns: the module or a :py:class:`~pymicro.lazy.LazyModule` instance.
+    '''
+    import sys
+    if sys.modules.get(name) is not None:
+        return sys.modules[name]
+    return LazyModule(name)
@@ -0,0 +1,94 @@
+"""The parallel module provides helpers to process large data sets by chunks, possibly with a pool of processes.
+
+The work is split into contiguous chunks of items (frames, orientations,
+profiles...). The data shared by all the chunks (the state) is set up once
+in each process by an initializer function which stores it in a module
+level dictionary, so that it is sent to the worker processes only once::
+
+  _my_state = {}
+
+  def _init_my_state(state):
+      _my_state.clear()
+      _my_state.update(state)
+
+  def _my_chunk(indices):
+      return _my_state['data'][indices[0]:indices[-1] + 1].sum(axis=0)
+
+  chunks = chunk_ranges(len(data), n_processes=4)
+  results = map_chunks(_my_chunk, chunks, {'data': data}, _init_my_state, _my_state.clear, n_processes=4)
+"""
+import numpy as np
+
+
+def chunk_ranges(n_items, n_processes=1, chunk_size=None, max_chunk_size=None, multiple=None):
+    '''Split a number of items into contiguous chunks.
+
+    By default, the chunk size is chosen to have 4 chunks per process, which
+    balances the load between the processes while keeping the chunks large.
+
+    :param int n_items: the number of items to process.
+    :param int n_processes: the number of processes (1 by default).
+    :param int chunk_size: the number of items in each chunk (automatic by default).
+    :param int max_chunk_size: the maximum size of the automatic chunks, typically to limit the memory used by a task.
+    :param int multiple: if given, the chunk size is rounded up to a multiple of this value.
+    :returns: a list of ranges of item indices.
+    '''
+    if chunk_size is None:
+        chunk_size = int(np.ceil(n_items / (4. * n_processes)))
+        if max_chunk_size is not None:
+            chunk_size = min(chunk_size, max_chunk_size)
+    chunk_size = max(1, chunk_size)
+    if multiple is not None:
+        chunk_size = multiple * int(np.ceil(float(chunk_size) / multiple))
+    return [range(i, min(i + chunk_size, n_items)) for i in range(0, n_items, chunk_size)]
+
+
+def map_chunks(function, chunks, state, initializer, finalizer=None, n_processes=1, message=None):
+    '''Apply a function to a list of chunks, possibly with a pool of processes.
+
+    With a pool, `initializer(state)` is called once in each worker process
+    and the processes are terminated if the processing of a chunk fails.
+    Otherwise, the chunks are processed in the current process and
+    `finalizer()` is always called at the end to release the state, even if
+    an exception is raised.
+
+    .. note::
+
+      The state is copied to the worker processes, it must not contain open
+      file handles (pass the file paths and open the files in the
+      initializer instead).
+
+    :param function: the module level function applied to each chunk.
+    :param list chunks: the list of chunks (see :py:func:`chunk_ranges`).
+    :param dict state: the data shared by all the chunks.
+    :param initializer: the module level function setting up the state.
+    :param finalizer: an optional function releasing the state in the current process.
+    :param int n_processes: the number of processes to use (1 by default).
+    :param str message: an optional message printed before processing each chunk in the current process, formatted
+        with the first and last items of the chunk.
+    :returns: the list of the results of each chunk.
+    '''
+    if n_processes > 1:
+        from multiprocessing import Pool
+        pool = Pool(n_processes, initializer=initializer, initargs=(state,))
+        try:
+            results = pool.map(function, chunks)
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+        return results
+    initializer(state)
+    try:
+        results = []
+        for chunk in chunks:
+            if message is not None:
+                print(message % (chunk[0], chunk[-1]))
+            results.append(function(chunk))
+    finally:
+        if finalizer is not None:
+            finalizer()
+    return results
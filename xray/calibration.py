@@ -0,0 +1,300 @@
+"""The calibration module allows to refine the geometry of a flat detector from a powder diffraction pattern.
+
+A standard powder (CeO2, LaB6 or Si) is imaged on the detector, the Debye-Scherrer rings are located on the image
+and the detector parameters (distance, beam center and tilts) are adjusted so that the scattering angle of each ring
+point matches the Bragg angle of the corresponding reflection::
+
+  detector = RegArrayDetector2d(size=(2048, 2048))
+  detector.pixel_size = 0.1
+  detector.ref_pos = np.array([150., 0., 0.])  # approximate geometry
+  detector.ucen, detector.vcen = 1020, 1030
+  points, residuals = calibrate(detector, image, 'CeO2', lambda_keV=30.)
+
+The sample is assumed to be at the origin of the laboratory frame and the X-ray beam along the X axis. After the
+calibration, the detector reference pixel (ucen, vcen) is the beam center, `ref_pos` is the point where the direct
+beam hits the detector and the detector tilts are refined around the Y and Z axes (a tilt around the beam axis does
+not change the scattering angles and is left untouched).
+"""
+import numpy as np
+from pymicro.crystal.lattice import Lattice, Crystal, HklPlaneArray
+from pymicro.lazy import lazy_import
+
+optimize = lazy_import('scipy.optimize')
+
+# lattice parameter (nm), lattice centering and basis (fractional coordinates and atom labels) of the calibrants
+calibrants = {'CeO2': (0.541165, 'F', [(0., 0., 0.), (0.25, 0.25, 0.25), (0.75, 0.75, 0.75)], ['Ce', 'O', 'O']),
+              'LaB6': (0.415692, 'P', [(0., 0., 0.), (0.1996, 0.5, 0.5), (0.8004, 0.5, 0.5), (0.5, 0.1996, 0.5),
+                                       (0.5, 0.8004, 0.5), (0.5, 0.5, 0.1996), (0.5, 0.5, 0.8004)],
+                       ['La', 'B', 'B', 'B', 'B', 'B', 'B']),
+              'Si': (0.543102, 'F', [(0., 0., 0.), (0.25, 0.25, 0.25)], ['Si', 'Si']),
+              }
+
+
+def calibrant_crystal(name):
+    '''Create the crystal structure of a powder calibrant.
+
+    :param str name: the name of the calibrant, one of 'CeO2', 'LaB6' or 'Si'.
+    :raise ValueError: if the calibrant is unknown.
+    :returns: a :py:class:`~pymicro.crystal.lattice.Crystal` instance.
+    '''
+    if name not in calibrants:
+        raise ValueError('unknown calibrant %s, choose among %s' % (name, ', '.join(sorted(calibrants.keys()))))
+    (a, centering, basis, labels) = calibrants[name]
+    lattice = Lattice.from_parameters(a, a, a, 90, 90, 90, centering)
+    return Crystal(lattice, basis=basis, basis_labels=labels)
+
+
+def calibrant_d_spacings(name, d_min=0.08, rel_tol=1.e-6):
+    '''Compute the interplanar spacings of the rings of a powder calibrant.
+
+    The reflections with a vanishing structure factor (for instance (200) for
+    silicon) are removed and the reflections sharing the same spacing are
+    merged into a single ring.
+
+    :param str name: the name of the calibrant, one of 'CeO2', 'LaB6' or 'Si'.
+    :param float d_min: the minimum interplanar spacing in nm (0.08 by default).
+    :param float rel_tol: the relative tolerance on the structure factors and on the spacings.
+    :returns: a numpy array of the spacings of the rings in nm, by decreasing order.
+    '''
+    crystal = calibrant_crystal(name)
+    hkl = HklPlaneArray.generate(crystal._lattice, d_min=d_min, include_friedel_pair=False)
+    F2 = crystal.structure_factors(hkl)
+    d = hkl.interplanar_spacings()[F2 > rel_tol * F2.max()]
+    d = np.sort(d)[::-1]
+    return d[np.r_[True, -np.diff(d) > rel_tol * d[1:]]]
+
+
+def ring_two_thetas(d_spacings, lambda_keV):
+    '''Compute the scattering angles of a series of rings.
+
+    :param d_spacings: the interplanar spacings of the rings in nm.
+    :param float lambda_keV: the X-ray energy in keV.
+    :returns: the scattering angles in degrees (the rings which cannot diffract at this energy are removed).
+    '''
+    lambda_nm = 1.2398 / lambda_keV
+    sin_theta = lambda_nm / (2 * np.asarray(d_spacings, dtype=float))
+    return 2 * np.degrees(np.arcsin(sin_theta[sin_theta <= 1.]))
+
+
+def scattering_angles(detector):
+    '''Compute the scattering and azimuthal angles of all the pixels of a detector.
+
+    The sample is at the origin of the laboratory frame and the beam is along
+    X. The pixel coordinates are obtained from the cached map of
+    :py:meth:`~pymicro.xray.detectors.RegArrayDetector2d.lab_coordinates`.
+
+    :param detector: a :py:class:`~pymicro.xray.detectors.RegArrayDetector2d` instance.
+    :returns tuple (two_theta, eta): two arrays of the detector size with the scattering angle and the azimuthal
+        angle (in the YZ plane, measured from Y) in degrees.
+    '''
+    xyz = detector.lab_coordinates()
+    rho = np.hypot(xyz[..., 1], xyz[..., 2])
+    two_theta = np.degrees(np.arctan2(rho, xyz[..., 0]))
+    eta = np.degrees(np.arctan2(xyz[..., 2], xyz[..., 1]))
+    return two_theta, eta
+
+
+def extract_ring_points(image, detector, two_thetas, tth_window=0.5, n_sectors=72, snr=5.):
+    '''Locate points on the Debye-Scherrer rings of a powder image.
+
+    The pixels closer than `tth_window` to one of the expected rings
+    (computed with the current detector geometry) are grouped by ring and
+    by azimuthal sector. In each group, the brightest pixel is retained if
+    its intensity stands out of the background and its position is refined
+    by the intensity weighted centroid of its 3x3 neighbourhood. All the
+    groups are processed at once with sorting and indexing operations.
+
+    The background and the noise level are estimated by the median and the
+    median absolute deviation of the image.
+
+    :param image: the powder image, with the shape of the detector.
+    :param detector: a :py:class:`~pymicro.xray.detectors.RegArrayDetector2d` instance.
+    :param two_thetas: the scattering angles of the rings in degrees.
+    :param float tth_window: the half width of the search window around each ring in degrees.
+    :param int n_sectors: the number of azimuthal sectors (72 by default, so one point every 5 degrees).
+    :param float snr: the minimum signal to noise ratio of a ring point.
+    :returns: a structured array with the sub-pixel coordinates ('uv'), the ring index ('ring'), the expected
+        scattering angle ('two_theta') and the intensity ('intensity') of each ring point.
+    '''
+    image = np.asarray(image, dtype=np.float64)
+    if image.shape != tuple(detector.size):
+        raise ValueError('image shape %s does not match the detector size %s' % (image.shape, detector.size))
+    rings = np.sort(np.asarray(two_thetas, dtype=float))
+    (tth, eta) = scattering_angles(detector)
+    (tth, eta, intensity) = (tth.ravel(), eta.ravel(), image.ravel())
+    # assign each pixel to the closest ring
+    k = np.searchsorted(0.5 * (rings[1:] + rings[:-1]), tth)
+    pixels = np.nonzero(np.abs(tth - rings[k]) < tth_window)[0]
+    sector = np.minimum(((eta[pixels] + 180.) * n_sectors / 360.).astype(int), n_sectors - 1)
+    group = k[pixels] * n_sectors + sector
+    # brightest pixel of each group
+    order = np.lexsort((intensity[pixels], group))
+    last = np.r_[np.nonzero(np.diff(group[order]))[0], len(order) - 1] if len(order) else np.array([], dtype=int)
+    best = pixels[order[last]]
+    bg = np.median(image)
+    sigma = max(1.4826 * np.median(np.abs(image - bg)), np.finfo(float).eps)
+    best = best[intensity[best] > bg + snr * sigma]
+    # sub-pixel position from the 3x3 neighbourhood (the pixels on the edges of the detector are discarded)
+    (u, v) = np.unravel_index(best, image.shape)
+    inside = (u > 0) & (u < image.shape[0] - 1) & (v > 0) & (v < image.shape[1] - 1)
+    (best, u, v) = (best[inside], u[inside], v[inside])
+    offsets = np.arange(-1, 2)
+    nu = u[:, np.newaxis, np.newaxis] + offsets[:, np.newaxis]
+    nv = v[:, np.newaxis, np.newaxis] + offsets
+    w = np.maximum(image[nu, nv] - bg, 0.)
+    points = np.zeros(len(best), dtype=[('uv', np.float64, 2), ('ring', np.int32), ('two_theta', np.float64),
+                                        ('intensity', np.float64)])
+    points['uv'][:, 0] = np.sum(w * nu, axis=(1, 2)) / np.sum(w, axis=(1, 2))
+    points['uv'][:, 1] = np.sum(w * nv, axis=(1, 2)) / np.sum(w, axis=(1, 2))
+    points['ring'] = k[best]
+    points['two_theta'] = rings[k[best]]
+    points['intensity'] = intensity[best]
+    return points
+
+
+def _tilt_matrices(tilts):
+    '''Return the three elementary rotation matrices of the detector tilts (in radians) and their derivatives.'''
+    (cx, cy, cz) = np.cos(tilts)
+    (sx, sy, sz) = np.sin(tilts)
+    Rx = np.array([[1., 0., 0.], [0., cx, -sx], [0., sx, cx]])
+    Ry = np.array([[cy, 0., sy], [0., 1., 0.], [-sy, 0., cy]])
+    Rz = np.array([[cz, -sz, 0.], [sz, cz, 0.], [0., 0., 1.]])
+    dRy = np.array([[-sy, 0., cy], [0., 0., 0.], [-cy, 0., -sy]])
+    dRz = np.array([[-sz, -cz, 0.], [cz, -sz, 0.], [0., 0., 0.]])
+    return Rx, Ry, Rz, dRy, dRz
+
+
+def fit_geometry(detector, uv, two_theta, fit_tilts=True, verbose=False):
+    '''Refine the detector geometry from a series of ring points.
+
+    The parameters are the distance D from the sample to the detector along
+    the beam, the beam center :math:`(u_0, v_0)` in pixels and the detector
+    tilts :math:`t_y, t_z` around the Y and Z axes. A ring point of pixel
+    coordinates (u, v) is located at:
+
+    .. math::
+
+      p = D\\,e_x + s\\left[(u - u_0)\\,R\\,u_{dir} + (v - v_0)\\,R\\,v_{dir}\\right]
+
+    with :math:`s` the pixel size and :math:`R = R_z R_y R_x` the tilt
+    matrix. The residuals are the differences between the scattering angles
+    :math:`2\\theta=\\arccos(p_x/|p|)` and the expected angles; they are
+    minimized by least squares with the analytic Jacobian:
+
+    .. math::
+
+      \\dfrac{\\partial 2\\theta}{\\partial p} = -\\dfrac{e_x - p_x\\,p/|p|^2}{\\sqrt{p_y^2 + p_z^2}}
+
+    The refined geometry is written back into the detector: `ref_pos` is set
+    to :math:`(D, 0, 0)`, the reference pixel to the beam center and the
+    tilts are updated.
+
+    :param detector: a :py:class:`~pymicro.xray.detectors.RegArrayDetector2d` instance with an approximate geometry.
+    :param uv: a (N, 2) array of the pixel coordinates of the ring points.
+    :param two_theta: a (N,) array of the expected scattering angles of the ring points in degrees.
+    :param bool fit_tilts: also refine the tilts (True by default).
+    :param bool verbose: activate verbose mode.
+    :returns: the (N,) array of the residuals in degrees.
+    '''
+    uv = np.asarray(uv, dtype=float)
+    target = np.radians(two_theta)
+    # initial parameters from the current geometry: the direct beam position
+    (u0, v0) = detector.lab_to_pixel(detector.project_along_direction((0., 0., 0.), (1., 0., 0.)))
+    distance = np.dot(detector.ref_pos, detector.w_dir) / detector.w_dir[0]
+    tilts = np.radians(detector.tilts)
+    x0 = np.array([distance, u0, v0, tilts[1], tilts[2]])
+    if not fit_tilts:
+        x0 = x0[:3]
+    (u_dir0, v_dir0) = (detector._u_dir0.astype(float), detector._v_dir0.astype(float))
+    s = detector.pixel_size
+
+    def geometry(x):
+        t = np.array([tilts[0], x[3], x[4]]) if fit_tilts else tilts
+        (Rx, Ry, Rz, dRy, dRz) = _tilt_matrices(t)
+        (du, dv) = (uv[:, 0] - x[1], uv[:, 1] - x[2])
+        (ud, vd) = (np.dot(Rz, np.dot(Ry, np.dot(Rx, u_dir0))), np.dot(Rz, np.dot(Ry, np.dot(Rx, v_dir0))))
+        p = s * (du[:, np.newaxis] * ud + dv[:, np.newaxis] * vd)
+        p[:, 0] += x[0]
+        return p, du, dv, ud, vd, (Rx, Ry, Rz, dRy, dRz)
+
+    def residuals(x):
+        p = geometry(x)[0]
+        return np.arctan2(np.hypot(p[:, 1], p[:, 2]), p[:, 0]) - target
+
+    def jacobian(x):
+        (p, du, dv, ud, vd, (Rx, Ry, Rz, dRy, dRz)) = geometry(x)
+        n2 = np.sum(p ** 2, axis=1)
+        rho = np.hypot(p[:, 1], p[:, 2])
+        # derivative of 2theta with respect to the position of the point
+        g = p * (p[:, 0] / n2)[:, np.newaxis]
+        g[:, 0] -= 1.
+        g /= rho[:, np.newaxis]
+        J = np.empty((len(p), len(x)))
+        J[:, 0] = g[:, 0]
+        J[:, 1] = -s * np.dot(g, ud)
+        J[:, 2] = -s * np.dot(g, vd)
+        if fit_tilts:
+            for j, dR in [(3, np.dot(Rz, np.dot(dRy, Rx))), (4, np.dot(dRz, np.dot(Ry, Rx)))]:
+                dp = s * (du[:, np.newaxis] * np.dot(dR, u_dir0) + dv[:, np.newaxis] * np.dot(dR, v_dir0))
+                J[:, j] = np.sum(g * dp, axis=1)
+        return J
+
+    if len(uv) < len(x0):
+        raise ValueError('not enough ring points (%d) to fit the detector geometry' % len(uv))
+    x = optimize.leastsq(residuals, x0, Dfun=jacobian)[0]
+    if verbose:
+        print('detector distance: %.3f, beam center: (%.2f, %.2f)' % tuple(x[:3]))
+    detector.ref_pos = np.array([x[0], 0., 0.])
+    (detector.ucen, detector.vcen) = (x[1], x[2])
+    if fit_tilts:
+        detector.set_tilts(np.degrees([tilts[0], x[3], x[4]]))
+        if verbose:
+            print('detector tilts: %s' % detector.tilts)
+    return np.degrees(residuals(x))
+
+
+def calibrate(detector, image, calibrant='CeO2', lambda_keV=None, d_spacings=None, n_iterations=3, tth_window=0.5,
+              n_sectors=72, snr=5., fit_tilts=True, verbose=False):
+    '''Calibrate the geometry of a detector with the image of a powder standard.
+
+    Each iteration extracts the ring points with the current geometry (see
+    :py:func:`extract_ring_points`), fits the geometry (see
+    :py:func:`fit_geometry`), then rejects the points with a residual larger
+    than 3 times the RMS residual and fits the geometry again. The search
+    window is reduced at each iteration as the geometry improves. The
+    detector must have an approximate initial geometry, accurate enough for
+    the rings to be found within the search window.
+
+    :param detector: a :py:class:`~pymicro.xray.detectors.RegArrayDetector2d` instance, its geometry is updated.
+    :param image: the powder image, with the shape of the detector.
+    :param str calibrant: the name of the calibrant ('CeO2' by default, see :py:data:`calibrants`).
+    :param float lambda_keV: the X-ray energy in keV.
+    :param d_spacings: the spacings of the rings in nm, to use a calibrant not listed in :py:data:`calibrants`.
+    :param int n_iterations: the number of extraction/fit iterations (3 by default).
+    :param float tth_window: the initial half width of the search window around each ring in degrees.
+    :param int n_sectors: the number of azimuthal sectors to extract ring points.
+    :param float snr: the minimum signal to noise ratio of a ring point.
+    :param bool fit_tilts: also refine the tilts (True by default).
+    :param bool verbose: activate verbose mode.
+    :raise ValueError: if the energy is not specified.
+    :returns tuple (points, residuals): the structured array of the ring points used in the last fit and their
+        residuals in degrees.
+    '''
+    if lambda_keV is None:
+        raise ValueError('the X-ray energy must be specified to calibrate the detector')
+    if d_spacings is None:
+        d_spacings = calibrant_d_spacings(calibrant)
+    two_thetas = ring_two_thetas(d_spacings, lambda_keV)
+    for i in range(n_iterations):
+        points = extract_ring_points(image, detector, two_thetas, tth_window=tth_window, n_sectors=n_sectors,
+                                     snr=snr)
+        residuals = fit_geometry(detector, points['uv'], points['two_theta'], fit_tilts=fit_tilts)
+        rms = np.sqrt(np.mean(residuals ** 2))
+        inliers = np.abs(residuals) <= 3 * rms
+        points = points[inliers]
+        residuals = fit_geometry(detector, points['uv'], points['two_theta'], fit_tilts=fit_tilts)
+        rms = np.sqrt(np.mean(residuals ** 2))
+        if verbose:
+            print('iteration %d: %d ring points, rms residual %.4f deg' % (i + 1, len(points), rms))
+        tth_window = max(0.5 * tth_window, 5 * rms)
+    return points, residuals
@@ -1,11 +1,15 @@
 import os
 import numpy as np
-from scipy import ndimage
-from skimage.transform import radon
-from matplotlib import pyplot as plt, cm
-from pymicro.crystal.microstructure import Grain
-from pymicro.crystal.lattice import HklPlane
-from pymicro.xray.xray_utils import lambda_keV_to_nm, radiograph
+from pymicro.crystal.microstructure import Orientation, Grain
+from pymicro.crystal.lattice import HklPlane, HklPlaneArray
+from pymicro.xray.xray_utils import lambda_keV_to_nm, radiograph, _projection_matrix
+from pymicro.file.file_utils import edf_write
+from pymicro.lazy import lazy_import
+from pymicro.parallel import chunk_ranges, map_chunks
+
+ndimage = lazy_import('scipy.ndimage')
+plt = lazy_import('matplotlib.pyplot')
+cm = lazy_import('matplotlib.cm')
 
 
 def dct_projection(orientations, data, dif_grains, omega, lambda_keV, detector, lattice, include_direct_beam=True,
@@ -58,43 +62,401 @@ def dct_projection(orientations, data, dif_grains, omega, lambda_keV, detector,
     return full_proj
 
 
+def dct_spot_table(orientations, hkl, lambda_keV, detector=None, positions=None, grain_ids=None):
+    """Compute the diffraction spots of a set of grains for a DCT scan.
+
+    For each grain and each reflection, the two rotation angles
+    :math:`\\omega_1` and :math:`\\omega_2` fulfilling the Bragg condition
+    are computed by solving the second order equation of
+    :py:meth:`~pymicro.crystal.microstructure.Orientation.dct_omega_angles`
+    for all grains and all reflections at once. The diffracted beam direction
+    :math:`\\mathbf{K}=\\mathbf{X}+\\mathbf{\\Omega}.\\mathbf{g}^{-1}\\mathbf{G_c}`
+    gives the azimuthal angle :math:`\\eta` (measured around the X axis from
+    Z towards -Y) and, if a detector is provided, the spot position on the
+    detector.
+
+    The result is a structured array with one row per (grain, reflection)
+    pair, ordered by grain, and the following fields:
+
+     * grain_id: the grain id;
+     * hkl: the Miller indices of the reflection;
+     * omega: the two rotation angles in degrees in [0, 360[;
+     * two_theta: the diffraction angle in degrees;
+     * eta: the two azimuthal angles in degrees in [0, 360[;
+     * uv: the two spot positions on the detector in pixels (NaN if no detector
+       is given or if the diffracted beam does not reach the detector plane);
+     * valid: False when the reflection cannot fulfil the Bragg condition (the
+       other fields are then set to NaN).
+
+    ::
+
+      hkl = HklPlaneArray.generate(Lattice.from_symbol('Ti'), max_miller=3)
+      spots = dct_spot_table(micro.grains, hkl, 40., detector=detector)
+      spots = spots[spots['valid']]
+
+    :param orientations: the grain orientations, a list of :py:class:`~pymicro.crystal.microstructure.Orientation`
+        or :py:class:`~pymicro.crystal.microstructure.Grain` instances or a (G, 3, 3) array of orientation matrices.
+    :param hkl: the reflections, an :py:class:`~pymicro.crystal.lattice.HklPlaneArray` instance.
+    :param float lambda_keV: the X-ray energy in keV.
+    :param detector: a :py:class:`~pymicro.xray.detectors.RegArrayDetector2d` instance to compute the spot positions.
+    :param positions: a (G, 3) array of the grain positions in mm (defaults to the position of the grains if
+        available, the origin otherwise).
+    :param grain_ids: a sequence of G grain ids (defaults to the id of the grains if available, their index otherwise).
+    :returns: a numpy structured array of length G x N.
+    """
+    if not isinstance(hkl, HklPlaneArray):
+        hkl = HklPlaneArray.from_list(hkl)
+    g = Orientation.orientation_matrices(orientations)
+    n_grains, n_hkl = len(g), len(hkl)
+    is_grain = not isinstance(orientations, np.ndarray) and all(isinstance(o, Grain) for o in orientations)
+    if grain_ids is None:
+        grain_ids = [o.id for o in orientations] if is_grain else np.arange(n_grains)
+    if positions is None:
+        if is_grain:
+            positions = [o.position for o in orientations]
+        else:
+            positions = np.zeros((n_grains, 3))
+    positions = np.asarray(positions, dtype=np.float64).reshape((n_grains, 3))
+    lambda_nm = lambda_keV_to_nm(lambda_keV)
+    theta = hkl.bragg_angles(lambda_keV)
+    # scattering vectors in the sample frame at omega=0, shape (G, N, 3)
+    Gs = np.einsum('gjk,nj->gnk', g, hkl.scattering_vectors())
+    A = Gs[:, :, 0]
+    B = -Gs[:, :, 1]
+    C = -2 * np.sin(theta) ** 2 / lambda_nm
+    with np.errstate(invalid='ignore', divide='ignore'):
+        Delta = 4 * (A ** 2 + B ** 2 - C ** 2)
+        valid = Delta >= 0  # False for NaN values
+        sqrt_delta = np.sqrt(np.where(valid, Delta, np.nan))
+        t = np.stack([(B - 0.5 * sqrt_delta) / (A + C), (B + 0.5 * sqrt_delta) / (A + C)], axis=-1)
+    omega = np.mod(2 * np.arctan(t), 2 * np.pi)  # shape (G, N, 2)
+    # diffracted beam directions K = X + Omega.Gs, shape (G, N, 2, 3)
+    (cw, sw) = (np.cos(omega), np.sin(omega))
+    Gx, Gy = Gs[:, :, np.newaxis, 0], Gs[:, :, np.newaxis, 1]
+    K = np.empty(omega.shape + (3,))
+    K[..., 0] = cw * Gx - sw * Gy + 1. / lambda_nm
+    K[..., 1] = sw * Gx + cw * Gy
+    K[..., 2] = Gs[:, :, np.newaxis, 2]
+    eta = np.mod(np.arctan2(-K[..., 1], K[..., 2]), 2 * np.pi)
+    uv = np.full(omega.shape + (2,), np.nan)
+    if detector is not None:
+        # grain positions rotated with the sample
+        pos = np.empty(omega.shape + (3,))
+        pos[..., 0] = cw * positions[:, np.newaxis, np.newaxis, 0] - sw * positions[:, np.newaxis, np.newaxis, 1]
+        pos[..., 1] = sw * positions[:, np.newaxis, np.newaxis, 0] + cw * positions[:, np.newaxis, np.newaxis, 1]
+        pos[..., 2] = positions[:, np.newaxis, np.newaxis, 2]
+        # NaN when the diffracted beam goes away from the detector
+        uv = detector.project_to_pixels(pos, K)[0]
+    spots = np.zeros(n_grains * n_hkl, dtype=[('grain_id', int), ('hkl', int, (3,)), ('omega', float, (2,)),
+                                               ('two_theta', float), ('eta', float, (2,)), ('uv', float, (2, 2)),
+                                               ('valid', bool)])
+    spots['grain_id'] = np.repeat(grain_ids, n_hkl)
+    spots['hkl'] = np.tile(hkl.miller_indices(), (n_grains, 1))
+    spots['omega'] = np.degrees(omega).reshape((-1, 2))
+    spots['two_theta'] = np.where(valid, np.degrees(2 * theta), np.nan).ravel()
+    spots['eta'] = np.degrees(eta).reshape((-1, 2))
+    spots['uv'] = uv.reshape((-1, 2, 2))
+    spots['valid'] = valid.ravel()
+    return spots
+
+
+# state of the DCT scan simulation (see :py:func:`~pymicro.parallel.map_chunks`)
+_dct_scan_state = {}
+
+
+def _init_dct_scan(state):
+    """Initialize the state of a DCT scan simulation with empty caches of projections."""
+    _dct_scan_state.clear()
+    _dct_scan_state.update(state)
+    _dct_scan_state['cache'] = {}
+    _dct_scan_state['beam_cache'] = {}
+    labels = state['labels']
+    if labels is not None:
+        # each row of this 2D view holds the Z column of one (x, y) position of the sample
+        _dct_scan_state['sample'] = (labels > 0).reshape((-1, labels.shape[2])).astype(np.float32)
+
+
+def _omega_bin(omega):
+    """Return the cache bin of an omega value and the omega value used for all the frames of this bin."""
+    step = _dct_scan_state['cache_step']
+    if step > 0:
+        omega_bin = int(round(omega / step))
+        return omega_bin, omega_bin * step
+    return omega, omega
+
+
+def _grain_projection(gid, omega):
+    """Return the projection of a cropped grain, computed at the closest cached omega value."""
+    state = _dct_scan_state
+    cache = state['cache']
+    (omega_bin, omega) = _omega_bin(omega)
+    key = (gid, omega_bin)
+    if key not in cache:
+        # projections from previous bins are not needed anymore since the frames are processed in order
+        for old_key in [k for k in cache if k[1] != omega_bin]:
+            del cache[old_key]
+        cache[key] = radiograph(state['crops'][gid], omega)
+    return cache[key]
+
+
+def _direct_beam(omega, gids):
+    """Return the radiograph of the sample without some grains, computed at the closest cached omega value.
+
+    The radiograph of the whole sample is computed once per omega bin and the
+    projection of each removed grain is subtracted from it. The grains are
+    projected with the same matrix as the whole sample, restricted to the
+    (x, y) positions of their crop, so that they are exactly at their place.
+    """
+    state = _dct_scan_state
+    (omega_bin, omega) = _omega_bin(omega)
+    cache = state['beam_cache']
+    (nx, ny, nz) = state['labels'].shape
+    if cache.get('bin') != omega_bin:
+        width = int(np.ceil(max(nx, ny) * 2 ** 0.5))
+        P = _projection_matrix((nx, ny), omega, width).tocsc()
+        cache.clear()
+        cache.update({'bin': omega_bin, 'matrix': P, 'sample': P.dot(state['sample']), 'grains': {}})
+    absorption = cache['sample'].copy()
+    for gid in np.unique(gids):
+        (sx, sy, sz) = state['slices'][gid]
+        if gid not in cache['grains']:
+            crop = state['crops'][gid]
+            positions = (np.arange(sx.start, sx.stop)[:, np.newaxis] * ny + np.arange(sy.start, sy.stop)).ravel()
+            cache['grains'][gid] = cache['matrix'][:, positions].dot(crop.reshape((-1, crop.shape[2])))
+        absorption[:, sz] -= cache['grains'][gid]
+    return absorption
+
+
+def _dct_scan_frames(frame_indices):
+    """Compute a series of DCT frames (worker function of :py:func:`simulate_dct_scan`)."""
+    state = _dct_scan_state
+    frames = np.zeros((len(frame_indices),) + tuple(state['size']), dtype=np.float32)
+    for n, i in enumerate(frame_indices):
+        omega = state['omegas'][i]
+        in_frame = state['spot_frames'] == i
+        gids = state['spot_gids'][in_frame]
+        uvs = state['spot_uvs'][in_frame]
+        if state['include_direct_beam']:
+            # radiograph of the sample without the diffracting grains
+            absorption = _direct_beam(omega, gids)
+            add_to_image(frames[n], absorption[::-1, ::-1] / state['att'], np.array(state['size']) // 2)
+        for gid in np.unique(gids):
+            # all the spots of a grain in this frame share the same projection, (u, v) axes correspond to (-Y, -Z)
+            add_spots_to_image(frames[n], uvs[gids == gid], _grain_projection(gid, omega)[::-1, ::-1])
+    output = state['output']
+    if output is None:
+        return frames
+    if output.endswith('.npy'):
+        stack = np.lib.format.open_memmap(output, mode='r+')
+        stack[frame_indices[0]:frame_indices[-1] + 1] = frames
+        stack.flush()
+        del stack
+    else:
+        for n, i in enumerate(frame_indices):
+            if output.endswith('.png'):
+                plt.imsave(output % i, frames[n].T, cmap=cm.gray, origin='upper')
+            else:
+                edf_write(frames[n], output % i, type=np.float32)
+    return None
+
+
+def simulate_dct_scan(orientations, data, omegas, lambda_keV, detector, hkl, output=None, include_direct_beam=True,
+                      att=5, cache_step=1.0, n_processes=1, chunk_size=None, verbose=False):
+    """Simulate all the detector frames of a DCT scan.
+
+    Each grain of the labeled volume is cropped once and the diffraction
+    spots of all grains are computed once for the whole scan with
+    :py:func:`dct_spot_table`. For each frame, the projections of the
+    diffracting grains are placed on the detector at their spot positions.
+    If requested, the direct beam is added as the radiograph of the sample
+    from which the diffracting grains are removed.
+
+    The projection of a grain varies slowly with omega so it is computed
+    once per interval of `cache_step` degrees and reused for all the frames
+    within this interval, and so is the radiograph of the whole sample used
+    for the direct beam.
+
+    The frames are written as soon as they are computed, either in a numpy
+    `.npy` file (memory mapped so the whole scan never needs to fit in
+    memory) or as an image sequence. The scan can be split in contiguous
+    ranges of omega which are computed by a pool of processes.
+
+    .. note::
+
+      As in :py:func:`dct_projection`, the voxel size of the volume is
+      assumed to be the pixel size of the detector. The omega values must be
+      regularly spaced; each diffraction spot is assigned to the frame with
+      the closest omega value.
+
+    :param orientations: a dictionary of the grain orientations indexed by grain id or a list of
+        :py:class:`~pymicro.crystal.microstructure.Grain` instances.
+    :param data: the 3D labeled array of the sample in (XYZ) form (0 is the background).
+    :param omegas: the array of rotation angles of the scan in degrees.
+    :param float lambda_keV: the X-ray energy in keV.
+    :param detector: the :py:class:`~pymicro.xray.detectors.RegArrayDetector2d` instance.
+    :param hkl: the reflections to consider, an :py:class:`~pymicro.crystal.lattice.HklPlaneArray` instance.
+    :param str output: None to return the frames in memory, the path of a `.npy` file or a file name pattern
+        for an image sequence (eg 'dct_%04d.edf' or 'dct_%04d.png').
+    :param bool include_direct_beam: add the direct beam to the frames (True by default).
+    :param float att: attenuation factor of the direct beam (5 by default).
+    :param float cache_step: omega interval in degrees used to reuse the projections (1 by default, 0
+        to compute them exactly for each frame).
+    :param int n_processes: the number of processes to use (1 by default).
+    :param int chunk_size: the number of consecutive frames computed in a single task.
+    :param bool verbose: activate verbose mode (False by default).
+    :returns: the stack of frames as a (n_omegas, nu, nv) array (memory mapped for a `.npy` output) or None for an
+        image sequence.
+    """
+    omegas = np.asarray(omegas, dtype=np.float64)
+    if isinstance(orientations, dict):
+        gids = sorted(orientations.keys())
+        orientation_list = [orientations[gid] for gid in gids]
+    else:
+        gids = [grain.id for grain in orientations]
+        orientation_list = orientations
+    gids = [gid for gid in gids if gid > 0]
+    # crop each grain and compute its center of mass only once
+    objects = ndimage.find_objects(data)
+    coms = ndimage.measurements.center_of_mass(data > 0, data, gids)
+    crops, slices, keep = {}, {}, []
+    for k, gid in enumerate(gids):
+        if gid > len(objects) or objects[gid - 1] is None:
+            if verbose:
+                print('skipping grain %d which is not in the volume' % gid)
+            continue
+        sl = objects[gid - 1]
+        crops[gid] = (data[sl] == gid).astype(np.float32)
+        slices[gid] = sl
+        keep.append(k)
+    gids = [gids[k] for k in keep]
+    positions = detector.pixel_size * (np.array([coms[k] for k in keep]) - 0.5 * np.array(data.shape))
+    g = Orientation.orientation_matrices([orientation_list[k] for k in keep])
+    spots = dct_spot_table(g, hkl, lambda_keV, detector=detector, positions=positions, grain_ids=gids)
+    # assign each diffraction spot to a frame
+    spot_omegas = spots['omega'].ravel()
+    spot_gids = np.repeat(spots['grain_id'], 2)
+    spot_uvs = spots['uv'].reshape((-1, 2))
+    ok = np.repeat(spots['valid'], 2) & np.all(np.isfinite(spot_uvs), axis=1)
+    step = omegas[1] - omegas[0] if len(omegas) > 1 else 360.
+    n_turn = int(round(360. / step))
+    spot_frames = np.mod(np.rint((spot_omegas[ok] - omegas[0]) / step).astype(int), n_turn)
+    in_scan = spot_frames < len(omegas)
+    if verbose:
+        print('%d diffraction spots in the scan' % np.sum(in_scan))
+    state = {'omegas': omegas,
+             'size': tuple(detector.size),
+             'spot_frames': spot_frames[in_scan],
+             'spot_gids': spot_gids[ok][in_scan],
+             'spot_uvs': np.rint(spot_uvs[ok][in_scan]).astype(int),
+             'crops': crops,
+             'slices': slices,
+             'include_direct_beam': include_direct_beam,
+             'labels': data if include_direct_beam else None,
+             'att': att,
+             'cache_step': cache_step,
+             'output': output}
+    if output is not None and output.endswith('.npy'):
+        stack = np.lib.format.open_memmap(output, mode='w+', dtype=np.float32,
+                                          shape=(len(omegas),) + tuple(detector.size))
+        del stack
+    # split the scan in contiguous ranges of omega so that the grain projections are reused
+    chunks = chunk_ranges(len(omegas), n_processes, chunk_size)
+    results = map_chunks(_dct_scan_frames, chunks, state, _init_dct_scan, _dct_scan_state.clear, n_processes,
+                         'computing frames %d to %d' if verbose else None)
+    if output is None:
+        return np.concatenate(results, axis=0)
+    elif output.endswith('.npy'):
+        return np.load(output, mmap_mode='r+')
+    return None
+
+
+def add_spots_to_image(image, uv, spots, weights=None, verbose=False):
+    """Add a series of spots to an image in a single operation.
+
+    Each spot is a small image centered at its (u, v) location: the pixel
+    (i, j) of the spot is added to the pixel (u - nu // 2 + i, v - nv // 2 + j)
+    of the image, with (nu, nv) the spot size. The spots may be of any size
+    and may be completely or partially outside the image, in which case they
+    are cropped accordingly. Overlapping spots are summed. For an image of
+    integer type, the result is clipped to the range of the data type.
+
+    ::
+
+      kernel = np.ones((11, 11))
+      add_spots_to_image(detector.data, uv, kernel, weights=intensities)
+
+    :param np.array image: the 2D image that will be modified.
+    :param uv: a (N, 2) array of the spot centers (rounded to the nearest pixel).
+    :param spots: the spot images, either a single 2D array used for all the spots or a (N, nu, nv) stack.
+    :param weights: an optional (N,) array to scale the spots (eg the spot intensities or energies).
+    :param bool verbose: activate verbose mode (False by default).
+    :returns: the number of pixels of the spots which have been added to the image.
+    """
+    uv = np.rint(np.asarray(uv, dtype=np.float64).reshape((-1, 2)))
+    spots = np.asarray(spots)
+    (nu, nv) = spots.shape[-2:]
+    values = spots.reshape((-1, nu, nv)) * np.ones((len(uv), 1, 1))
+    if weights is not None:
+        values = values * np.asarray(weights, dtype=np.float64).reshape((-1, 1, 1))
+    # skip spots with undefined positions
+    ok = np.all(np.isfinite(uv), axis=1)
+    uv, values = uv[ok].astype(int), values[ok]
+    u = uv[:, 0, np.newaxis, np.newaxis] - nu // 2 + np.arange(nu)[:, np.newaxis]
+    v = uv[:, 1, np.newaxis, np.newaxis] - nv // 2 + np.arange(nv)[np.newaxis, :]
+    inside = (u >= 0) & (u < image.shape[0]) & (v >= 0) & (v < image.shape[1])
+    if verbose:
+        print('adding %d spots to the image, %d are completely outside' % (len(uv), np.sum(~np.any(inside, axis=(1, 2)))))
+    flat = (u * image.shape[1] + v)[inside]
+    pixels, inverse = np.unique(flat, return_inverse=True)
+    sums = np.bincount(inverse, weights=values[inside])
+    (pu, pv) = np.divmod(pixels, image.shape[1])
+    if np.issubdtype(image.dtype, np.integer):
+        info = np.iinfo(image.dtype)
+        image[pu, pv] = np.clip(image[pu, pv] + np.rint(sums), info.min, info.max)
+    else:
+        image[pu, pv] += sums
+    return len(flat)
+
+
+def add_colored_spots_to_image(image, uv, spots, values, cmap='jet', value_range=None, weights=None):
+    """Add a series of spots to an RGB image, colored according to a value (typically the X-ray energy).
+
+    :param np.array image: the (nu, nv, 3) float RGB image that will be modified.
+    :param uv: a (N, 2) array of the spot centers.
+    :param spots: the spot images, either a single 2D array used for all the spots or a (N, nu, nv) stack.
+    :param values: a (N,) array of the values used to color the spots.
+    :param cmap: the name of the matplotlib colormap to use ('jet' by default).
+    :param tuple value_range: the (min, max) values mapped to the colormap (defaults to the range of the values).
+    :param weights: an optional (N,) array to scale the spots.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if value_range is None:
+        value_range = (np.nanmin(values), np.nanmax(values))
+    norm = (values - value_range[0]) / max(value_range[1] - value_range[0], np.finfo(float).eps)
+    colors = cm.get_cmap(cmap)(np.clip(norm, 0., 1.))[:, :3]
+    if weights is not None:
+        colors = colors * np.asarray(weights, dtype=np.float64)[:, np.newaxis]
+    for channel in range(3):
+        add_spots_to_image(image[:, :, channel], uv, spots, weights=colors[:, channel])
+
+
 def add_to_image(image, inset, (u, v), verbose=False):
     """Add an image to another image at a specified position.
 
     The inset image may be of any size and may only overlap partly on the overall image depending on the location
-    specified. In such a case, the inset image is cropped accordingly.
+    specified. In such a case, the inset image is cropped accordingly. See :py:func:`add_spots_to_image` to add
+    many insets at once.
 
     :param np.array image: the master image taht will be modified.
     :param np.array inset: the inset to add to the image.
     :param tuple (u,v): the location (center) where to add the inset.
     :param bool verbose: activate verbose mode (False by default).
     """
-    spot_size = inset.shape
-    u_start = 0
-    u_end = spot_size[0]
-    v_start = 0
-    v_end = spot_size[1]
-    # check bounds for spots that may be completely or partly outside the image
-    if (u + spot_size[0] // 2 < 0) or (u - spot_size[0] // 2 > image.shape[0] - 1) or (
-                    v + spot_size[1] // 2 < 0) or (v - spot_size[1] // 2 > image.shape[1] - 1):
-        if verbose:
-            print('skipping this spot which is outside the detector area')
-        return None  # spot is completely outside the detector area
-    if u - spot_size[0] // 2 < 0:
-        u_start = int(spot_size[0] // 2 - u + 1)
-    elif u - spot_size[0] // 2 + spot_size[0] > image.shape[0] - 1:
-        u_end = int(image.shape[0] - (u - spot_size[0] // 2))
-    if v - spot_size[1] // 2 < 0:
-        v_start = int(spot_size[1] // 2 - v + 1)
-    elif v - spot_size[1] // 2 + spot_size[1] > image.shape[1] - 1:
-        v_end = int(image.shape[1] - (v - spot_size[1] // 2))
-    # now add spot to the image
-    image[u - spot_size[0] // 2 + u_start: u - spot_size[0] // 2 + u_end,
-    v - spot_size[1] // 2 + v_start: v - spot_size[1] // 2 + v_end] \
-        += inset[u_start:u_end, v_start:v_end]
-
-
-def all_dif_spots(g_proj, g_uv, verbose=False):
+    if add_spots_to_image(image, [(u, v)], inset) == 0 and verbose:
+        print('skipping this spot which is outside the detector area')
+
+
+def all_dif_spots(g_proj, g_uv, detector_size=(2048, 2048), verbose=False):
     """Produce a 2D image placing all diffraction spots at their respective position on the detector.
 
     Spots outside the detector are are skipped while those only partially on the detector are cropped accordingly.
@@ -103,19 +465,13 @@ def all_dif_spots(g_proj, g_uv, verbose=False):
     the second axis is the horizontal coordinate of the detector (u) and the third axis the vertical coordinate \
     of the detector (v).
     :param g_uv: list or array of the diffraction spot position.
+    :param tuple detector_size: the size of the detector image in pixels ((2048, 2048) by default).
     :param bool verbose: activate verbose mode (False by default).
     :returns: a 2D composite image of all the diffraction spots.
     """
-    # TODO add a detector object to account for the image size and the position of the direct beam
-    image = np.zeros((2048, 2048), dtype=g_proj.dtype)
-    print(g_proj.shape[0], len(g_uv))
+    image = np.zeros(detector_size, dtype=g_proj.dtype)
     assert g_proj.shape[0] == len(g_uv)
-    for i in range(g_proj.shape[0]):
-        spot = g_proj[i]
-        if verbose:
-            print('i={0}, size of spot: {1}'.format(i, spot.shape))
-            print('placing diffraction spot at location {0}'.format(g_uv[i]))
-        add_to_image(image, spot, g_uv[i], verbose)
+    add_spots_to_image(image, g_uv, g_proj, verbose=verbose)
     return image
 
 
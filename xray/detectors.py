@@ -1,9 +1,12 @@
 """The detectors module define classes to manipulate X-ray detectors.
 """
 import os, numpy as np
-from matplotlib import pyplot as plt, cm, rcParams
-from pymicro.file.file_utils import HST_read, HST_write
-from pymicro.external.tifffile import TiffFile
+from pymicro.file.file_utils import HST_read, HST_write, HDF5FrameSource
+from pymicro.lazy import lazy_import
+
+plt = lazy_import('matplotlib.pyplot')
+cm = lazy_import('matplotlib.cm')
+sparse = lazy_import('scipy.sparse')
 
 #rcParams.update({'font.size': 12})
 #rcParams['text.latex.preamble'] = [r"\usepackage{amsmath}"]
@@ -52,8 +55,6 @@ class Detector2d:
 
         bin_edges = np.linspace(two_theta_mini, two_theta_maxi, 1 + nbOfBins)
         two_theta_values = bin_edges[:-1] + 0.5 * two_theta_step
-        intensityResult = np.zeros(nbOfBins)  # this will be the summed intensity
-        counts = np.zeros(nbOfBins)  # this will be the number of pixel contributing to each point
 
         # calculating bin indices for each pixel
         binIndices = np.floor((self.two_thetas - two_theta_mini) / two_theta_step).astype(np.int16)
@@ -84,9 +85,11 @@ class Detector2d:
         if psi_max:
             binIndices[(self.psis > psi_max)] = -1
             # binIndices[(self.psis > psi_max) & (self.psis < 180 - psi_max)] = -1
-        for ii in range(nbOfBins):
-            intensityResult[ii] = self.corr_data[binIndices == ii].sum()
-            counts[ii] = (binIndices == ii).sum()
+        # sum the intensity of each bin in a single pass (masked pixels are counted but do not contribute)
+        inside = (binIndices >= 0) & (binIndices < nbOfBins)
+        intensityResult = np.bincount(binIndices[inside], weights=np.ma.filled(self.corr_data, 0)[inside],
+                                      minlength=nbOfBins)
+        counts = np.bincount(binIndices[inside], minlength=nbOfBins).astype(float)
         intensityResult /= counts
 
         if output_image:
@@ -141,15 +144,13 @@ class Detector2d:
         # assign default values if needed
         if not two_theta_mini: two_theta_mini = self.two_thetas.min()
         if not two_theta_maxi: two_theta_maxi = self.two_thetas.max()
-        if not psi_step: psi_step = 1. / mar.calib
+        if not psi_step: psi_step = 1. / self.calib
         nbOfBins = int((psi_max - psi_min) / psi_step)
         print '* Sagital regroup (psi binning)'
         print '  psi range = [%.1f-%.1f] with a %g deg step (%d bins)' % (psi_min, psi_max, psi_step, nbOfBins)
 
         bin_edges = np.linspace(psi_min, psi_max, 1 + nbOfBins)
         psi_values = bin_edges[:-1] + 0.5 * psi_step
-        intensityResult = np.zeros(nbOfBins);  # this will be the summed intensity
-        counts = np.zeros(nbOfBins);  # this will be the number of pixel contributing to each point
 
         # calculating bin indices for each pixel
         binIndices = np.floor((self.psis - psi_min) / psi_step).astype(np.int16)
@@ -161,10 +162,11 @@ class Detector2d:
             binIndices[(self.two_thetas < two_theta_mini)] = -1
         if two_theta_maxi:
             binIndices[(self.two_thetas > two_theta_maxi)] = -1
-        for ii in range(nbOfBins):
-            intensityResult[ii] = self.corr_data[binIndices == ii].sum()
-            counts[ii] = (binIndices == ii).sum()
-        print counts
+        # sum the intensity of each bin in a single pass (masked pixels are counted but do not contribute)
+        inside = (binIndices >= 0) & (binIndices < nbOfBins)
+        intensityResult = np.bincount(binIndices[inside], weights=np.ma.filled(self.corr_data, 0)[inside],
+                                      minlength=nbOfBins)
+        counts = np.bincount(binIndices[inside], minlength=nbOfBins).astype(float)
         intensityResult /= counts
 
         if output_image:
@@ -206,7 +208,10 @@ class RegArrayDetector2d(Detector2d):
 
     The two dimensions of the pixel grid are reffered by u and v. Usually u is the horizontal direction and v the
     vertical one, but both can be controlled by the u_dir and v_dir attributes. This allows to control the detector
-    flips and tilts.
+    flips. Arbitrary tilts of the detector can be applied on top of that with the `set_tilts` method.
+
+    All the geometry methods accept either a single point (or pixel) or arrays of points (or pixels) so that a large
+    number of diffracted beams can be processed at once.
     '''
 
     def __init__(self, size=(2048, 2048), data_type=np.uint16, u_dir=[0, -1, 0], v_dir=[0, 0, -1]):
@@ -214,17 +219,51 @@ class RegArrayDetector2d(Detector2d):
         self.ref = np.ones(self.size, dtype=self.data_type)
         self.dark = np.zeros(self.size, dtype=self.data_type)
         self.bg = np.zeros(self.size, dtype=self.data_type)
-        self.u_dir = np.array(u_dir)
+        self.tilts = np.zeros(3)
+        self._lab_coordinates = None
+        self._lab_coordinates_key = None
+        self._u_dir0 = np.array(u_dir)
         self.set_v_dir(v_dir)
 
     def set_u_dir(self, u_dir):
         '''Set the coordinates of the vector describing the first (horizontal) direction of the pixels.'''
-        self.u_dir = np.array(u_dir)
-        self.w_dir = np.cross(self.u_dir, self.v_dir)
+        self._u_dir0 = np.array(u_dir)
+        self._update_directions()
 
     def set_v_dir(self, v_dir):
         '''Set the coordinates of the vector describing the second (vertical) direction of the pixels.'''
-        self.v_dir = np.array(v_dir)
+        self._v_dir0 = np.array(v_dir)
+        self._update_directions()
+
+    def set_tilts(self, tilts):
+        '''Set the tilts of the detector.
+
+        The tilts are three rotation angles in degrees around the X, Y and Z
+        axes of the laboratory frame. They are applied in this order to the
+        pixel directions set by `set_u_dir` and `set_v_dir` (the detector
+        rotates around its reference position).
+
+        :param tilts: a sequence of the 3 tilt angles in degrees.
+        '''
+        self.tilts = np.array(tilts, dtype=float)
+        self._update_directions()
+
+    def tilt_matrix(self):
+        '''Return the rotation matrix corresponding to the detector tilts.'''
+        (cx, cy, cz) = np.cos(np.radians(self.tilts))
+        (sx, sy, sz) = np.sin(np.radians(self.tilts))
+        Rx = np.array([[1., 0., 0.], [0., cx, -sx], [0., sx, cx]])
+        Ry = np.array([[cy, 0., sy], [0., 1., 0.], [-sy, 0., cy]])
+        Rz = np.array([[cz, -sz, 0.], [sz, cz, 0.], [0., 0., 1.]])
+        return np.dot(Rz, np.dot(Ry, Rx))
+
+    def _update_directions(self):
+        '''Compute the pixel directions and the detector normal from the flips and tilts.'''
+        if not np.any(self.tilts):
+            (self.u_dir, self.v_dir) = (self._u_dir0, self._v_dir0)
+        else:
+            R = self.tilt_matrix()
+            (self.u_dir, self.v_dir) = (np.dot(R, self._u_dir0), np.dot(R, self._v_dir0))
         self.w_dir = np.cross(self.u_dir, self.v_dir)
 
     def get_size_mm(self):
@@ -272,40 +311,112 @@ class RegArrayDetector2d(Detector2d):
 
            d=\dfrac{(p_0 - l_0).n}{l.n}
 
+        The origins and directions can be single vectors or (N, 3) arrays (a
+        single origin can be used with several directions). The coordinates
+        of the lines parallel to the detector are set to NaN.
+
+        :param origin: a point of the line(s) as a (3,) or (N, 3) array.
+        :param direction: the direction of the line(s) as a (3,) or (N, 3) array.
+        :return: the intersection point(s) as a (3,) or (N, 3) array.
         '''
-        assert np.dot(self.w_dir, direction) != 0
-        d = np.dot((self.ref_pos - origin), self.w_dir) / np.dot(direction, self.w_dir)
-        p = origin + d * direction
+        origin = np.asarray(origin, dtype=float)
+        direction = np.asarray(direction, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ln = np.dot(direction, self.w_dir)
+            d = np.where(ln != 0, np.dot(self.ref_pos - origin, self.w_dir) / ln, np.nan)
+        p = origin + np.asarray(d)[..., np.newaxis] * direction
         return p
 
     def lab_to_pixel(self, p):
         '''Compute the pixel number corresponding to a physical point in space.
 
-        :param tuple p: the coordinate of the point in the laboratory frame.
-        :return tuple (u, v): the detector coordinates of the given point.
+        The point is assumed to lie on the detector plane (the component along
+        the detector normal is ignored).
+
+        :param p: the coordinates of the point in the laboratory frame, as a (3,) or (N, 3) array.
+        :return tuple (u, v): the detector coordinates of the given point(s).
         '''
-        # check if the point is on the detector plane
-        vec = np.array(p) - np.array(self.ref_pos)
-        assert np.dot(self.w_dir, vec) < 1.e-6
-        u = self.ucen + np.dot(self.u_dir, vec) / self.pixel_size
-        v = self.vcen + np.dot(self.v_dir, vec) / self.pixel_size
+        vec = np.asarray(p, dtype=float) - self.ref_pos
+        u = self.ucen + np.dot(vec, self.u_dir) / self.pixel_size
+        v = self.vcen + np.dot(vec, self.v_dir) / self.pixel_size
         return u, v
 
     def pixel_to_lab(self, u, v):
         '''Compute the laboratory coordinates of a given pixel.
 
-        :param int u: the given pixel number along the first direction.
-        :param int v: the given pixel number along the second direction.
-        :return tuple (x, y, z): the laboratory coordinates.
+        :param u: the given pixel number(s) along the first direction (scalar or array).
+        :param v: the given pixel number(s) along the second direction (scalar or array of the same shape).
+        :return: the laboratory coordinates as a (3,) array or an array of shape u.shape + (3,).
         '''
+        u = np.asarray(u, dtype=float)[..., np.newaxis]
+        v = np.asarray(v, dtype=float)[..., np.newaxis]
         r = (u - self.ucen) * self.u_dir + (v - self.vcen) * self.v_dir
         p = self.ref_pos + r * self.pixel_size
         return p
 
+    def is_on_detector(self, u, v, margin=0.):
+        '''Return a mask of the pixel coordinates which fall on the detector.
+
+        :param u: the pixel number(s) along the first direction (scalar or array).
+        :param v: the pixel number(s) along the second direction (scalar or array).
+        :param float margin: also accept the coordinates up to this number of pixels outside the detector (0 by
+            default).
+        :return: a boolean mask (False for NaN coordinates).
+        '''
+        with np.errstate(invalid='ignore'):
+            return (u >= -margin) & (u < self.size[0] + margin) & (v >= -margin) & (v < self.size[1] + margin)
+
+    def project_to_pixels(self, origin, direction, forward_only=True, margin=0.):
+        '''Compute the pixel coordinates where a series of beams hit the detector.
+
+        This combines :py:meth:`project_along_direction` and
+        :py:meth:`lab_to_pixel` and computes a mask of the beams hitting the
+        detector.
+
+        :param origin: the beam origin(s) as a (3,) or (..., 3) array.
+        :param direction: the beam direction(s) as a (3,) or (..., 3) array.
+        :param bool forward_only: if True (default), the pixel coordinates of the beams going away from the detector
+            are set to NaN; if False, the beams are considered as lines.
+        :param float margin: also consider as hitting the detector the beams up to this number of pixels outside
+            of it (0 by default).
+        :return tuple (uv, mask): the (..., 2) array of pixel coordinates and the boolean mask of the beams hitting
+            the detector.
+        '''
+        origin = np.asarray(origin, dtype=float)
+        direction = np.asarray(direction, dtype=float)
+        p = self.project_along_direction(origin, direction)
+        if forward_only:
+            with np.errstate(invalid='ignore'):
+                backward = np.sum((p - origin) * direction, axis=-1) <= 0
+            p = np.where(backward[..., np.newaxis], np.nan, p)
+        (u, v) = self.lab_to_pixel(p)
+        uv = np.stack((u, v), axis=-1)
+        return uv, self.is_on_detector(u, v, margin)
+
+    def lab_coordinates(self):
+        '''Return the laboratory coordinates of all the pixels of the detector.
+
+        The array is computed on the first call and cached, it is recomputed
+        only if the detector geometry changes.
+
+        :return: a (nu, nv, 3) float32 array of the pixel centers in the laboratory frame.
+        '''
+        key = (tuple(self.size), self.ucen, self.vcen, self.pixel_size, tuple(self.ref_pos), tuple(self.u_dir),
+               tuple(self.v_dir))
+        if self._lab_coordinates is None or key != self._lab_coordinates_key:
+            xyz = np.empty(tuple(self.size) + (3,), dtype=np.float32)
+            u = np.arange(self.size[0], dtype=float)
+            for v in range(self.size[1]):
+                xyz[:, v] = self.pixel_to_lab(u, v)
+            self._lab_coordinates = xyz
+            self._lab_coordinates_key = key
+        return self._lab_coordinates
+
     def load_image(self, image_path):
         print('loading image %s' % image_path)
         self.image_path = image_path
         if image_path.endswith('.tif'):
+            from pymicro.external.tifffile import TiffFile
             self.data = TiffFile(image_path).asarray().T.astype(np.float32)
         elif image_path.endswith('.raw'):
             self.data = HST_read(self.image_path, data_type=self.data_type, dims=(self.size[0], self.size[1], 1))[:, :,
@@ -404,6 +515,9 @@ class Xpad(Detector2d):
 
     '''
 
+    # geometrical correction matrices indexed by detector layout
+    _remap_matrices = {}
+
     def __init__(self):
         Detector2d.__init__(self)
         self.numberOfModules = 2
@@ -418,6 +532,7 @@ class Xpad(Detector2d):
         self.XcenDetector = 451.7 + 5 * 3
         self.YcenDetector = 116.0  # position of direct beam on xpad at del=gam=0
         self.verbose = True
+        self._lab_coordinates = None
 
     def load_image(self, image_path, nxs_prefix=None, nxs_dataset=None, nxs_index=None, nxs_update_geometry=False,
                    stack='first'):
@@ -433,7 +548,10 @@ class Xpad(Detector2d):
         :param bool nxs_update_geometry: if True the compute_TwoTh_Psi_arrays method is called after loading the image.
         :params str stack: indicates what to do if many images are present, \
         'first' (default) to keep only the first one, 'median' to compute \
-        the median over the third dimension.
+        the median over the third dimension. With the nexus format, 'mean' \
+        and 'max' can also be used and the frames are reduced without \
+        loading the whole scan in memory (see \
+        :py:class:`~pymicro.file.file_utils.HDF5FrameSource`).
         '''
         self.image_path = image_path
         if image_path.endswith('.raw'):
@@ -442,23 +560,22 @@ class Xpad(Detector2d):
             if stack == 'first':
                 image = rawdata[:, :, 0]
             elif stack == 'median':
-                image = np.median(image, axis=2)
+                image = np.median(rawdata, axis=2)
             self.data = image.astype(np.float32).transpose()
             self.compute_corrected_image()
         elif image_path.endswith('.nxs'):
-            import tables
-            f = tables.openFile(image_path)
-            root = f.root._v_groups.keys()[0]
-            command = 'f.root.__getattr__(\"%s\")' % root
-            rawdata = eval(command + '.scan_data.data_%s.read()' % nxs_dataset)  # xpad images
-            delta = eval('f.root.%s%d.DIFFABS.__getattr__(\'D13-1-CX1__EX__DIF.1-DELTA__#1\').raw_value.read()' % (
-                nxs_prefix, nxs_index))
-            gamma = 0.0  # eval('f.root.%s%d.DIFFABS.__getattr__(\'D13-1-CX1__EX__DIF.1-GAMMA__#1\').raw_value.read()' % (nxs_prefix, nxs_index))
-            f.close()
-            if stack == 'first':
-                image = rawdata[0, :, :]
-            elif stack == 'median':
-                image = np.median(rawdata, axis=0)
+            # the frames are read lazily so that the median of long scans does not need to fit in memory
+            import h5py
+            with h5py.File(image_path, 'r') as f:
+                root = list(f.keys())[0]
+                with HDF5FrameSource(f, '/%s/scan_data/data_%s' % (root, nxs_dataset)) as source:  # xpad images
+                    delta_path = '/%s%d/DIFFABS/D13-1-CX1__EX__DIF.1-DELTA__#1/raw_value' % (nxs_prefix, nxs_index)
+                    delta = source.h5file[delta_path][()]
+                    gamma = 0.0  # '/%s%d/DIFFABS/D13-1-CX1__EX__DIF.1-GAMMA__#1/raw_value' % (nxs_prefix, nxs_index)
+                    if stack == 'first':
+                        image = source[0]
+                    else:
+                        image = source.reduce(stack)
             self.data = image
             print(self.data.shape)
             self.compute_corrected_image()
@@ -542,13 +659,80 @@ class Xpad(Detector2d):
         # plt.show()
         return newX_array, newY_array, newX_Ifactor_array
 
+    def remap_matrix(self):
+        '''Return the sparse matrix mapping the raw image to the image with the corrected geometry.
+
+        The corrected image accounts for the gaps between the chips and for
+        the double pixels: each pixel of the corrected image is a linear
+        combination of the raw pixels (the intensity of the double pixels is
+        split over several corrected pixels). The matrix depends only on the
+        detector layout, it is computed once and shared by all the instances
+        with the same layout.
+
+        :returns: a sparse matrix of shape (n_corrected_pixels, n_raw_pixels) in CSR format.
+        '''
+        layout = (self.numberOfModules, self.numberOfChips, self.chip_sizeX, self.chip_sizeY, self.factorIdoublePixel)
+        if layout in Xpad._remap_matrices:
+            return Xpad._remap_matrices[layout]
+        newX_array, newY_array, newX_Ifactor_array = self.compute_geometry()
+        (size_y, size_x) = (len(newY_array), len(newX_array))
+        raw_shape = (self.numberOfModules * self.chip_sizeY, self.numberOfChips * self.chip_sizeX)
+        (y, x) = np.meshgrid(np.arange(size_y), np.arange(size_x), indexing='ij')
+        (y_old, x_old) = (newY_array.astype(int)[y], newX_array.astype(int)[x])
+        factor = newX_Ifactor_array[x]
+        # regular and double pixels are copied with an intensity factor
+        copy = factor > 0
+        rows = [np.ravel_multi_index((y[copy], x[copy]), (size_y, size_x))]
+        cols = [np.ravel_multi_index((y_old[copy], x_old[copy]), raw_shape)]
+        weights = [factor[copy]]
+        # the pixels between the chips are interpolated from their neighbours
+        interp = factor < 0
+        for shift in [-1, 1]:
+            rows.append(np.ravel_multi_index((y[interp], x[interp]), (size_y, size_x)))
+            cols.append(np.ravel_multi_index((y_old[interp], x_old[interp] + shift), raw_shape))
+            weights.append(np.full(np.sum(interp), 0.5 / self.factorIdoublePixel))
+        remap = sparse.csr_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))),
+                                        shape=(size_y * size_x, raw_shape[0] * raw_shape[1]))
+        # correct the double lines (last and 1st line of the modules, at their junction)
+        lineIndex1 = self.chip_sizeY - 1  # last line of module1 = 119, is the 1st line to correct
+        lineIndex5 = lineIndex1 + 3 + 1  # 1st line of module2 (after adding the 3 empty lines), becomes the 5th line
+        lines = sparse.identity(size_y, format='lil')
+        f = 1. / self.factorIdoublePixel
+        for (line, w1, w5) in [(lineIndex1, f, 0), (lineIndex1 + 1, f, 0), (lineIndex1 + 2, f / 2, f / 2),
+                               (lineIndex1 + 3, 0, f), (lineIndex5, 0, f)]:
+            lines[line, :] = 0
+            lines[line, lineIndex1] = w1
+            lines[line, lineIndex5] = w5
+        # the line correction applies to each column of the image
+        lines = sparse.kron(lines.tocsr(), sparse.identity(size_x), format='csr')
+        Xpad._remap_matrices[layout] = (lines.dot(remap)).tocsr()
+        return Xpad._remap_matrices[layout]
+
+    def correct_geometry(self, data):
+        '''Apply the geometrical correction to a raw image or to a stack of raw images.
+
+        The correction is a single sparse matrix product (see :py:meth:`remap_matrix`).
+
+        :param data: the raw image of shape (240, 560) for a S140 detector or a stack of raw images with the first
+            axis being the frame index.
+        :returns: the corrected image (or stack of images).
+        '''
+        remap = self.remap_matrix()
+        size_x = len(self.compute_geometry()[0])
+        data = np.asarray(data)
+        shape = (-1, remap.shape[0] // size_x, size_x)
+        if data.ndim == 2:
+            return remap.dot(data.ravel().astype(np.float64)).reshape(shape[1:])
+        frames = data.reshape((len(data), -1)).T.astype(np.float64)
+        return remap.dot(frames).T.reshape(shape)
+
     def compute_corrected_image(self):
         '''Compute a corrected image.
 
         First the intensity is corrected either via background substraction
         or flat field correction. Then tiling and double pixels are accounted
         for to obtain a proper geometry where each pixel of the image
-        represent the same physical zone.'''
+        represent the same physical zone (see :py:meth:`correct_geometry`).'''
         # now apply intensity corrections based on the value of self.correction
         if self.correction == 'bg':
             self.corr_data = self.data - self.bg
@@ -556,40 +740,7 @@ class Xpad(Detector2d):
             self.corr_data = (self.data - self.dark).astype(np.float32) / (self.ref - self.dark).astype(np.float32)
         else:
             self.corr_data = self.data.copy()
-        newX_array, newY_array, newX_Ifactor_array = self.compute_geometry()
-        image_corr1_sizeX = len(newX_array)
-        image_corr1_sizeY = len(newY_array)
-        thisCorrectedImage = np.zeros((image_corr1_sizeY, image_corr1_sizeX))
-        for y in range(0, image_corr1_sizeY):  # correct for double pixels
-            yold = newY_array[y];
-            for x in range(0, image_corr1_sizeX):
-                xold = newX_array[x]
-                Ifactor = newX_Ifactor_array[x]
-                if (Ifactor > 0):
-                    # print "pos"
-                    thisCorrectedImage[y, x] = self.corr_data[yold, xold] * Ifactor
-                if (Ifactor < 0):
-                    # print "neg"
-                    thisCorrectedImage[y, x] = (self.corr_data[yold, xold - 1] + self.corr_data[
-                        yold, xold + 1]) / 2.0 / self.factorIdoublePixel
-
-        # correct the double lines (last and 1st line of the modules, at their junction)
-        lineIndex1 = self.chip_sizeY - 1;  # last line of module1 = 119, is the 1st line to correct
-        lineIndex5 = lineIndex1 + 3 + 1;  # 1st line of module2 (after adding the 3 empty lines), becomes the 5th line tocorrect
-        lineIndex2 = lineIndex1 + 1;
-        lineIndex3 = lineIndex1 + 2;
-        lineIndex4 = lineIndex1 + 3;
-        for x in range(0, image_corr1_sizeX):
-            i1 = thisCorrectedImage[lineIndex1, x];
-            i5 = thisCorrectedImage[lineIndex5, x];
-            i1new = i1 / self.factorIdoublePixel;
-            i5new = i5 / self.factorIdoublePixel;
-            i3 = (i1new + i5new) / 2.0;
-            thisCorrectedImage[lineIndex1, x] = i1new;
-            thisCorrectedImage[lineIndex2, x] = i1new;
-            thisCorrectedImage[lineIndex3, x] = i3;
-            thisCorrectedImage[lineIndex5, x] = i5new;
-            thisCorrectedImage[lineIndex4, x] = i5new
+        thisCorrectedImage = self.correct_geometry(self.corr_data)
 
         if self.mask_flag == 1:
             double_pixel_mask = np.zeros_like(thisCorrectedImage)
@@ -640,6 +791,7 @@ class Xpad(Detector2d):
         (image_corr1_sizeX, image_corr1_sizeY) = self.corr_data.shape
         twoThArray = np.zeros_like(self.corr_data)
         psiArray = np.zeros_like(self.corr_data)
+        labArray = np.zeros((image_corr1_sizeX, image_corr1_sizeY, 3), dtype=np.float32)
 
         # converting to 2th-psi
         for x in range(0, image_corr1_sizeX):
@@ -663,6 +815,7 @@ class Xpad(Detector2d):
                 corrX = x1 * cosgamma + y1 * singamma
                 corrY = -x1 * singamma + y1 * cosgamma
                 corrZ = z1
+                labArray[x, y] = (corrX, corrY, corrZ)
                 # calculate the square values and normalization
                 corrX2 = corrX * corrX
                 corrY2 = corrY * corrY
@@ -685,4 +838,17 @@ class Xpad(Detector2d):
                 psiArray[x, y] = psi
         self.two_thetas = twoThArray
         self.psis = psiArray
+        # pixel positions (in mm) and detector normal (the direction of the pixel at the detector center)
+        self._lab_coordinates = self.pixel_size * labArray
+        self.w_dir = np.array([cosdelta * cosgamma, -cosdelta * singamma, sindelta])
         return twoThArray, psiArray
+
+    def lab_coordinates(self):
+        '''Return the laboratory coordinates of all the pixels of the corrected image.
+
+        The coordinates are computed by `compute_TwoTh_Psi_arrays` for the
+        current positions of the delta and gamma axes.
+
+        :return: a (nu, nv, 3) float32 array of the pixel centers in mm or None if the geometry is not computed yet.
+        '''
+        return self._lab_coordinates
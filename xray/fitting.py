@@ -15,10 +15,17 @@
       :align: center
 
       Plot of the main predefined fitting function in the fitting module.
+
+  Large numbers of profiles (for instance from a mapping scan) can be fitted
+  at once with a sum of Gaussian, Lorentzian, pseudo-Voigt or Voigt peaks
+  with the vectorized `fit_profiles` function.
 '''
-from scipy import optimize
-from scipy.special import wofz
 import numpy as np
+from pymicro.lazy import lazy_import
+from pymicro.parallel import chunk_ranges, map_chunks
+
+optimize = lazy_import('scipy.optimize')
+special = lazy_import('scipy.special')
 
 
 def fit(y, x=None, expression=None, nb_params=None, init=None):
@@ -114,6 +121,8 @@ class FitFunction:
     You may subclass it to create your own fitting function just as the
     predfined fit function do (see `Gaussian` for instance).
     '''
+    # name of the analytic profile (see `profile_model`) used to compute the derivatives in `fit`
+    profile = None
 
     def __init__(self):
         self.parameters = []
@@ -167,45 +176,36 @@ class FitFunction:
 
         **verbose**: boolean, activate verbose mode
         '''
-        # local function to evaluate the cost
-        global it
-        it = 0
+        # the iteration counter is local to this fit
+        iteration = [0]
 
         def cost_func(new_params):
-            global it
             p = self.get_parameters()
             if verbose:
-                print 'iteration %d, trying parameters:' % it, p
-                it += 1
-                '''
-                from matplotlib import pyplot as plt
-                if it == 0:
-                  plt.plot(x, y, 'bo', label = 'data points')
-                  plt.ylim(0, 0.6)
-                  plt.grid()
-                  plt.legend(numpoints=1,loc='upper left')
-                  plt.savefig('fit/fit_%02d.pdf' % it)
-                it += 1
-                plt.clf()
-                plt.plot(x, y, 'bo', label = 'data points')
-                plt.plot(x, self(x), 'k-', label = 'gaussian fit')
-                plt.ylim(0, 0.6)
-                plt.title('fitting iteration %02d' % it)
-                plt.legend(numpoints=1,loc='upper left')
-                plt.savefig('fit/fit_%02d.pdf' % it)
-                '''
+                print 'iteration %d, trying parameters:' % iteration[0], p
+                iteration[0] += 1
             for i, pi in enumerate(p):
                 pi.set(new_params[i])
             return y - self(x)
 
         if x is None: x = np.arange(y.shape[0])
         p = [param.value for param in self.get_parameters()]
-        optimize.leastsq(cost_func, p, Dfun=None, xtol=1.e-6)
+        Dfun = None
+        if self.profile is not None:
+            # analytic derivatives of the predefined profiles
+            profile_func = _profiles[self.profile][0]
+
+            def Dfun(new_params):
+                return -profile_func(x[np.newaxis], np.array(new_params, dtype=float)[np.newaxis], True)[1][0]
+
+        optimize.leastsq(cost_func, p, Dfun=Dfun, xtol=1.e-6)
 
 
 class Gaussian(FitFunction):
     '''first parameter is position, second is sigma, third is height'''
 
+    profile = 'Gaussian'
+
     def __init__(self, position=0.0, sigma=1.0, height=1.0):
         FitFunction.__init__(self)
 
@@ -242,6 +242,8 @@ class Lorentzian(FitFunction):
     of the function is given by height_factor/(pi*gamma). The FWHM is just 2*gamma.
     '''
 
+    profile = 'Lorentzian'
+
     def __init__(self, position=0.0, gamma=1.0, height_factor=1.0):
         FitFunction.__init__(self)
 
@@ -302,12 +304,14 @@ class Voigt(FitFunction):
     in scipy with the wofz function.
     '''
 
+    profile = 'Voigt'
+
     def __init__(self, position=0.0, sigma=1.0, gamma=1.0, height_factor=1.0):
         FitFunction.__init__(self)
 
         def V(x, p):
             z = (x - p[0].value + 1j * p[2].value) / (p[1].value * np.sqrt(2))
-            return p[3].value * wofz(z).real / (p[1].value * np.sqrt(2 * np.pi))
+            return p[3].value * special.wofz(z).real / (p[1].value * np.sqrt(2 * np.pi))
 
         self.expression = V
         self.add_parameter(position, 'position')
@@ -342,3 +346,343 @@ class Voigt(FitFunction):
         fg = 2 * p[1].value * np.sqrt(2 * np.log(2))
         fl = 2 * p[2].value
         return 0.5346 * fl + np.sqrt(0.2166 * fl ** 2 + fg ** 2)
+
+
+def _gaussian(x, p, jacobian=False):
+    '''Gaussian profiles :math:`h\\exp(-((x-x_0)/\\sigma)^2)` with parameters (position, sigma, height).'''
+    (x0, sigma, h) = (p[:, 0:1], p[:, 1:2], p[:, 2:3])
+    u = (x - x0) / sigma
+    e = np.exp(-u ** 2)
+    f = h * e
+    if not jacobian:
+        return f, None
+    return f, np.stack((2 * f * u / sigma, 2 * f * u ** 2 / sigma, e), axis=-1)
+
+
+def _lorentzian(x, p, jacobian=False):
+    '''Lorentzian profiles :math:`A\\gamma/\\pi/((x-x_0)^2+\\gamma^2)` with parameters (position, gamma,
+    height_factor).'''
+    (x0, gamma, a) = (p[:, 0:1], p[:, 1:2], p[:, 2:3])
+    d = x - x0
+    D = d ** 2 + gamma ** 2
+    f = a * gamma / (np.pi * D)
+    if not jacobian:
+        return f, None
+    return f, np.stack((2 * f * d / D, a / (np.pi * D) - 2 * f * gamma / D, gamma / (np.pi * D)), axis=-1)
+
+
+def _pseudo_voigt(x, p, jacobian=False):
+    '''Pseudo-Voigt profiles, a mixing of a Lorentzian and a Gaussian of the same half width at half maximum w,
+    with parameters (position, w, height, eta).'''
+    (x0, w, h, eta) = (p[:, 0:1], p[:, 1:2], p[:, 2:3], p[:, 3:4])
+    u = (x - x0) / w
+    L = 1. / (1. + u ** 2)
+    G = np.exp(-np.log(2) * u ** 2)
+    shape = eta * L + (1 - eta) * G
+    f = h * shape
+    if not jacobian:
+        return f, None
+    df_du = -2 * h * u * (eta * L ** 2 + (1 - eta) * np.log(2) * G)
+    return f, np.stack((-df_du / w, -df_du * u / w, shape, h * (L - G)), axis=-1)
+
+
+def _voigt(x, p, jacobian=False):
+    '''Voigt profiles :math:`A\\,\\mathrm{Re}(w(z))/(\\sigma\\sqrt{2\\pi})` with :math:`z=(x-x_0+i\\gamma)/
+    (\\sigma\\sqrt{2})` and parameters (position, sigma, gamma, height_factor).
+
+    The derivatives use the derivative of the Faddeeva function :math:`w'(z)=-2zw(z)+2i/\\sqrt{\\pi}`.
+    '''
+    (x0, sigma, gamma, a) = (p[:, 0:1], p[:, 1:2], p[:, 2:3], p[:, 3:4])
+    s2 = sigma * np.sqrt(2)
+    z = (x - x0 + 1j * gamma) / s2
+    w = special.wofz(z)
+    norm = 1. / (sigma * np.sqrt(2 * np.pi))
+    shape = w.real * norm
+    f = a * shape
+    if not jacobian:
+        return f, None
+    dw = -2 * z * w + 2j / np.sqrt(np.pi)
+    J = np.stack((-a * norm * dw.real / s2,
+                  -a * norm * (dw * z).real / sigma - f / sigma,
+                  -a * norm * dw.imag / s2,
+                  shape), axis=-1)
+    return f, J
+
+
+# profile functions and number of parameters of each peak
+_profiles = {'Gaussian': (_gaussian, 3),
+             'Lorentzian': (_lorentzian, 3),
+             'PseudoVoigt': (_pseudo_voigt, 4),
+             'Voigt': (_voigt, 4)}
+
+
+def _constrain(params, profile, n_peaks):
+    '''Keep the widths positive and the pseudo-Voigt mixing parameter in [0, 1].'''
+    k = _profiles[profile][1]
+    peaks = params[:, :n_peaks * k].reshape((len(params), n_peaks, k))
+    peaks[:, :, 1] = np.abs(peaks[:, :, 1])
+    if profile == 'Voigt':
+        peaks[:, :, 2] = np.abs(peaks[:, :, 2])
+    elif profile == 'PseudoVoigt':
+        peaks[:, :, 3] = np.clip(peaks[:, :, 3], 0., 1.)
+    params[:, :n_peaks * k] = peaks.reshape((len(params), -1))
+    return params
+
+
+def profile_model(x, params, profile='Gaussian', n_peaks=1, n_background=0, jacobian=False):
+    '''Evaluate a series of multi-peak profiles and their derivatives.
+
+    Each profile is the sum of `n_peaks` peaks of the same type and of a
+    polynomial background with `n_background` coefficients
+    :math:`b_0 + b_1x + ...`. The parameters of a profile are the
+    parameters of each peak followed by the background coefficients:
+
+     * Gaussian: (position, sigma, height), see :py:class:`Gaussian`
+     * Lorentzian: (position, gamma, height_factor), see :py:class:`Lorentzian`
+     * PseudoVoigt: (position, hwhm, height, eta), eta being the Lorentzian fraction
+     * Voigt: (position, sigma, gamma, height_factor), see :py:class:`Voigt`
+
+    :param x: the coordinates, a (N,) array shared by all the profiles or a (M, N) array.
+    :param params: a (M, P) array of the parameters of the M profiles.
+    :param str profile: the type of peaks ('Gaussian' by default).
+    :param int n_peaks: the number of peaks in each profile (1 by default).
+    :param int n_background: the number of coefficients of the polynomial background (0 by default).
+    :param bool jacobian: also compute the derivatives with respect to the parameters.
+    :returns tuple (f, J): the (M, N) array of the profiles and the (M, N, P) array of their derivatives (None if
+        jacobian is False).
+    '''
+    if profile not in _profiles:
+        raise ValueError('unknown profile %s, choose among %s' % (profile, ', '.join(sorted(_profiles.keys()))))
+    (func, k) = _profiles[profile]
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    (M, N) = (len(params), x.shape[1])
+    f = np.zeros((M, N))
+    J = np.empty((M, N, params.shape[1])) if jacobian else None
+    for i in range(n_peaks):
+        (fi, Ji) = func(x, params[:, i * k:(i + 1) * k], jacobian)
+        f += fi
+        if jacobian:
+            J[:, :, i * k:(i + 1) * k] = Ji
+    for j in range(n_background):
+        xj = x ** j
+        f += params[:, n_peaks * k + j:n_peaks * k + j + 1] * xj
+        if jacobian:
+            J[:, :, n_peaks * k + j] = xj
+    return f, J
+
+
+def _levenberg_marquardt(x, y, params, profile, n_peaks, n_background, max_iterations=100, tol=1.e-8):
+    '''Fit a series of profiles at once with the Levenberg-Marquardt algorithm.
+
+    All the profiles are iterated together: the normal equations are built
+    and solved for all the profiles still running with stacked linear
+    algebra, and each profile has its own damping factor. A profile stops
+    when the relative decrease of its cost is below `tol` or when no step
+    decreases the cost anymore.
+
+    :returns tuple (params, cost, converged): the fitted parameters, the sums of squared residuals and the mask of
+        the converged profiles.
+    '''
+    params = _constrain(np.array(params, dtype=float), profile, n_peaks)
+    (M, P) = params.shape
+    x = np.atleast_2d(x)
+    (f, J) = profile_model(x, params, profile, n_peaks, n_background, jacobian=True)
+    r = f - y
+    cost = np.sum(r ** 2, axis=1)
+    lam = 1.e-3 * np.ones(M)
+    converged = np.zeros(M, dtype=bool)
+    active = np.nonzero(np.isfinite(cost))[0]
+    eye = np.eye(P)
+    for iteration in range(max_iterations):
+        if len(active) == 0:
+            break
+        xa = x if len(x) == 1 else x[active]
+        Ja = J[active]
+        A = np.einsum('mni,mnj->mij', Ja, Ja)
+        g = np.einsum('mni,mn->mi', Ja, r[active])
+        d = np.diagonal(A, axis1=1, axis2=2) + np.finfo(float).eps
+        A_damped = A + lam[active, np.newaxis, np.newaxis] * d[:, np.newaxis, :] * eye
+        try:
+            delta = np.linalg.solve(A_damped, -g[:, :, np.newaxis])[:, :, 0]
+        except np.linalg.LinAlgError:
+            delta = np.array([np.linalg.lstsq(A_damped[m], -g[m], rcond=None)[0] for m in range(len(active))])
+        new_params = _constrain(params[active] + delta, profile, n_peaks)
+        (f_new, J_new) = profile_model(xa, new_params, profile, n_peaks, n_background, jacobian=True)
+        r_new = f_new - y[active]
+        cost_new = np.sum(r_new ** 2, axis=1)
+        better = cost_new < cost[active]
+        small = better & (cost[active] - cost_new <= tol * cost[active])
+        accepted = active[better]
+        params[accepted] = new_params[better]
+        r[accepted] = r_new[better]
+        J[accepted] = J_new[better]
+        cost[accepted] = cost_new[better]
+        lam[accepted] *= 0.1
+        lam[active[~better]] *= 10.
+        done = small | (lam[active] > 1.e10)
+        converged[active[done]] = True
+        active = active[~done]
+    return params, cost, converged
+
+
+def guess_peak(x, y, profile='Gaussian'):
+    '''Estimate the parameters of a single peak from the data.
+
+    The position is the location of the maximum, the height is the
+    difference between the maximum and the minimum and the half width at
+    half maximum is estimated by the number of points above half the height.
+
+    :param x: the (N,) array of coordinates.
+    :param y: the (N,) or (M, N) array of the profiles.
+    :param str profile: the type of peak ('Gaussian' by default).
+    :returns: a (M, k) array of the peak parameters (k being the number of parameters of the profile).
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.atleast_2d(y)
+    (y_min, y_max) = (y.min(axis=1), y.max(axis=1))
+    h = y_max - y_min
+    x0 = x[np.argmax(y, axis=1)]
+    step = np.abs(x[-1] - x[0]) / max(len(x) - 1, 1)
+    hwhm = np.maximum(0.5 * np.sum(y - y_min[:, np.newaxis] > 0.5 * h[:, np.newaxis], axis=1), 1.) * step
+    return peak_parameters(x0, hwhm, h, profile)
+
+
+def peak_parameters(position, hwhm, height, profile='Gaussian'):
+    '''Compute the parameters of a series of peaks from their position, width and height.
+
+    :param position: the positions of the peaks.
+    :param hwhm: the half widths at half maximum of the peaks.
+    :param height: the heights of the peaks.
+    :param str profile: the type of peak ('Gaussian' by default, see :py:func:`profile_model`).
+    :returns: a (M, k) array of the peak parameters (k being the number of parameters of the profile).
+    '''
+    (x0, hwhm, h) = (np.atleast_1d(position), np.atleast_1d(hwhm), np.atleast_1d(height))
+    if profile == 'Gaussian':
+        return np.stack((x0, hwhm / np.sqrt(np.log(2)), h), axis=-1)
+    elif profile == 'Lorentzian':
+        return np.stack((x0, hwhm, h * np.pi * hwhm), axis=-1)
+    elif profile == 'PseudoVoigt':
+        return np.stack((x0, hwhm, h, 0.5 * np.ones_like(h)), axis=-1)
+    elif profile == 'Voigt':
+        (sigma, gamma) = (hwhm / np.sqrt(2 * np.log(2)) / 2, hwhm / 2)
+        maxi = special.wofz(1j * gamma / (sigma * np.sqrt(2))).real / (sigma * np.sqrt(2 * np.pi))
+        return np.stack((x0, sigma, gamma, h / maxi), axis=-1)
+    raise ValueError('unknown profile %s, choose among %s' % (profile, ', '.join(sorted(_profiles.keys()))))
+
+
+# state of the profile fitting (see :py:func:`~pymicro.parallel.map_chunks`)
+_fit_profiles_state = {}
+
+
+def _init_fit_profiles(state):
+    '''Initialize the state of a profile fitting.'''
+    _fit_profiles_state.clear()
+    _fit_profiles_state.update(state)
+
+
+def _fit_profiles_chunk(indices):
+    '''Fit a range of profiles, row by row (worker function of :py:func:`fit_profiles`).'''
+    state = _fit_profiles_state
+    (start, stop) = (indices[0], indices[-1] + 1)
+    (x, y, init) = (state['x'], state['profiles'][start:stop], state['init'][start:stop])
+    if x.ndim == 2:
+        x = x[start:stop]
+    options = (state['profile'], state['n_peaks'], state['n_background'], state['max_iterations'], state['tol'])
+    row_length = state['row_length']
+    if row_length is None:
+        return _levenberg_marquardt(x, y, init, *options)
+    params = np.empty_like(init)
+    cost = np.empty(len(y))
+    converged = np.zeros(len(y), dtype=bool)
+    for i in range(0, len(y), row_length):
+        row = slice(i, min(i + row_length, len(y)))
+        n = row.stop - row.start
+        xr = x if x.ndim == 1 else x[row]
+        p0 = init[row].copy()
+        if i > 0:
+            # warm start from the fits of the previous row
+            previous = slice(row.start - row_length, row.start - row_length + n)
+            p0[converged[previous]] = params[previous][converged[previous]]
+        (params[row], cost[row], converged[row]) = _levenberg_marquardt(xr, y[row], p0, *options)
+        if i > 0:
+            # fit again from the initial guess where the warm start failed
+            failed = np.nonzero(~converged[row])[0]
+            if len(failed):
+                (p, c, ok) = _levenberg_marquardt(xr if x.ndim == 1 else xr[failed], y[row][failed],
+                                                  init[row][failed], *options)
+                better = ok | (c < cost[row][failed])
+                params[row.start + failed[better]] = p[better]
+                cost[row.start + failed[better]] = c[better]
+                converged[row.start + failed[better]] = ok[better]
+    return params, cost, converged
+
+
+def fit_profiles(x, profiles, init=None, profile='Gaussian', n_peaks=1, n_background=0, row_length=None,
+                 max_iterations=100, tol=1.e-8, n_processes=1, chunk_size=None, verbose=False):
+    '''Fit a large number of profiles with a sum of peaks.
+
+    This is meant to process the thousands of profiles of a mapping scan
+    (for instance the integrated patterns used to build a strain map). The
+    profiles are fitted together with a vectorized Levenberg-Marquardt
+    algorithm using the analytic derivatives of the peak functions (see
+    :py:func:`profile_model`). The profiles can be split into chunks
+    processed by a pool of processes.
+
+    If the profiles come from a raster scan with rows of `row_length`
+    points, the rows are fitted one after the other and each profile starts
+    from the fitted parameters of its neighbour in the previous row (warm
+    start), which is usually much closer to the solution than a generic
+    initial guess. The profiles for which the warm start fails are fitted
+    again from the initial guess.
+
+    ::
+
+      x = np.linspace(3., 5., 200)
+      params, cost, converged = fit_profiles(x, profiles, profile='PseudoVoigt', n_background=1, row_length=100)
+
+    :param x: the coordinates, a (N,) array shared by all the profiles or a (M, N) array.
+    :param profiles: the (M, N) array of the profiles to fit.
+    :param init: the initial parameters, a (P,) array used for all the profiles or a (M, P) array; if None, the
+        parameters of a single peak are estimated from each profile (see :py:func:`guess_peak`).
+    :param str profile: the type of peaks, 'Gaussian' (default), 'Lorentzian', 'PseudoVoigt' or 'Voigt'.
+    :param int n_peaks: the number of peaks in each profile (1 by default).
+    :param int n_background: the number of coefficients of the polynomial background (0 by default).
+    :param int row_length: the number of profiles in a row of a raster scan to warm start the fits (None by
+        default, all the profiles start from the initial parameters).
+    :param int max_iterations: the maximum number of iterations (100 by default).
+    :param float tol: the tolerance on the relative decrease of the cost.
+    :param int n_processes: the number of processes to use (1 by default).
+    :param int chunk_size: the number of profiles fitted in a single task (a multiple of the row length).
+    :param bool verbose: activate verbose mode (False by default).
+    :raise ValueError: if the initial parameters are not specified for a multi-peak profile.
+    :returns tuple (params, cost, converged): the (M, P) array of the fitted parameters, the (M,) array of the sums
+        of squared residuals and the (M,) boolean array of the converged fits.
+    '''
+    if profile not in _profiles:
+        raise ValueError('unknown profile %s, choose among %s' % (profile, ', '.join(sorted(_profiles.keys()))))
+    x = np.asarray(x, dtype=float)
+    profiles = np.atleast_2d(np.asarray(profiles, dtype=float))
+    M = len(profiles)
+    if init is None:
+        if n_peaks != 1:
+            raise ValueError('the initial parameters must be specified to fit %d peaks' % n_peaks)
+        init = np.hstack((guess_peak(x if x.ndim == 1 else x[0], profiles, profile), np.zeros((M, n_background))))
+        if n_background > 0:
+            init[:, _profiles[profile][1]] = profiles.min(axis=1)
+    init = np.array(np.broadcast_to(np.asarray(init, dtype=float), (M, np.shape(init)[-1])))
+    P = n_peaks * _profiles[profile][1] + n_background
+    if init.shape[1] != P:
+        raise ValueError('%d initial parameters given, %d expected' % (init.shape[1], P))
+    state = {'x': x, 'profiles': profiles, 'init': init, 'profile': profile, 'n_peaks': n_peaks,
+             'n_background': n_background, 'row_length': row_length, 'max_iterations': max_iterations, 'tol': tol}
+    # the chunks contain whole rows of the map for the warm start
+    chunks = chunk_ranges(M, n_processes, chunk_size, multiple=row_length)
+    results = map_chunks(_fit_profiles_chunk, chunks, state, _init_fit_profiles, _fit_profiles_state.clear,
+                         n_processes, 'fitting profiles %d to %d' if verbose else None)
+    params = np.concatenate([result[0] for result in results])
+    cost = np.concatenate([result[1] for result in results])
+    converged = np.concatenate([result[2] for result in results])
+    if verbose:
+        print('%d profiles fitted, %d converged' % (M, np.sum(converged)))
+    return params, cost, converged
@@ -0,0 +1,479 @@
+"""The integration module provides a fast azimuthal integrator for 2D detector images.
+
+The integration of a detector image is a linear operation: each bin of the
+resulting profile is a weighted sum of the pixel intensities. The weights
+only depend on the detector geometry so they are computed once and stored
+in a sparse matrix (with one row per bin and one column per pixel). The
+integration of a frame is then a single sparse matrix-vector product and
+a stack of frames is integrated with a single sparse matrix-matrix product::
+
+  mar.compute_TwoTh_Psi_arrays()
+  integrator = AzimuthalIntegrator.from_detector(mar)
+  two_theta_values, intensity, counts = integrator.integrate(mar.corr_data, n_bins=2000)
+
+The same approach is used to regroup the images in 2D as a function of
+2theta and of the azimuthal angle psi (caking), optionally splitting each
+pixel between the bins it overlaps::
+
+  two_theta_values, psi_values, cakes, counts = integrator.cake(frames, n_two_theta=500, n_psi=360)
+
+The lookup matrices are cached in memory and on the disk (see
+:py:func:`~pymicro.file.file_utils.get_cache_dir`) so they are computed
+only once for a given geometry and mask.
+"""
+import os
+import hashlib
+import numpy as np
+from pymicro.file.file_utils import get_cache_dir
+from pymicro.lazy import lazy_import
+
+sparse = lazy_import('scipy.sparse')
+
+
+def _pixel_extents(values, period=None):
+    '''Estimate the range of a geometrical quantity covered by each pixel.
+
+    The value of the quantity at a pixel corner is the mean of the values at
+    the 4 pixel centers around it (linearly extrapolated at the borders of
+    the detector). The range covered by a pixel is then given by the
+    minimum and maximum values at its 4 corners.
+
+    :param values: the 2D array of the quantity at the pixel centers.
+    :param float period: the period of the quantity if it is an angle which wraps (eg 360).
+    :returns tuple: the 2D arrays of the minimum and maximum values relative to the pixel centers.
+    '''
+    padded = np.pad(values, 1, mode='reflect', reflect_type='odd')
+    (n0, n1) = values.shape
+
+    def delta(di, dj):
+        d = padded[1 + di:1 + di + n0, 1 + dj:1 + dj + n1] - values
+        if period is not None:
+            # the difference between two angles is taken in [-period/2, period/2]
+            d = np.mod(d + 0.5 * period, period) - 0.5 * period
+        return d
+
+    lo = hi = np.zeros_like(values)
+    with np.errstate(invalid='ignore'):
+        for (ci, cj) in [(-1, -1), (-1, 1), (1, -1), (1, 1)]:
+            corner = 0.25 * (delta(ci, cj) + delta(ci, 0) + delta(0, cj))
+            # corners next to undefined values are ignored
+            (lo, hi) = (np.fmin(lo, corner), np.fmax(hi, corner))
+    return lo, hi
+
+
+def _split_pixels(lo, hi, v_min, step, n_bins):
+    '''Distribute pixels covering the intervals [lo, hi] over regular bins.
+
+    :param lo: the (P,) array of the lower bounds of the pixels.
+    :param hi: the (P,) array of the upper bounds of the pixels.
+    :param float v_min: the lower bound of the first bin.
+    :param float step: the width of the bins.
+    :param int n_bins: the number of bins.
+    :returns tuple: the arrays of the pixel indices (in [0, P)), of the bin indices and of the fraction of each pixel
+        falling in each bin, sorted by pixel.
+    '''
+    first = np.clip(np.floor((lo - v_min) / step), -1, n_bins).astype(np.int64)
+    last = np.clip(np.floor((hi - v_min) / step), -1, n_bins).astype(np.int64)
+    span = last - first + 1
+    pixels = np.repeat(np.arange(len(lo)), span)
+    bins = first[pixels] + np.arange(len(pixels)) - np.repeat(np.cumsum(span) - span, span)
+    width = (hi - lo)[pixels]
+    overlap = np.minimum(hi[pixels], v_min + (bins + 1) * step) - np.maximum(lo[pixels], v_min + bins * step)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.where(width > 0, overlap / width, 1.)
+    keep = (bins >= 0) & (bins < n_bins) & (fraction > 0)
+    return pixels[keep], bins[keep], fraction[keep]
+
+
+class AzimuthalIntegrator:
+    '''Class to integrate detector images as a function of the scattering angle.
+
+    The integrator is built with the (2theta, psi) arrays describing the
+    detector geometry, for instance computed by the `compute_TwoTh_Psi_arrays`
+    method of a detector. The pixels to exclude from the integration can be
+    specified with a mask. The intensity corrections use the laboratory
+    coordinates of the pixels and the detector normal when they are known,
+    so that tilted detectors are properly handled.
+    '''
+
+    def __init__(self, two_thetas, psis=None, mask=None, use_cache=True, lab_coordinates=None, normal=None):
+        '''Create a new integrator.
+
+        :param two_thetas: the array of the 2theta values of the pixels in degrees.
+        :param psis: the array of the azimuthal angles of the pixels in degrees (needed to select a psi range or
+            for caking).
+        :param mask: an optional boolean array of the pixels to exclude (True for the excluded pixels).
+        :param bool use_cache: store the lookup matrices on the disk (True by default).
+        :param lab_coordinates: an optional array of the positions of the pixels in mm (with an extra last axis of
+            size 3) in the laboratory frame, the sample being at the origin.
+        :param normal: the normal to the detector plane, needed with the laboratory coordinates.
+        :raise ValueError: if the laboratory coordinates do not match the geometry arrays or if the normal is missing.
+        '''
+        self.shape = np.shape(two_thetas)
+        self.two_thetas = np.asarray(two_thetas, dtype=np.float64).ravel()
+        self.psis = None if psis is None else np.asarray(psis, dtype=np.float64).ravel()
+        self.mask = None if mask is None else np.asarray(mask, dtype=bool).ravel()
+        self.lab_coordinates = None
+        self.normal = None
+        if lab_coordinates is not None:
+            lab_coordinates = np.asarray(lab_coordinates, dtype=np.float64)
+            if lab_coordinates.shape != self.shape + (3,):
+                raise ValueError('the laboratory coordinates must have a shape %s, got %s'
+                                 % (self.shape + (3,), lab_coordinates.shape))
+            if normal is None:
+                raise ValueError('the detector normal is needed with the laboratory coordinates')
+            self.lab_coordinates = lab_coordinates.reshape((-1, 3))
+            self.normal = np.asarray(normal, dtype=np.float64) / np.linalg.norm(normal)
+        self.use_cache = use_cache
+        self._geometry_hash = None
+        self._matrices = {}
+        self._corrections = {}
+
+    @staticmethod
+    def from_detector(detector, mask=None, use_cache=True):
+        '''Create an integrator with the geometry of a detector.
+
+        The `compute_TwoTh_Psi_arrays` method of the detector must have been
+        called first. If the corrected image of the detector is a masked array,
+        its mask is used (unless a mask is specified). The laboratory
+        coordinates of the pixels and the detector normal are used for the
+        intensity corrections if the detector provides them (and if the
+        detector plane does not go through the sample); the scattering angles
+        of the detector must then have been computed with the same geometry,
+        for instance with :py:func:`~pymicro.xray.calibration.scattering_angles`.
+
+        :param detector: the :py:class:`~pymicro.xray.detectors.Detector2d` instance.
+        :param mask: an optional boolean array of the pixels to exclude.
+        :param bool use_cache: store the lookup matrices on the disk (True by default).
+        :returns: a new `AzimuthalIntegrator` instance.
+        :raise ValueError: if the scattering angles of the detector do not match its laboratory coordinates.
+        '''
+        if mask is None and np.ma.isMaskedArray(getattr(detector, 'corr_data', None)):
+            mask = np.ma.getmaskarray(detector.corr_data)
+        (xyz, normal) = (None, getattr(detector, 'w_dir', None))
+        if normal is not None and hasattr(detector, 'lab_coordinates'):
+            xyz = detector.lab_coordinates()
+            if xyz is not None and (np.shape(xyz)[:-1] != np.shape(detector.two_thetas) or
+                                    abs(np.dot(xyz[0, 0], normal)) < 1.e-9):
+                xyz = None
+        if xyz is not None:
+            two_thetas = np.degrees(np.arctan2(np.hypot(xyz[..., 1], xyz[..., 2]), xyz[..., 0]))
+            error = np.nanmax(np.abs(two_thetas - detector.two_thetas))
+            if not error < 1.e-3:
+                raise ValueError('the scattering angles of the detector differ by up to %.3g degrees from its '
+                                 'laboratory coordinates' % error)
+        return AzimuthalIntegrator(detector.two_thetas, detector.psis, mask=mask, use_cache=use_cache,
+                                   lab_coordinates=xyz, normal=normal if xyz is not None else None)
+
+    def geometry_hash(self):
+        '''Return a hash string identifying the geometry and the mask of this integrator.'''
+        if self._geometry_hash is None:
+            md5 = hashlib.md5()
+            md5.update(str(self.shape))
+            for array in [self.two_thetas, self.psis, self.mask]:
+                md5.update(np.ascontiguousarray(array).data if array is not None else 'None')
+            self._geometry_hash = md5.hexdigest()
+        return self._geometry_hash
+
+    def _range(self, values, value_range):
+        '''Return the (min, max) range as a tuple of floats (the full range of the values by default).'''
+        if value_range is None:
+            value_range = (np.nanmin(values), np.nanmax(values))
+        return float(value_range[0]), float(value_range[1])
+
+    def _cached_matrix(self, key, build):
+        '''Return a lookup matrix from the memory or disk cache, or build it with the given function.'''
+        if key not in self._matrices:
+            matrix = None
+            if self.use_cache:
+                key_hash = hashlib.md5(self.geometry_hash() + repr(key)).hexdigest()
+                cache_path = os.path.join(get_cache_dir(), 'azimuthal_%s.npz' % key_hash)
+                if os.path.exists(cache_path):
+                    matrix = sparse.load_npz(cache_path).tocsr()
+            if matrix is None:
+                matrix = build()
+                if self.use_cache:
+                    sparse.save_npz(cache_path, matrix)
+            self._matrices[key] = matrix
+        return self._matrices[key]
+
+    def _valid_pixels(self, two_theta_range, psi_range):
+        '''Return the mask of the pixels to integrate.'''
+        valid = np.isfinite(self.two_thetas)
+        valid &= (self.two_thetas >= two_theta_range[0]) & (self.two_thetas <= two_theta_range[1])
+        if psi_range is not None:
+            valid &= (self.psis >= psi_range[0]) & (self.psis <= psi_range[1])
+        if self.mask is not None:
+            valid &= ~self.mask
+        return valid
+
+    def _pixel_ranges(self, pixels, split_pixels, with_psi=False):
+        '''Return the (2theta, psi) ranges covered by the given pixels (zero width without pixel splitting).'''
+        ranges = []
+        for (values, period) in [(self.two_thetas, None), (self.psis, 360.)][:1 + with_psi]:
+            centers = values[pixels]
+            if split_pixels:
+                if len(self.shape) != 2:
+                    raise ValueError('pixel splitting needs 2D geometry arrays, got shape %s' % (self.shape,))
+                (lo, hi) = _pixel_extents(values.reshape(self.shape), period=period)
+                ranges.append((centers + lo.ravel()[pixels], centers + hi.ravel()[pixels]))
+            else:
+                ranges.append((centers, centers))
+        return ranges
+
+    def _build_matrix(self, n_bins, two_theta_range, psi_range, split_pixels):
+        '''Compute the (n_bins, n_pixels) lookup matrix assigning each pixel to the 2theta bins.'''
+        if split_pixels:
+            # the pixels are selected on their center but may contribute to bins outside of the 2theta range
+            valid = self._valid_pixels((-np.inf, np.inf), psi_range)
+        else:
+            valid = self._valid_pixels(two_theta_range, psi_range)
+        pixels = np.flatnonzero(valid)
+        step = (two_theta_range[1] - two_theta_range[0]) / float(n_bins)
+        ((lo, hi),) = self._pixel_ranges(pixels, split_pixels)
+        if not split_pixels:
+            # the upper bound belongs to the last bin
+            lo = hi = np.where(lo == two_theta_range[1], lo - 0.5 * step, lo)
+        (p, bins, weights) = _split_pixels(lo, hi, two_theta_range[0], step, n_bins)
+        return sparse.csr_matrix((weights.astype(np.float32), (bins, pixels[p])),
+                                 shape=(n_bins, len(self.two_thetas)))
+
+    def lookup_matrix(self, n_bins=1000, two_theta_range=None, psi_range=None, split_pixels=False):
+        '''Return the lookup matrix for the given binning.
+
+        The matrix is computed once and cached in memory and on the disk.
+
+        :param int n_bins: the number of 2theta bins (1000 by default).
+        :param tuple two_theta_range: the (min, max) 2theta values in degrees (the full range by default).
+        :param tuple psi_range: an optional (min, max) range of psi values in degrees.
+        :param bool split_pixels: split the pixels between all the bins they overlap (False by default).
+        :returns tuple: the sparse matrix in CSR format and the array of the 2theta bin centers.
+        '''
+        two_theta_range = self._range(self.two_thetas, two_theta_range)
+        if psi_range is not None:
+            psi_range = (float(psi_range[0]), float(psi_range[1]))
+        key = (n_bins, two_theta_range, psi_range) + (('split',) if split_pixels else ())
+        matrix = self._cached_matrix(key, lambda: self._build_matrix(n_bins, two_theta_range, psi_range,
+                                                                     split_pixels))
+        edges = np.linspace(two_theta_range[0], two_theta_range[1], n_bins + 1)
+        return matrix, 0.5 * (edges[:-1] + edges[1:])
+
+    def _build_cake_matrix(self, n_two_theta, n_psi, two_theta_range, psi_range, split_pixels):
+        '''Compute the (n_psi * n_two_theta, n_pixels) lookup matrix of the 2D regrouping.'''
+        valid = np.isfinite(self.two_thetas) & np.isfinite(self.psis)
+        if self.mask is not None:
+            valid &= ~self.mask
+        pixels = np.flatnonzero(valid)
+        ((tt_lo, tt_hi), (psi_lo, psi_hi)) = self._pixel_ranges(pixels, split_pixels, with_psi=True)
+        tt_step = (two_theta_range[1] - two_theta_range[0]) / float(n_two_theta)
+        psi_step = (psi_range[1] - psi_range[0]) / float(n_psi)
+        if not split_pixels:
+            # the upper bounds belong to the last bins
+            tt_lo = tt_hi = np.where(tt_lo == two_theta_range[1], tt_lo - 0.5 * tt_step, tt_lo)
+            psi_lo = psi_hi = np.where(psi_lo == psi_range[1], psi_lo - 0.5 * psi_step, psi_lo)
+        (p_tt, b_tt, w_tt) = _split_pixels(tt_lo, tt_hi, two_theta_range[0], tt_step, n_two_theta)
+        (p_psi, b_psi, w_psi) = _split_pixels(psi_lo, psi_hi, psi_range[0], psi_step, n_psi)
+        # combine the 2theta and psi bins of each pixel (both lists are sorted by pixel)
+        n_tt_bins = np.bincount(p_tt, minlength=len(pixels))
+        n_psi_bins = np.bincount(p_psi, minlength=len(pixels))
+        n_pairs = n_tt_bins * n_psi_bins
+        pair_pixels = np.repeat(np.arange(len(pixels)), n_pairs)
+        k = np.arange(len(pair_pixels)) - np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+        i_tt = np.repeat(np.cumsum(n_tt_bins) - n_tt_bins, n_pairs) + k // n_psi_bins[pair_pixels]
+        i_psi = np.repeat(np.cumsum(n_psi_bins) - n_psi_bins, n_pairs) + k % n_psi_bins[pair_pixels]
+        rows = b_psi[i_psi] * n_two_theta + b_tt[i_tt]
+        weights = (w_tt[i_tt] * w_psi[i_psi]).astype(np.float32)
+        return sparse.csr_matrix((weights, (rows, pixels[pair_pixels])),
+                                 shape=(n_psi * n_two_theta, len(self.two_thetas)))
+
+    def cake_matrix(self, n_two_theta=500, n_psi=360, two_theta_range=None, psi_range=None, split_pixels=True):
+        '''Return the lookup matrix for the 2D regrouping (caking).
+
+        The matrix is computed once and cached in memory and on the disk.
+
+        :param int n_two_theta: the number of 2theta bins (500 by default).
+        :param int n_psi: the number of psi bins (360 by default).
+        :param tuple two_theta_range: the (min, max) 2theta values in degrees (the full range by default).
+        :param tuple psi_range: the (min, max) psi values in degrees (the full range by default).
+        :param bool split_pixels: split the pixels between all the bins they overlap (True by default).
+        :returns tuple: the sparse matrix in CSR format, the array of the 2theta bin centers and the array of the
+            psi bin centers.
+        '''
+        if self.psis is None:
+            raise ValueError('the psi values of the pixels are needed for caking')
+        two_theta_range = self._range(self.two_thetas, two_theta_range)
+        psi_range = self._range(self.psis, psi_range)
+        key = ('cake', n_two_theta, n_psi, two_theta_range, psi_range, split_pixels)
+        matrix = self._cached_matrix(key, lambda: self._build_cake_matrix(n_two_theta, n_psi, two_theta_range,
+                                                                          psi_range, split_pixels))
+        tt_edges = np.linspace(two_theta_range[0], two_theta_range[1], n_two_theta + 1)
+        psi_edges = np.linspace(psi_range[0], psi_range[1], n_psi + 1)
+        return matrix, 0.5 * (tt_edges[:-1] + tt_edges[1:]), 0.5 * (psi_edges[:-1] + psi_edges[1:])
+
+    def _cos_obliquity(self):
+        '''Return the cosine of the angle between the beam diffracted towards each pixel and the detector normal.
+
+        Without the laboratory coordinates of the pixels, the detector is
+        assumed to be perpendicular to the incident beam and the angle is
+        2theta.
+        '''
+        if 'cos_obliquity' not in self._corrections:
+            if self.lab_coordinates is None:
+                cos_alpha = np.cos(np.radians(self.two_thetas))
+            else:
+                r = np.linalg.norm(self.lab_coordinates, axis=1)
+                cos_alpha = np.abs(np.dot(self.lab_coordinates, self.normal)) / r
+            self._corrections['cos_obliquity'] = cos_alpha
+        return self._corrections['cos_obliquity']
+
+    def solid_angle(self):
+        '''Return the map of the relative solid angle of the pixels.
+
+        The solid angle of a pixel of area A seen from the sample is
+        :math:`A(\mathbf{n}.\mathbf{\hat{r}})/r^2` with :math:`\mathbf{r}`
+        the position of the pixel and :math:`\mathbf{n}` the detector normal.
+        Relative to a pixel at normal incidence, this gives
+        :math:`\cos^3\alpha` with :math:`\alpha` the angle between
+        :math:`\mathbf{r}` and the normal, which is :math:`2\theta` for a
+        flat detector perpendicular to the incident beam (the only geometry
+        available without the laboratory coordinates of the pixels).
+
+        :returns: the solid angle map (computed once and cached).
+        '''
+        if 'solid_angle' not in self._corrections:
+            self._corrections['solid_angle'] = (self._cos_obliquity() ** 3).reshape(self.shape)
+        return self._corrections['solid_angle']
+
+    def polarization(self, factor=0.95, psi_offset=0.):
+        '''Return the map of the polarization factor of the pixels.
+
+        The polarization factor is given by:
+
+        .. math::
+
+           P = \\dfrac{1}{2}\\left[1 + \\cos^2 2\\theta - f\\cos(2\\psi)\\sin^2 2\\theta\\right]
+
+        where :math:`f` is the polarization factor of the beam (0 for an
+        unpolarized beam as produced by a laboratory source, close to 1 for a
+        synchrotron beam polarized in the plane psi=0).
+
+        :param float factor: the polarization factor of the incident beam (0.95 by default).
+        :param float psi_offset: the angle in degrees between the polarization plane and psi=0 (0 by default).
+        :returns: the polarization map (computed once for each set of parameters and cached).
+        '''
+        if self.psis is None and factor != 0:
+            raise ValueError('the psi values of the pixels are needed for the polarization correction')
+        key = ('polarization', factor, psi_offset)
+        if key not in self._corrections:
+            two_theta = np.radians(self.two_thetas)
+            p = 1 + np.cos(two_theta) ** 2
+            if factor != 0:
+                # psi is undefined at the beam center where sin(2theta) = 0
+                cos_2psi = np.nan_to_num(np.cos(2 * np.radians(self.psis - psi_offset)))
+                p -= factor * cos_2psi * np.sin(two_theta) ** 2
+            self._corrections[key] = (0.5 * p).reshape(self.shape)
+        return self._corrections[key]
+
+    def absorption(self, mu_air=0., distance=0., mu_filter=0., filter_thickness=0.):
+        '''Return the map of the transmission of the air and of a filter placed in front of the detector.
+
+        The filter is parallel to the detector so that the path length in the
+        filter is :math:`t/\cos\alpha`, with :math:`\alpha` the angle
+        between the diffracted beam and the detector normal (see
+        :py:meth:`solid_angle`). The path length in the air is the distance
+        from the sample to each pixel when the laboratory coordinates of the
+        pixels are known and :math:`D/\cos 2\theta` otherwise.
+
+        :param float mu_air: the linear attenuation coefficient of air in 1/mm.
+        :param float distance: the distance from the sample to the detector in mm (only used without the
+            laboratory coordinates of the pixels).
+        :param float mu_filter: the linear attenuation coefficient of the filter in 1/mm.
+        :param float filter_thickness: the thickness of the filter in mm.
+        :returns: the transmission map (computed once for each set of parameters and cached).
+        '''
+        key = ('absorption', mu_air, distance, mu_filter, filter_thickness)
+        if key not in self._corrections:
+            if self.lab_coordinates is None:
+                air_path = distance / np.cos(np.radians(self.two_thetas))
+            else:
+                air_path = np.linalg.norm(self.lab_coordinates, axis=1)
+            path = mu_air * air_path + mu_filter * filter_thickness / self._cos_obliquity()
+            self._corrections[key] = np.exp(-path).reshape(self.shape)
+        return self._corrections[key]
+
+    def _regroup(self, matrix, image, correction=None):
+        '''Apply a lookup matrix to an image or a stack of images and normalize by the pixel counts.
+
+        With a correction map, the intensity of each bin is the sum of the
+        intensities divided by the sum of the corrections of its pixels.
+        '''
+        image = np.asarray(image)
+        n_pixels = len(self.two_thetas)
+        counts = np.asarray(matrix.sum(axis=1)).ravel()
+        if image.size == n_pixels:
+            sums = matrix.dot(image.ravel().astype(np.float64))
+        else:
+            frames = image.reshape((-1, n_pixels))
+            sums = matrix.dot(frames.T.astype(np.float64)).T
+        norm = counts if correction is None else matrix.dot(np.asarray(correction, dtype=np.float64).ravel())
+        with np.errstate(divide='ignore', invalid='ignore'):
+            intensity = np.where(norm > 0, sums / norm, np.nan)
+        return intensity, counts
+
+    def integrate(self, image, n_bins=1000, two_theta_range=None, psi_range=None, split_pixels=False,
+                  correction=None):
+        '''Integrate a detector image or a stack of images as a function of 2theta.
+
+        A stack of images is integrated with a single sparse matrix product.
+
+        With pixel splitting, each pixel contributes to all the bins it
+        overlaps in proportion of the overlap, which avoids aliasing when the
+        bins are narrower than the pixels. Intensity corrections (see
+        :py:meth:`solid_angle`, :py:meth:`polarization` and
+        :py:meth:`absorption`) can be combined in a single map::
+
+          correction = integrator.solid_angle() * integrator.polarization(0.95)
+          two_theta_values, intensity, counts = integrator.integrate(image, 4000, split_pixels=True,
+                                                                     correction=correction)
+
+        :param image: the detector image, with the same shape as the geometry arrays, or a stack of images with the
+            first axis being the frame index.
+        :param int n_bins: the number of 2theta bins (1000 by default).
+        :param tuple two_theta_range: the (min, max) 2theta values in degrees (the full range by default).
+        :param tuple psi_range: an optional (min, max) range of psi values in degrees.
+        :param bool split_pixels: split the pixels between all the bins they overlap (False by default).
+        :param correction: an optional map of the intensity correction of each pixel.
+        :returns tuple: the 2theta bin centers, the mean intensity in each bin (NaN for empty bins, an array of
+            shape (n_frames, n_bins) for a stack) and the number of pixels in each bin.
+        '''
+        (matrix, two_theta_values) = self.lookup_matrix(n_bins, two_theta_range, psi_range, split_pixels)
+        (intensity, counts) = self._regroup(matrix, image, correction)
+        return two_theta_values, intensity, counts
+
+    def cake(self, image, n_two_theta=500, n_psi=360, two_theta_range=None, psi_range=None, split_pixels=True,
+             correction=None):
+        '''Regroup a detector image or a stack of images as a function of 2theta and psi.
+
+        With pixel splitting, each pixel contributes to all the bins it
+        overlaps in proportion of the overlap (the extent of the pixel is
+        approximated by the bounding box of its corners in the (2theta, psi)
+        space). The counts are then fractional and the intensity of each bin
+        is normalized by the total fraction of pixels it received.
+
+        :param image: the detector image, with the same shape as the geometry arrays, or a stack of images with the
+            first axis being the frame index.
+        :param int n_two_theta: the number of 2theta bins (500 by default).
+        :param int n_psi: the number of psi bins (360 by default).
+        :param tuple two_theta_range: the (min, max) 2theta values in degrees (the full range by default).
+        :param tuple psi_range: the (min, max) psi values in degrees (the full range by default).
+        :param bool split_pixels: split the pixels between all the bins they overlap (True by default).
+        :param correction: an optional map of the intensity correction of each pixel (see :py:meth:`integrate`).
+        :returns tuple: the 2theta bin centers, the psi bin centers, the mean intensity as a (n_psi, n_two_theta)
+            array (NaN for empty bins, (n_frames, n_psi, n_two_theta) for a stack) and the (n_psi, n_two_theta)
+            array of pixel counts.
+        '''
+        (matrix, two_theta_values, psi_values) = self.cake_matrix(n_two_theta, n_psi, two_theta_range, psi_range,
+                                                                  split_pixels)
+        (intensity, counts) = self._regroup(matrix, image, correction)
+        shape = (n_psi, n_two_theta)
+        return two_theta_values, psi_values, intensity.reshape(intensity.shape[:-1] + shape), counts.reshape(shape)
@@ -1,7 +1,11 @@
+import os
 import numpy as np
-from pymicro.crystal.lattice import HklPlane
+from pymicro.crystal.lattice import HklPlane, HklPlaneArray
+from pymicro.crystal.microstructure import Orientation
 from pymicro.xray.xray_utils import *
-from pymicro.xray.dct import add_to_image
+from pymicro.xray.dct import add_spots_to_image
+from pymicro.parallel import chunk_ranges, map_chunks
+
 
 def select_lambda(hkl, orientation, Xu=np.array([1., 0., 0.]), verbose=False):
     '''
@@ -33,7 +37,9 @@ def select_lambda(hkl, orientation, Xu=np.array([1., 0., 0.]), verbose=False):
 
 def build_list(lattice=None, max_miller=3):
     '''Create a list of all HklPlanes.
-    This should move to the HklPlane class as a static method.'''
+
+    For large values of max_miller, prefer the vectorized
+    :py:meth:`~pymicro.crystal.lattice.HklPlaneArray.from_max_miller` method.'''
     # build a list of all hkl planes
     hklplanes = []
     indices = range(-max_miller, max_miller + 1)
@@ -119,6 +125,123 @@ def diffracted_vector(hkl, orientation, min_theta=0.1, verbose=False):
     return K
 
 
+def laue_spot_table(orientations, hkl, detector=None, spectrum=None, spectrum_thr=0., min_theta=0.1, margin=0.):
+    '''Compute the Laue diffraction spots of a set of reflections for one or several crystal orientations.
+
+    This is the vectorized version of :py:func:`select_lambda` and
+    :py:func:`diffracted_vector`: all the reflections and all the
+    orientations are processed at once. The incident beam is along the X
+    axis and the sample is at the origin.
+
+    As in :py:func:`select_lambda`, the selected energy is negative when the
+    scattering vector points forward (the reflection is then actually
+    produced by the Friedel pair). The diffracted vector
+    :math:`\\mathbf{K}=\\mathbf{X}/\\lambda+\\mathbf{G_s}` is computed with
+    the signed wavelength so that the line it defines is the diffracted beam
+    in both cases.
+
+    The result is a structured array of shape (M, N) for M orientations and
+    N reflections with the following fields:
+
+     * energy: the selected energy in keV (signed, see above);
+     * theta: the Bragg angle in radians (signed);
+     * K: the diffracted vector;
+     * uv: the spot position on the detector in pixels (NaN without detector);
+     * intensity: the spectrum intensity at the selected energy (1 without spectrum);
+     * hit: True if the reflection diffracts (glancing angle above min_theta
+       and energy within the spectrum) and hits the detector (or passes
+       less than `margin` pixels away from it).
+
+    ::
+
+      hkl = HklPlaneArray.from_max_miller(8, lattice=ni)
+      spots = laue_spot_table(orientations, hkl, detector)
+      uv = spots['uv'][0][spots['hit'][0]]  # spots of the first orientation
+
+    :param orientations: an :py:class:`~pymicro.crystal.microstructure.Orientation` instance, a list of orientations
+        or a (M, 3, 3) array of orientation matrices.
+    :param hkl: the reflections, an :py:class:`~pymicro.crystal.lattice.HklPlaneArray` instance or a list of
+        :py:class:`~pymicro.crystal.lattice.HklPlane` instances.
+    :param detector: an optional :py:class:`~pymicro.xray.detectors.RegArrayDetector2d` instance.
+    :param spectrum: an optional two columns array of the spectrum (energy in keV, intensity).
+    :param float spectrum_thr: the threshold used to determine the energy range of the spectrum.
+    :param float min_theta: the minimum glancing angle in degrees (0.1 by default).
+    :param float margin: the distance in pixels outside the detector up to which a spot is still considered as
+        hitting it (0 by default).
+    :returns: a structured numpy array of shape (M, N).
+    '''
+    if not isinstance(hkl, HklPlaneArray):
+        hkl = HklPlaneArray.from_list(hkl)
+    if hasattr(orientations, 'orientation_matrix'):
+        orientations = [orientations]
+    g = Orientation.orientation_matrices(orientations)
+    return _laue_spots(g, hkl.scattering_vectors(), hkl.interplanar_spacings(), detector=detector,
+                       spectrum=spectrum, energy_window=_energy_window(spectrum, spectrum_thr), min_theta=min_theta,
+                       margin=margin)
+
+
+def _energy_window(spectrum, spectrum_thr=0.):
+    '''Return the energy range (in keV) where the spectrum is above the threshold (None without spectrum).'''
+    if spectrum is None:
+        return None
+    indices = np.argwhere(spectrum[:, 1] > spectrum_thr)
+    return float(spectrum[indices[0], 0]), float(spectrum[indices[-1], 0])
+
+
+def _laue_spots(g, G, d_spacings, detector=None, spectrum=None, energy_window=None, min_theta=0.1, ref_pos=None,
+                margin=0.):
+    '''Compute the Laue spot table from precomputed arrays (see :py:func:`laue_spot_table`).
+
+    :param g: a (M, 3, 3) array of orientation matrices.
+    :param G: a (N, 3) array of the scattering vectors in the crystal frame.
+    :param d_spacings: a (N,) array of the interplanar spacings.
+    :param detector: an optional detector instance.
+    :param spectrum: an optional two columns array of the spectrum (energy in keV, intensity).
+    :param tuple energy_window: the energy range of the spectrum (see :py:func:`_energy_window`).
+    :param float min_theta: the minimum glancing angle in degrees.
+    :param ref_pos: an optional (M, 3) array of detector positions for each orientation (detector.ref_pos by default).
+    :param float margin: the distance in pixels outside the detector up to which a spot is still considered as
+        hitting it.
+    :returns: a structured numpy array of shape (M, N).
+    '''
+    # scattering vectors in the laboratory frame, shape (M, N, 3)
+    Gs = np.einsum('mjk,nj->mnk', g, G)
+    # the angle between X and the scattering vector is theta + pi/2
+    sin_theta = -Gs[:, :, 0] / np.sqrt(np.sum(Gs ** 2, axis=2))
+    theta = np.arcsin(np.clip(sin_theta, -1., 1.))
+    lambda_nm = 2 * d_spacings * sin_theta
+    with np.errstate(divide='ignore', invalid='ignore'):
+        energy = lambda_nm_to_keV(lambda_nm)
+        K = Gs.copy()
+        K[:, :, 0] += 1. / lambda_nm
+    hit = np.abs(theta) >= np.radians(min_theta)
+    intensity = np.ones_like(theta)
+    if spectrum is not None:
+        (E_min, E_max) = energy_window
+        hit &= (np.abs(energy) >= E_min) & (np.abs(energy) <= E_max)
+        intensity = np.interp(np.abs(energy), spectrum[:, 0], spectrum[:, 1], left=0., right=0.)
+    uv = np.full(theta.shape + (2,), np.nan)
+    if detector is not None:
+        # moving the detector is equivalent to moving the sample in the opposite direction
+        origin = np.zeros(3)
+        if ref_pos is not None:
+            origin = (detector.ref_pos - np.asarray(ref_pos))[:, np.newaxis, :]
+        # the actual diffracted beam is along sign(lambda).K
+        with np.errstate(invalid='ignore'):
+            (uv, on_detector) = detector.project_to_pixels(origin, np.sign(lambda_nm)[:, :, np.newaxis] * K,
+                                                           margin=margin)
+        hit &= on_detector
+    spots = np.zeros(theta.shape, dtype=[('energy', float), ('theta', float), ('K', float, (3,)), ('uv', float, (2,)),
+                                         ('intensity', float), ('hit', bool)])
+    spots['energy'] = energy
+    spots['theta'] = theta
+    spots['K'] = K
+    spots['uv'] = uv
+    spots['intensity'] = intensity
+    spots['hit'] = hit
+    return spots
+
+
 def compute_Laue_pattern(orientation, detector, hklplanes=None, spectrum=None, spectrum_thr=0.,
                          r_spot=5, color_spots_by_energy=False, inverted=False, show_direct_beam=False):
     '''
@@ -127,11 +250,12 @@ def compute_Laue_pattern(orientation, detector, hklplanes=None, spectrum=None, s
     
     The incident beam is assumed to be along the X axis: (1, 0, 0). The crystal can have any orientation and uses 
     an instance of the `Orientation` class. The `Detector2d` instance holds all the geometry (detector size and 
-    position).
+    position). The diffraction spots are computed for all the lattice planes at once with
+    :py:func:`laue_spot_table`.
 
     :param orientation: The crystal orientation.
     :param detector: An instance of the Detector2d class.
-    :param list hklplanes: A list of the lattice planes to include in the pattern.
+    :param hklplanes: A list of the lattice planes to include in the pattern (or a `HklPlaneArray` instance).
     :param spectrum: A two columns array of the spectrum to use for the calculation.
     :param float spectrum_thr: The threshold to use to determine if a wave length is contributing or not.
     :param int r_spot: Size of the spots on the detector in pixel (5 by default)
@@ -145,43 +269,338 @@ def compute_Laue_pattern(orientation, detector, hklplanes=None, spectrum=None, s
     spot = np.ones((2 * r_spot + 1, 2 * r_spot + 1), dtype=detector.data.dtype)
     max_val = np.iinfo(detector.data.dtype.type).max  # 255 here
     if show_direct_beam:
-        add_to_image(detector.data, max_val * spot, (detector.ucen, detector.vcen))
-
-    if spectrum is not None:
-        print('using spectrum')
-        indices = np.argwhere(spectrum[:, 1] > spectrum_thr)
-        E_min = float(spectrum[indices[0], 0])
-        E_max = float(spectrum[indices[-1], 0])
-        lambda_min = lambda_keV_to_nm(E_max)
-        lambda_max = lambda_keV_to_nm(E_min)
-        print('energy bounds: [{0:.1f}, {1:.1f}] keV'.format(E_min, E_max))
-
-    for hkl in hklplanes:
-        (the_energy, theta) = select_lambda(hkl, orientation, verbose=False)
-        if spectrum is not None:
-            if abs(the_energy) < E_min or abs(the_energy) > E_max:
-                #print('skipping reflection {0:s} which would diffract at {1:.1f}'.format(hkl.miller_indices(), abs(the_energy)))
-                continue
-            #print('including reflection {0:s} which will diffract at {1:.1f}'.format(hkl.miller_indices(), abs(the_energy)))
-        K = diffracted_vector(hkl, orientation)
-        if K is None or np.dot([1., 0., 0.], K) == 0:
-            continue  # skip diffraction // to the detector
-        R = detector.project_along_direction((0., 0., 0.), K)
-        (u, v) = detector.lab_to_pixel(R)
-        if u >= 0 and u < detector.size[0] and v >= 0 and v < detector.size[1]:
-            print('diffracted beam will hit the detector at (%.3f, %.3f) mm or (%d, %d) pixels' % (R[1], R[2], u, v))
-            print('diffracted beam energy is {0}'.format(abs(the_energy)))
-        # mark corresponding pixels on the image detector
-        if color_spots_by_energy:
-            add_to_image(detector.data, abs(the_energy) * spot.astype(float), (u, v))
-        else:
-            add_to_image(detector.data, max_val * spot, (u, v))
+        add_spots_to_image(detector.data, [(detector.ucen, detector.vcen)], spot, weights=[max_val])
+    # keep the spots partly on the detector (their centres are rounded to the nearest pixel)
+    spots = laue_spot_table(orientation, hklplanes, detector, spectrum=spectrum, spectrum_thr=spectrum_thr,
+                            margin=r_spot + 0.5)[0]
+    spots = spots[spots['hit']]
+    print('%d diffracted beams hit the detector' % len(spots))
+    # mark corresponding pixels on the image detector
+    if color_spots_by_energy:
+        add_spots_to_image(detector.data, spots['uv'], spot, weights=np.abs(spots['energy']))
+    else:
+        add_spots_to_image(detector.data, spots['uv'], spot, weights=max_val * np.ones(len(spots)))
     if inverted:
         print('inverting image')
         detector.data = np.invert(detector.data)
     return detector.data
 
 
+# state of the Laue sweep simulation (see :py:func:`~pymicro.parallel.map_chunks`)
+_laue_sweep_state = {}
+
+
+def _init_laue_sweep(state):
+    '''Initialize the state of a Laue sweep.'''
+    _laue_sweep_state.clear()
+    _laue_sweep_state.update(state)
+
+
+def _laue_sweep_chunk(indices):
+    '''Compute the Laue spots for a range of orientations (worker function of :py:func:`laue_sweep`).'''
+    state = _laue_sweep_state
+    ref_pos = None if state['ref_pos'] is None else state['ref_pos'][indices[0]:indices[-1] + 1]
+    spots = _laue_spots(state['g'][indices[0]:indices[-1] + 1], state['G'], state['d_spacings'],
+                        detector=state['detector'], spectrum=state['spectrum'], energy_window=state['energy_window'],
+                        min_theta=state['min_theta'], ref_pos=ref_pos)
+    output = state['output']
+    if output is None:
+        results = []
+        for m in range(len(indices)):
+            hit = np.where(spots['hit'][m])[0]
+            spot_list = np.empty(len(hit), dtype=[('hkl_index', int), ('uv', float, (2,)), ('energy', float),
+                                                  ('intensity', float)])
+            spot_list['hkl_index'] = hit
+            spot_list['uv'] = spots['uv'][m, hit]
+            spot_list['energy'] = np.abs(spots['energy'][m, hit])
+            spot_list['intensity'] = spots['intensity'][m, hit]
+            results.append(spot_list)
+        return results
+    stack = np.lib.format.open_memmap(output, mode='r+')
+    for m, i in enumerate(indices):
+        hit = spots['hit'][m]
+        frame = np.zeros(stack.shape[1:], dtype=stack.dtype)
+        add_spots_to_image(frame, spots['uv'][m, hit], state['spot'], weights=spots['intensity'][m, hit])
+        stack[i] = frame
+    stack.flush()
+    del stack
+    return None
+
+
+def laue_sweep(orientations, detector, hklplanes, spectrum=None, spectrum_thr=0., min_theta=0.1, distances=None,
+               output=None, r_spot=5, n_processes=1, chunk_size=None, verbose=False):
+    '''Simulate the Laue patterns of a series of crystal orientations (rocking or mapping scan).
+
+    The reflection table (scattering vectors and interplanar spacings) and
+    the energy window of the spectrum are computed once and shared by all the
+    orientations, which are processed by chunks (see
+    :py:func:`laue_spot_table`) and possibly by a pool of processes.
+
+    The result is either a sparse list of spots for each orientation or a
+    stack of images written in a memory mapped `.npy` file so that the whole
+    scan never needs to fit in memory.
+
+    ::
+
+      orientations = [Orientation.from_euler([45., 0.01 * i, 0.]) for i in range(1000)]
+      spot_lists = laue_sweep(orientations, detector, HklPlaneArray.generate(ni, max_miller=5))
+      stack = laue_sweep(orientations, detector, hkl, output='rocking.npy', n_processes=4)
+
+    :param orientations: a list of :py:class:`~pymicro.crystal.microstructure.Orientation` instances or a (M, 3, 3)
+        array of orientation matrices.
+    :param detector: the :py:class:`~pymicro.xray.detectors.RegArrayDetector2d` instance.
+    :param hklplanes: the reflections to consider, an :py:class:`~pymicro.crystal.lattice.HklPlaneArray` instance
+        or a list of :py:class:`~pymicro.crystal.lattice.HklPlane` instances.
+    :param spectrum: an optional two columns array of the spectrum (energy in keV, intensity).
+    :param float spectrum_thr: the threshold used to determine the energy range of the spectrum.
+    :param float min_theta: the minimum glancing angle in degrees (0.1 by default).
+    :param distances: an optional (M,) array of sample to detector distances in mm; the detector is moved along the
+        direction of `detector.ref_pos` for each orientation.
+    :param str output: None to return the sparse spot lists or the path of a `.npy` file for the image stack.
+    :param int r_spot: size of the spots in the images in pixel (5 by default).
+    :param int n_processes: the number of processes to use (1 by default).
+    :param int chunk_size: the number of orientations computed in a single task.
+    :param bool verbose: activate verbose mode (False by default).
+    :returns: a list of M structured arrays with the fields hkl_index, uv, energy and intensity, or the (M, nu, nv)
+        memory mapped image stack.
+    '''
+    if not isinstance(hklplanes, HklPlaneArray):
+        hklplanes = HklPlaneArray.from_list(hklplanes)
+    g = Orientation.orientation_matrices(orientations)
+    ref_pos = None
+    if distances is not None:
+        ref_pos = np.outer(distances, detector.ref_pos / np.linalg.norm(detector.ref_pos))
+    state = {'g': g,
+             'G': hklplanes.scattering_vectors(),
+             'd_spacings': hklplanes.interplanar_spacings(),
+             'detector': detector,
+             'spectrum': spectrum,
+             'energy_window': _energy_window(spectrum, spectrum_thr),
+             'min_theta': min_theta,
+             'ref_pos': ref_pos,
+             'spot': np.ones((2 * r_spot + 1, 2 * r_spot + 1), dtype=np.float32),
+             'output': output}
+    if output is not None:
+        stack = np.lib.format.open_memmap(output, mode='w+', dtype=np.float32,
+                                          shape=(len(g),) + tuple(detector.size))
+        del stack
+    # limit the size of the spot tables computed at once
+    chunks = chunk_ranges(len(g), n_processes, chunk_size, max_chunk_size=100000 // max(1, len(hklplanes)))
+    results = map_chunks(_laue_sweep_chunk, chunks, state, _init_laue_sweep, _laue_sweep_state.clear, n_processes,
+                         'computing orientations %d to %d' if verbose else None)
+    if output is None:
+        return [spot_list for result in results for spot_list in result]
+    return np.load(output, mmap_mode='r+')
+
+
+# tables of angles between reflection normals indexed by lattice parameters and maximum Miller index
+_laue_angle_tables = {}
+
+
+def laue_angle_table(lattice, max_miller=3, use_cache=True):
+    '''Build the sorted table of the angles between the normals of the low index reflections of a lattice.
+
+    The first order reflections allowed by the lattice centering are used,
+    with a single reflection for each Friedel pair. Since the sign of a
+    plane normal cannot be determined from a Laue pattern, the angle between
+    two normals is taken in [0, 90] degrees.
+
+    The table is computed once and cached in memory and on the disk (see
+    :py:func:`~pymicro.file.file_utils.get_cache_dir`).
+
+    :param lattice: the :py:class:`~pymicro.crystal.lattice.Lattice` instance.
+    :param int max_miller: the maximum Miller index of the reflections (3 by default).
+    :param bool use_cache: use the disk cache (True by default).
+    :returns tuple: the reflections as a `HklPlaneArray`, the sorted (P,) array of
+        angles in degrees and the (P, 2) array of the indices of the corresponding
+        pairs of reflections.
+    '''
+    import hashlib
+    import tempfile
+    from pymicro.file.file_utils import get_cache_dir
+    key = (tuple(np.round(lattice._lengths, 8)), tuple(np.round(lattice._angles, 8)), lattice._centering, max_miller)
+    if key in _laue_angle_tables:
+        return _laue_angle_tables[key]
+    cache_path = os.path.join(get_cache_dir(), 'laue_angles_%s.npz' % hashlib.md5(repr(key)).hexdigest())
+    if use_cache and os.path.exists(cache_path):
+        with np.load(cache_path) as table:
+            hkl, angles, pairs = HklPlaneArray(table['hkl'], lattice), table['angles'].copy(), table['pairs'].copy()
+    else:
+        hkl = HklPlaneArray.generate(lattice, max_miller=max_miller, first_order=True, include_friedel_pair=False)
+        normals = hkl.normals()
+        (i, j) = np.triu_indices(len(hkl), k=1)
+        cos_angles = np.abs(np.sum(normals[i] * normals[j], axis=1))
+        angles = np.degrees(np.arccos(np.clip(cos_angles, 0., 1.)))
+        order = np.argsort(angles)
+        angles, pairs = angles[order], np.column_stack((i[order], j[order]))
+        if use_cache:
+            # write a temporary file first so that another process never reads an incomplete table
+            (fd, tmp_path) = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(cache_path))
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, hkl=hkl.miller_indices(), angles=angles, pairs=pairs)
+            os.rename(tmp_path, cache_path)
+    _laue_angle_tables[key] = (hkl, angles, pairs)
+    return _laue_angle_tables[key]
+
+
+def spot_normals(uv, detector):
+    '''Compute the normals of the diffracting planes from the spot positions on the detector.
+
+    The sample is assumed at the origin and the incident beam along X. The
+    diffracted beam direction :math:`\\mathbf{\\hat{K}}` is given by the spot
+    position and the plane normal is along :math:`\\mathbf{\\hat{K}}-\\mathbf{X}`.
+
+    :param uv: a (S, 2) array of the spot positions in pixels.
+    :param detector: the :py:class:`~pymicro.xray.detectors.RegArrayDetector2d` instance.
+    :returns: a (S, 3) array of unit vectors in the laboratory frame.
+    '''
+    uv = np.asarray(uv, dtype=np.float64).reshape((-1, 2))
+    p = detector.pixel_to_lab(uv[:, 0], uv[:, 1])
+    n = p / np.linalg.norm(p, axis=1)[:, np.newaxis] - np.array([1., 0., 0.])
+    return n / np.linalg.norm(n, axis=1)[:, np.newaxis]
+
+
+def _triad_rotations(c1, c2, l1, l2):
+    '''Compute the rotations bringing the crystal vectors (c1, c2) onto the laboratory vectors (l1, l2).
+
+    The first vector is matched exactly and the second one lies in the same plane.
+    All arguments are (C, 3) arrays, the result is a (C, 3, 3) array.
+    '''
+    def basis(a, b):
+        t2 = np.cross(a, b)
+        t2 /= np.linalg.norm(t2, axis=1)[:, np.newaxis]
+        return np.stack((a, t2, np.cross(a, t2)), axis=2)
+
+    return np.einsum('cij,ckj->cik', basis(l1, l2), basis(c1, c2))
+
+
+def _rotation_vector_matrix(w):
+    '''Rotation matrix associated with a rotation vector (axis times angle in radians).'''
+    angle = np.linalg.norm(w)
+    if angle < 1.e-12:
+        return np.eye(3)
+    k = w / angle
+    K = np.array([[0., -k[2], k[1]], [k[2], 0., -k[0]], [-k[1], k[0], 0.]])
+    return np.eye(3) + np.sin(angle) * K + (1 - np.cos(angle)) * np.dot(K, K)
+
+
+def index_laue_pattern(uv, detector, lattice, max_miller=3, n_spots=12, angle_tol=0.2, pixel_tol=5.,
+                       n_candidates=5, verbose=False):
+    '''Find the crystal orientation from the spots of a transmission Laue pattern.
+
+    The indexing proceeds as follows:
+
+     1. the plane normals are computed from the spot positions (see :py:func:`spot_normals`);
+     2. for each pair of the `n_spots` first spots, the angle between the
+        normals is matched against the precomputed table of angles between
+        reflection normals (see :py:func:`laue_angle_table`) by binary search;
+     3. each match gives candidate orientations (computed with the triad method)
+        which are scored by the number of spots they explain (voting);
+     4. the best candidates are refined by least squares on the spot positions,
+        simulated with :py:func:`laue_spot_table`, and ranked by the number of
+        indexed spots and the residual error.
+
+    ::
+
+      solutions = index_laue_pattern(uv, detector, Lattice.from_symbol('Ni'))
+      (orientation, n_indexed, rms) = solutions[0]
+
+    :param uv: a (S, 2) array of the measured spot positions in pixels, preferably sorted by decreasing intensity.
+    :param detector: the :py:class:`~pymicro.xray.detectors.RegArrayDetector2d` instance.
+    :param lattice: the crystal :py:class:`~pymicro.crystal.lattice.Lattice`.
+    :param int max_miller: the maximum Miller index of the reflections used for indexing (3 by default).
+    :param int n_spots: the number of spots used to generate the candidates (12 by default).
+    :param float angle_tol: the angular tolerance in degrees (0.2 by default).
+    :param float pixel_tol: the distance in pixels under which a simulated spot indexes a measured spot (5 by default).
+    :param int n_candidates: the number of candidates refined (5 by default).
+    :param bool verbose: activate verbose mode (False by default).
+    :returns list: the solutions as tuples (orientation, number of indexed spots, rms distance in pixels) sorted from
+        the best to the worst.
+    '''
+    from scipy import optimize
+    uv = np.asarray(uv, dtype=np.float64).reshape((-1, 2))
+    (hkl, angles, pairs) = laue_angle_table(lattice, max_miller)
+    normals = hkl.normals()
+    measured = spot_normals(uv, detector)
+    sub = measured[:n_spots]
+    # match all pairs of spots against the table
+    (a, b) = np.triu_indices(len(sub), k=1)
+    cos_ab = np.sum(sub[a] * sub[b], axis=1)
+    angles_ab = np.degrees(np.arccos(np.clip(np.abs(cos_ab), 0., 1.)))
+    lo = np.searchsorted(angles, angles_ab - angle_tol, side='left')
+    hi = np.searchsorted(angles, angles_ab + angle_tol, side='right')
+    n_matches = hi - lo
+    # nearly parallel normals do not define an orientation
+    n_matches[angles_ab < max(1., 2 * angle_tol)] = 0
+    if np.sum(n_matches) == 0:
+        return []
+    spot_pair = np.repeat(np.arange(len(a)), n_matches)
+    table_index = np.concatenate([np.arange(l, h) for (l, h) in zip(lo, hi)])
+    (c1, c2) = (normals[pairs[table_index, 0]], normals[pairs[table_index, 1]])
+    (l1, l2) = (sub[a[spot_pair]], sub[b[spot_pair]])
+    cos_ab = cos_ab[spot_pair]
+    # each match gives 4 candidates: 2 assignments of the reflections and 2 signs of the normals
+    C1, C2, L1, L2 = [], [], [], []
+    for (u1, u2) in [(c1, c2), (c2, c1)]:
+        u2 = u2 * np.where(np.sum(u1 * u2, axis=1) * cos_ab < 0, -1., 1.)[:, np.newaxis]
+        for sign in [1., -1.]:
+            C1.append(sign * u1)
+            C2.append(sign * u2)
+            L1.append(l1)
+            L2.append(l2)
+    R = _triad_rotations(np.concatenate(C1), np.concatenate(C2), np.concatenate(L1), np.concatenate(L2))
+    # vote: count the spots explained by each candidate
+    cos_tol = np.cos(np.radians(angle_tol))
+    votes = np.empty(len(R), dtype=int)
+    block = max(1, 2000000 // (len(sub) * len(normals)))
+    for start in range(0, len(R), block):
+        # bring the measured normals in the crystal frame of each candidate
+        crystal = np.einsum('cji,sj->csi', R[start:start + block], sub)
+        cos = np.abs(np.dot(crystal.reshape((-1, 3)), normals.T)).reshape((len(crystal), len(sub), len(normals)))
+        votes[start:start + block] = np.sum(np.max(cos, axis=2) > cos_tol, axis=1)
+    if verbose:
+        print('%d candidates from %d pair matches, best vote %d/%d' % (len(R), np.sum(n_matches), votes.max(), len(sub)))
+    # keep the best distinct candidates
+    candidates = []
+    for c in np.argsort(-votes, kind='mergesort'):
+        if len(candidates) == n_candidates:
+            break
+        if any(np.trace(np.dot(R[c], other.T)) > 3 - 1.e-4 for other in candidates):
+            continue
+        candidates.append(R[c])
+    # refine the candidates using the simulated spot positions
+    all_hkl = HklPlaneArray.generate(lattice, max_miller=max_miller, first_order=True)
+    solutions = []
+    for R0 in candidates:
+        # assign a reflection to each measured spot
+        cos = np.abs(np.dot(measured, np.dot(R0, normals.T)))
+        assigned = np.max(cos, axis=1) > cos_tol
+        if np.sum(assigned) < 2:
+            continue
+        spots_hkl = hkl[np.argmax(cos, axis=1)[assigned]]
+
+        def residuals(w):
+            g = np.dot(_rotation_vector_matrix(w), R0).T
+            sim = laue_spot_table(g[np.newaxis], spots_hkl, detector, min_theta=0.)['uv'][0]
+            return np.nan_to_num((sim - uv[assigned]).ravel())
+
+        w = optimize.leastsq(residuals, np.zeros(3), xtol=1.e-8)[0]
+        g = np.dot(_rotation_vector_matrix(w), R0).T
+        # evaluate the solution with the full simulated pattern
+        sim = laue_spot_table(g[np.newaxis], all_hkl, detector)[0]
+        sim_uv = sim['uv'][sim['hit']]
+        if len(sim_uv) == 0:
+            continue
+        dist = np.sqrt(np.min(np.sum((uv[:, np.newaxis, :] - sim_uv[np.newaxis, :, :]) ** 2, axis=2), axis=1))
+        indexed = dist < pixel_tol
+        rms = np.sqrt(np.mean(dist[indexed] ** 2)) if np.any(indexed) else np.inf
+        solutions.append((Orientation(g), int(np.sum(indexed)), rms))
+    solutions.sort(key=lambda solution: (-solution[1], solution[2]))
+    if verbose and solutions:
+        print('best solution indexes %d/%d spots with a rms of %.2f pixels' % (solutions[0][1], len(uv), solutions[0][2]))
+    return solutions
+
+
 if __name__ == '__main__':
     from matplotlib import pyplot as plt, cm, rcParams
 
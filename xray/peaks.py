@@ -0,0 +1,287 @@
+"""The peaks module provides automatic peak search in diffraction profiles and detector frames.
+
+Peaks are located in series of 1D profiles (for instance integrated patterns) with smoothed derivatives, all the
+profiles being processed at once. The result can be used directly to initialize the fitting functions of the
+:py:mod:`~pymicro.xray.fitting` module::
+
+  peaks = find_peaks(profiles, x=two_theta_values, sigma=2.)
+  init = seed_parameters(peaks, len(profiles), profile='PseudoVoigt', n_peaks=2)
+  params, cost, converged = fit_profiles(two_theta_values, profiles, init, profile='PseudoVoigt', n_peaks=2)
+
+Diffraction spots are located in stacks of 2D frames by thresholding above a local background and labelling the
+connected components; the frames are processed by chunks, possibly by a pool of processes, and can be read from a
+`.npy` or an HDF5 file so that long scans do not need to fit in memory::
+
+  spots = find_spots('scan.h5', snr=5., n_processes=4)
+"""
+import numpy as np
+from pymicro.xray.fitting import peak_parameters, _profiles
+from pymicro.lazy import lazy_import
+from pymicro.parallel import chunk_ranges, map_chunks
+
+ndimage = lazy_import('scipy.ndimage')
+
+
+def find_peaks(profiles, x=None, sigma=2., min_snr=5., background_window=None, max_peaks=None):
+    '''Find the peaks in a series of 1D profiles.
+
+    The profiles are smoothed with a Gaussian filter of width `sigma`
+    (in samples) and differentiated by convolution with the derivatives of
+    the Gaussian. A peak is a zero crossing of the first derivative with a
+    negative second derivative; its position is interpolated between the
+    samples. The background is the running minimum of the smoothed profile
+    over `background_window` samples and the noise level is estimated from
+    the median absolute difference between consecutive samples. Only the
+    peaks whose height above the background exceeds `min_snr` times the noise
+    level are kept.
+
+    The width of each peak is estimated from the curvature of the smoothed
+    profile at the peak, assuming a Gaussian shape, and corrected for the
+    smoothing (as is the height).
+
+    :param profiles: a (N,) or (M, N) array of profiles.
+    :param x: the (N,) array of coordinates of the samples (the sample indices by default).
+    :param float sigma: the width of the smoothing filter in samples (2 by default).
+    :param float min_snr: the minimum signal to noise ratio of a peak (5 by default).
+    :param int background_window: the size in samples of the running minimum used as background (20 sigma by
+        default).
+    :param int max_peaks: the maximum number of peaks kept in each profile, the highest ones (all by default).
+    :returns: a structured array with the profile index ('profile'), the fractional sample index ('index'), the
+        position ('position'), the height above the background ('height'), the half width at half maximum
+        ('hwhm'), the background ('background') and the signal to noise ratio ('snr') of each peak, ordered by
+        profile and position.
+    '''
+    y = np.atleast_2d(np.asarray(profiles, dtype=np.float64))
+    (M, N) = y.shape
+    x = np.arange(N, dtype=float) if x is None else np.asarray(x, dtype=float)
+    if background_window is None:
+        background_window = int(20 * sigma) + 1
+    ys = ndimage.gaussian_filter1d(y, sigma, axis=1, mode='nearest')
+    d1 = ndimage.gaussian_filter1d(y, sigma, axis=1, order=1, mode='nearest')
+    d2 = ndimage.gaussian_filter1d(y, sigma, axis=1, order=2, mode='nearest')
+    background = ndimage.minimum_filter1d(ys, background_window, axis=1, mode='nearest')
+    noise = 1.4826 * np.median(np.abs(np.diff(y, axis=1)), axis=1) / np.sqrt(2)
+    noise = np.maximum(noise, np.finfo(float).eps)
+    # zero crossings of the first derivative
+    (m, i) = np.nonzero((d1[:, :-1] > 0) & (d1[:, 1:] <= 0))
+    t = d1[m, i] / (d1[m, i] - d1[m, i + 1])
+    index = i + t
+    h = (1 - t) * (ys[m, i] - background[m, i]) + t * (ys[m, i + 1] - background[m, i + 1])
+    curvature = -((1 - t) * d2[m, i] + t * d2[m, i + 1])
+    keep = (curvature > 0) & (h > min_snr * noise[m])
+    (m, i, t, index, h, curvature) = (m[keep], i[keep], t[keep], index[keep], h[keep], curvature[keep])
+    # gaussian width in samples, corrected for the smoothing
+    s2 = h / curvature
+    s = np.sqrt(np.maximum(s2 - sigma ** 2, 0.25))
+    height = h * np.sqrt(s2) / s
+    step = np.interp(index, np.arange(N), np.gradient(x))
+    peaks = np.zeros(len(m), dtype=[('profile', np.int32), ('index', np.float64), ('position', np.float64),
+                                    ('height', np.float64), ('hwhm', np.float64), ('background', np.float64),
+                                    ('snr', np.float64)])
+    peaks['profile'] = m
+    peaks['index'] = index
+    peaks['position'] = np.interp(index, np.arange(N), x)
+    peaks['height'] = height
+    peaks['hwhm'] = s * np.sqrt(2 * np.log(2)) * np.abs(step)
+    peaks['background'] = (1 - t) * background[m, i] + t * background[m, i + 1]
+    peaks['snr'] = h / noise[m]
+    if max_peaks is not None and len(peaks):
+        peaks = _strongest(peaks, 'profile', 'height', max_peaks)
+        peaks = peaks[np.lexsort((peaks['index'], peaks['profile']))]
+    return peaks
+
+
+def _strongest(table, group_field, value_field, n):
+    '''Keep the n entries of a structured array with the largest values in each group.'''
+    order = np.lexsort((-table[value_field], table[group_field]))
+    groups = table[group_field][order]
+    first = np.r_[0, np.nonzero(np.diff(groups))[0] + 1]
+    rank = np.arange(len(order)) - np.repeat(first, np.diff(np.r_[first, len(order)]))
+    return table[order[rank < n]]
+
+
+def seed_parameters(peaks, n_profiles, profile='Gaussian', n_peaks=1, n_background=0):
+    '''Build the initial parameters of :py:func:`~pymicro.xray.fitting.fit_profiles` from a peak search.
+
+    The `n_peaks` highest peaks of each profile are used, ordered by
+    position. The first background coefficient is initialized with the
+    background of the highest peak and the others are zero. The parameters
+    of the profiles with less than `n_peaks` peaks are set to NaN (these
+    profiles are then skipped by the fit).
+
+    :param peaks: the structured array returned by :py:func:`find_peaks`.
+    :param int n_profiles: the number of profiles.
+    :param str profile: the type of peaks ('Gaussian' by default, see :py:func:`~pymicro.xray.fitting.profile_model`).
+    :param int n_peaks: the number of peaks in each profile (1 by default).
+    :param int n_background: the number of coefficients of the polynomial background (0 by default).
+    :returns: a (n_profiles, P) array of initial parameters.
+    '''
+    k = _profiles[profile][1]
+    init = np.nan * np.ones((n_profiles, n_peaks * k + n_background))
+    if len(peaks) == 0:
+        return init
+    strongest = _strongest(peaks, 'profile', 'height', n_peaks)
+    counts = np.bincount(strongest['profile'], minlength=n_profiles)
+    selected = strongest[counts[strongest['profile']] == n_peaks]
+    if n_background > 0:
+        init[:, n_peaks * k:] = 0.
+        # the highest peak comes first in each group
+        first = np.r_[True, np.diff(selected['profile']) != 0]
+        init[selected['profile'][first], n_peaks * k] = selected['background'][first]
+    selected = selected[np.lexsort((selected['position'], selected['profile']))]
+    params = peak_parameters(selected['position'], selected['hwhm'], selected['height'], profile)
+    rows = np.unique(selected['profile'])
+    init[rows, :n_peaks * k] = params.reshape((len(rows), n_peaks * k))
+    return init
+
+
+def estimate_background(frames, block_size=32):
+    '''Estimate the background and the noise level of a stack of frames.
+
+    Each frame is divided into blocks of `block_size` x `block_size`
+    pixels; the background of a block is the median of its pixels and the
+    noise level is given by their median absolute deviation, both being
+    insensitive to the diffraction spots as long as they cover less than half
+    of the block. All the blocks of all the frames are processed at once.
+
+    :param frames: a (nu, nv) frame or a (K, nu, nv) stack of frames.
+    :param int block_size: the size of the blocks in pixels (32 by default).
+    :returns tuple (background, noise): two arrays with the shape of the frames.
+    '''
+    frames = np.asarray(frames, dtype=np.float32)
+    stack = frames.reshape((-1,) + frames.shape[-2:])
+    (K, nu, nv) = stack.shape
+    (bu, bv) = (int(np.ceil(float(nu) / block_size)), int(np.ceil(float(nv) / block_size)))
+    padded = np.pad(stack, ((0, 0), (0, bu * block_size - nu), (0, bv * block_size - nv)), mode='reflect')
+    blocks = padded.reshape((K, bu, block_size, bv, block_size)).transpose((0, 1, 3, 2, 4))
+    blocks = blocks.reshape((K, bu, bv, block_size ** 2))
+    median = np.median(blocks, axis=-1)
+    mad = 1.4826 * np.median(np.abs(blocks - median[..., np.newaxis]), axis=-1)
+    expand = lambda a: np.repeat(np.repeat(a, block_size, axis=1), block_size, axis=2)[:, :nu, :nv]
+    return expand(median).reshape(frames.shape), expand(mad).reshape(frames.shape)
+
+
+def _open_frames(frames):
+    '''Give access to a stack of frames stored in an array, a `.npy` file or an HDF5 file.
+
+    The HDF5 frames can also be given as a (file path, dataset path) tuple.
+    '''
+    if isinstance(frames, tuple):
+        from pymicro.file.file_utils import HDF5FrameSource
+        return HDF5FrameSource(*frames)
+    if isinstance(frames, str):
+        if frames.endswith('.npy'):
+            return np.load(frames, mmap_mode='r')
+        from pymicro.file.file_utils import HDF5FrameSource
+        return HDF5FrameSource(frames)
+    return frames
+
+
+# state of the spot search (see :py:func:`~pymicro.parallel.map_chunks`)
+_find_spots_state = {}
+
+
+def _init_find_spots(state):
+    '''Initialize the state of a spot search and open the frames.'''
+    _find_spots_state.clear()
+    _find_spots_state.update(state)
+    _find_spots_state['source'] = _open_frames(state['frames'])
+
+
+def _release_find_spots():
+    '''Close the frames opened by :py:func:`_init_find_spots` and clear the state of the spot search.'''
+    source = _find_spots_state.get('source')
+    if source is not _find_spots_state.get('frames') and hasattr(source, 'close'):
+        source.close()
+    _find_spots_state.clear()
+
+
+def _find_spots_chunk(indices):
+    '''Find the spots in a range of frames (worker function of :py:func:`find_spots`).'''
+    state = _find_spots_state
+    (start, stop) = (indices[0], indices[-1] + 1)
+    frames = np.asarray(state['source'][start:stop], dtype=np.float32)
+    (background, noise) = estimate_background(frames, state['block_size'])
+    signal = frames - background
+    mask = signal > np.maximum(state['snr'] * noise, state['min_intensity'])
+    # connected components within each frame only
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = True
+    (labels, n) = ndimage.label(mask, structure=structure)
+    (k, u, v) = np.nonzero(labels)
+    l = labels[k, u, v] - 1
+    w = signal[k, u, v].astype(np.float64)
+    n_pixels = np.bincount(l, minlength=n)
+    intensity = np.bincount(l, w, minlength=n)
+    spots = np.zeros(n, dtype=[('frame', np.int32), ('uv', np.float64, 2), ('intensity', np.float64),
+                               ('peak', np.float64), ('background', np.float64), ('n_pixels', np.int32)])
+    if n == 0:
+        return spots
+    spots['frame'] = start + np.bincount(l, k, minlength=n) / n_pixels
+    spots['uv'][:, 0] = np.bincount(l, w * u, minlength=n) / intensity
+    spots['uv'][:, 1] = np.bincount(l, w * v, minlength=n) / intensity
+    spots['intensity'] = intensity
+    spots['peak'] = ndimage.maximum(signal, labels, np.arange(1, n + 1))
+    spots['background'] = np.bincount(l, background[k, u, v], minlength=n) / n_pixels
+    spots['n_pixels'] = n_pixels
+    return spots[n_pixels >= state['min_pixels']]
+
+
+def find_spots(frames, snr=5., min_intensity=0., block_size=32, min_pixels=2, n_processes=1, chunk_size=None,
+               verbose=False):
+    '''Find the diffraction spots in a stack of detector frames.
+
+    The background and the noise level are estimated by blocks (see
+    :py:func:`estimate_background`), the pixels standing above the
+    background by more than `snr` times the noise level are selected and
+    grouped into spots by connected component labelling (8-connectivity,
+    within each frame). The spot properties are then computed for all the
+    spots at once. The frames are processed by chunks, possibly by a pool of
+    processes; when the frames are given as a file path or an HDF5 source,
+    each process reads its own chunks from the file (an HDF5 source is
+    closed while the worker processes run and opened again afterwards).
+
+    The spot positions of a frame can be used directly to index a Laue
+    pattern, see :py:func:`~pymicro.xray.laue.index_laue_pattern`.
+
+    :param frames: a (nu, nv) frame, a (K, nu, nv) array of frames (possibly memory mapped), an
+        :py:class:`~pymicro.file.file_utils.HDF5FrameSource` instance, or the path of a `.npy` or HDF5 file.
+    :param float snr: the minimum signal to noise ratio of the spot pixels (5 by default).
+    :param float min_intensity: the minimum intensity above the background of the spot pixels (0 by default).
+    :param int block_size: the size of the blocks used to estimate the background (32 by default).
+    :param int min_pixels: the minimum number of pixels of a spot (2 by default).
+    :param int n_processes: the number of processes to use (1 by default).
+    :param int chunk_size: the number of frames processed in a single task.
+    :param bool verbose: activate verbose mode (False by default).
+    :returns: a structured array with the frame index ('frame'), the intensity weighted position in pixels ('uv'),
+        the integrated intensity above the background ('intensity'), the maximum intensity above the background
+        ('peak'), the mean background ('background') and the number of pixels ('n_pixels') of each spot.
+    '''
+    from pymicro.file.file_utils import HDF5FrameSource
+    h5_source = None
+    if isinstance(frames, HDF5FrameSource):
+        # the h5py objects cannot be shared with the worker processes, each process opens the file again
+        (h5_source, frames) = (frames, (frames.file_path, frames.dataset_path))
+    elif not isinstance(frames, str) and np.ndim(frames) == 2:
+        frames = np.asarray(frames)[np.newaxis]
+    source = h5_source or _open_frames(frames)
+    (n_frames, frame_shape) = (len(source), tuple(source.shape[1:]))
+    if source is not frames and source is not h5_source and hasattr(source, 'close'):
+        source.close()
+    state = {'frames': frames, 'snr': snr, 'min_intensity': min_intensity, 'block_size': block_size,
+             'min_pixels': min_pixels}
+    # limit the memory used by a task to about 64 MB of float32 frames
+    chunks = chunk_ranges(n_frames, n_processes, chunk_size, max_chunk_size=2 ** 24 // int(np.prod(frame_shape)))
+    if h5_source is not None and n_processes > 1:
+        # no HDF5 file may be open in the parent process when the worker processes are forked
+        h5_source.close()
+    try:
+        results = map_chunks(_find_spots_chunk, chunks, state, _init_find_spots, _release_find_spots, n_processes,
+                             'searching spots in frames %d to %d' if verbose else None)
+    finally:
+        if h5_source is not None and n_processes > 1:
+            h5_source.reopen()
+    spots = np.concatenate(results)
+    if verbose:
+        print('%d spots found in %d frames' % (len(spots), n_frames))
+    return spots
@@ -0,0 +1,215 @@
+"""The strain module computes elastic strain and stress maps from the shifts of diffraction peaks.
+
+For each point of a map, the lattice strain measured with a reflection is the relative change of its interplanar
+spacing, which is the projection of the strain tensor on the scattering vector :math:`n`:
+
+.. math::
+
+  \\varepsilon_n = \\dfrac{d - d_0}{d_0} = n^T\\varepsilon\\,n
+
+With at least 6 reflections with independent directions, the 6 components of the strain tensor are determined by
+least squares. All the points of the map are solved at once with stacked linear algebra::
+
+  hkl = HklPlaneArray.generate(Lattice.from_symbol('Ni'), max_miller=3, first_order=True)
+  strains = lattice_strains(two_thetas, hkl, lambda_keV=40.)  # (n_points, n_reflections)
+  directions = scattering_directions(two_thetas, etas)  # (n_points, n_reflections, 3)
+  strain, errors = fit_strain(strains, directions)
+  stress = strain_to_stress(strain, C, orientations)
+
+The stress is obtained with Hooke's law, the stiffness tensor of the crystal being rotated into the sample frame with
+the orientation of each point.
+"""
+import numpy as np
+from pymicro.crystal.lattice import HklPlaneArray
+from pymicro.crystal.elasticity import ElasticTensor, _voigt_pairs, bond_matrix, rotate_stiffness
+
+
+def _d_spacings(reflections):
+    '''Return the reference interplanar spacings from an array or a list of reflections.'''
+    if isinstance(reflections, HklPlaneArray):
+        return reflections.interplanar_spacings()
+    if len(reflections) > 0 and hasattr(reflections[0], 'interplanar_spacing'):
+        return np.array([hkl.interplanar_spacing() for hkl in reflections])
+    return np.asarray(reflections, dtype=np.float64)
+
+
+def lattice_strains(measured, reference, lambda_keV=None):
+    '''Compute the lattice strains from the measured interplanar spacings or scattering angles.
+
+    :param measured: a (..., R) array of the measured interplanar spacings, or of the scattering angles 2theta in
+        degrees if the energy is given; NaN values denote missing measurements.
+    :param reference: the R unstrained interplanar spacings (same unit as the measured spacings, nm for the
+        scattering angles), or an :py:class:`~pymicro.crystal.lattice.HklPlaneArray` instance, or a list of
+        :py:class:`~pymicro.crystal.lattice.HklPlane` instances.
+    :param float lambda_keV: the X-ray energy in keV, if the scattering angles are given (None by default).
+    :returns: a (..., R) array of the lattice strains.
+    '''
+    d = np.asarray(measured, dtype=np.float64)
+    if lambda_keV is not None:
+        d = 1.2398 / lambda_keV / (2 * np.sin(np.radians(d) / 2))
+    d0 = _d_spacings(reference)
+    return (d - d0) / d0
+
+
+def scattering_directions(two_theta, eta):
+    '''Compute the directions of the scattering vectors in the laboratory frame.
+
+    The X-ray beam is along X and the diffracted beam direction is
+    :math:`(\\cos 2\\theta, \\sin 2\\theta\\cos\\eta, \\sin 2\\theta\\sin\\eta)`
+    so that the scattering vector is along
+    :math:`(-\\sin\\theta, \\cos\\theta\\cos\\eta, \\cos\\theta\\sin\\eta)`.
+
+    :param two_theta: an array of the scattering angles in degrees.
+    :param eta: an array of the azimuthal angles in degrees (broadcastable with two_theta).
+    :returns: an array of unit vectors with the broadcast shape of the angles plus a last dimension of size 3.
+    '''
+    theta = np.radians(np.asarray(two_theta, dtype=np.float64)) / 2
+    eta = np.radians(np.asarray(eta, dtype=np.float64))
+    (theta, eta) = np.broadcast_arrays(theta, eta)
+    return np.stack((-np.sin(theta), np.cos(theta) * np.cos(eta), np.cos(theta) * np.sin(eta)), axis=-1)
+
+
+def strain_design_matrix(directions):
+    '''Build the matrix relating the strain components to the lattice strains along some directions.
+
+    The lattice strain along the unit vector n is the dot product of the
+    row :math:`(n_1^2, n_2^2, n_3^2, 2n_2n_3, 2n_1n_3, 2n_1n_2)` with the
+    tensor components :math:`(\\varepsilon_{11}, \\varepsilon_{22},
+    \\varepsilon_{33}, \\varepsilon_{23}, \\varepsilon_{13}, \\varepsilon_{12})`.
+
+    :param directions: a (..., 3) array of unit vectors.
+    :returns: a (..., 6) array.
+    '''
+    n = np.asarray(directions, dtype=np.float64)
+    (i, j) = (_voigt_pairs[:, 0], _voigt_pairs[:, 1])
+    return n[..., i] * n[..., j] * np.where(i == j, 1., 2.)
+
+
+def tensor_from_components(components):
+    '''Build symmetric tensors from their 6 components in Voigt order (11, 22, 33, 23, 13, 12).
+
+    :param components: a (..., 6) array.
+    :returns: a (..., 3, 3) array.
+    '''
+    components = np.asarray(components)
+    tensor = np.empty(components.shape[:-1] + (3, 3), dtype=components.dtype)
+    for k, (i, j) in enumerate(_voigt_pairs):
+        tensor[..., i, j] = tensor[..., j, i] = components[..., k]
+    return tensor
+
+
+def tensor_components(tensor):
+    '''Extract the 6 components in Voigt order (11, 22, 33, 23, 13, 12) of symmetric tensors.
+
+    :param tensor: a (..., 3, 3) array.
+    :returns: a (..., 6) array.
+    '''
+    tensor = np.asarray(tensor)
+    return tensor[..., _voigt_pairs[:, 0], _voigt_pairs[:, 1]]
+
+
+def fit_strain(strains, directions, weights=None, max_condition=1.e8):
+    '''Solve the strain tensor at each point of a map from the lattice strains of several reflections.
+
+    For each point, the weighted least squares problem
+    :math:`\\min\\sum_r w_r(A_r e - \\varepsilon_r)^2` is solved, with A the
+    design matrix (see :py:func:`strain_design_matrix`) and e the 6 strain
+    components. The normal equations of all the points are built and solved
+    at once. The missing measurements (NaN strains) get a zero weight and the
+    points where the reflection directions do not determine the 6 components
+    (less than 6 reflections or an ill-conditioned system) are set to NaN.
+
+    The standard deviations of the components are estimated from the
+    residuals when more than 6 reflections are available.
+
+    :param strains: a (P, R) array of the lattice strains of R reflections at P points (or a (R,) array).
+    :param directions: the unit scattering vectors in the sample frame, a (R, 3) array shared by all the points or
+        a (P, R, 3) array.
+    :param weights: an optional (P, R) or (R,) array of weights, typically the inverse variances of the strains.
+    :param float max_condition: the maximum condition number of the normal equations.
+    :returns tuple (strain, errors): the (P, 3, 3) array of the strain tensors and the (P, 6) array of the standard
+        deviations of the components in Voigt order.
+    '''
+    eps = np.atleast_2d(np.asarray(strains, dtype=np.float64))
+    (P, R) = eps.shape
+    A = np.broadcast_to(strain_design_matrix(directions), (P, R, 6))
+    w = np.ones((P, R)) if weights is None else np.array(np.broadcast_to(weights, (P, R)), dtype=np.float64)
+    valid = np.isfinite(eps) & np.all(np.isfinite(A), axis=-1) & (w > 0)
+    w = np.where(valid, w, 0.)
+    eps = np.where(valid, eps, 0.)
+    A = np.where(valid[..., np.newaxis], A, 0.)
+    N = np.einsum('pri,pr,prj->pij', A, w, A)
+    b = np.einsum('pri,pr,pr->pi', A, w, eps)
+    n_valid = np.sum(valid, axis=1)
+    ok = n_valid >= 6
+    if np.any(ok):
+        ok[ok] = np.linalg.cond(N[ok]) < max_condition
+    e = np.nan * np.ones((P, 6))
+    errors = np.nan * np.ones((P, 6))
+    if np.any(ok):
+        N_inv = np.linalg.inv(N[ok])
+        e[ok] = np.einsum('pij,pj->pi', N_inv, b[ok])
+        # residual variance of unit weight
+        r = np.einsum('pri,pi->pr', A[ok], e[ok]) - eps[ok]
+        dof = n_valid[ok] - 6
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s2 = np.where(dof > 0, np.sum(w[ok] * r ** 2, axis=1) / dof, np.nan)
+        errors[ok] = np.sqrt(s2[:, np.newaxis] * np.diagonal(N_inv, axis1=1, axis2=2))
+    return tensor_from_components(e), errors
+
+
+def strain_to_stress(strain, stiffness, orientations=None):
+    '''Compute the stress tensors from the strain tensors with Hooke's law.
+
+    The stiffness matrix is given in Voigt notation in the crystal frame; it
+    is rotated into the sample frame with the orientation of each point (the
+    orientation matrix g transforms the sample coordinates into the crystal
+    coordinates, so that the rotation to apply is :math:`g^T`).
+
+    :param strain: a (P, 3, 3) array of strain tensors in the sample frame.
+    :param stiffness: the (6, 6) stiffness matrix of the crystal in Voigt notation or an
+        :py:class:`~pymicro.crystal.elasticity.ElasticTensor` instance.
+    :param orientations: the orientations of the points, an
+        :py:class:`~pymicro.crystal.microstructure.Orientation` instance or a list of those, or a (3, 3) or
+        (P, 3, 3) array of orientation matrices; None if the stiffness is already expressed in the sample frame.
+    :returns: a (P, 3, 3) array of the stress tensors (in the unit of the stiffness).
+    '''
+    strain = np.asarray(strain, dtype=np.float64).reshape((-1, 3, 3))
+    if isinstance(stiffness, ElasticTensor):
+        stiffness = stiffness.stiffness()
+    C = np.asarray(stiffness, dtype=np.float64)
+    if orientations is not None:
+        from pymicro.crystal.microstructure import Orientation
+        if isinstance(orientations, Orientation):
+            orientations = [orientations]
+        g = Orientation.orientation_matrices(orientations)
+        C = rotate_stiffness(C, np.swapaxes(g, -1, -2))
+    # engineering shear strains
+    e = tensor_components(strain) * np.array([1., 1., 1., 2., 2., 2.])
+    s = np.einsum('...ij,...j->...i', C, e)
+    return tensor_from_components(s)
+
+
+def strain_map(measured, directions, reference, lambda_keV=None, weights=None, stiffness=None, orientations=None):
+    '''Compute the strain (and stress) tensors of a map from the measured peak positions.
+
+    This chains :py:func:`lattice_strains`, :py:func:`fit_strain` and
+    :py:func:`strain_to_stress`.
+
+    :param measured: a (P, R) array of the measured interplanar spacings, or of the scattering angles in degrees if
+        the energy is given.
+    :param directions: the unit scattering vectors in the sample frame, a (R, 3) or (P, R, 3) array.
+    :param reference: the unstrained interplanar spacings or reflections (see :py:func:`lattice_strains`).
+    :param float lambda_keV: the X-ray energy in keV, if the scattering angles are given (None by default).
+    :param weights: an optional (P, R) array of weights.
+    :param stiffness: the (6, 6) stiffness matrix of the crystal to compute the stress (None by default).
+    :param orientations: the orientations of the points (see :py:func:`strain_to_stress`).
+    :returns tuple (strain, errors, stress): the strain tensors, their standard deviations and the stress tensors
+        (None if the stiffness is not given).
+    '''
+    strains = lattice_strains(measured, reference, lambda_keV)
+    (strain, errors) = fit_strain(strains, directions, weights)
+    stress = None
+    if stiffness is not None:
+        stress = strain_to_stress(strain, stiffness, orientations)
+    return strain, errors, stress
@@ -1,13 +1,21 @@
 import unittest
+import os
+import shutil
+import tempfile
 import numpy as np
-from pymicro.crystal.lattice import Lattice, HklDirection, HklPlane, SlipSystem
+from pymicro.crystal.lattice import Lattice, HklDirection, HklPlane, HklPlaneArray, SlipSystem
 from pymicro.crystal.microstructure import Orientation
-from pymicro.xray.laue import select_lambda
+from pymicro.xray.laue import select_lambda, diffracted_vector, laue_spot_table, laue_angle_table, index_laue_pattern, \
+    laue_sweep, compute_Laue_pattern
 
 
 class LaueTests(unittest.TestCase):
     def setUp(self):
         print 'testing the Lattice class'
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
 
     def test_angle_zone(self):
         '''Verify the angle between X and a particular zone axis expressed
@@ -36,6 +44,117 @@ class LaueTests(unittest.TestCase):
         self.assertAlmostEqual(the_lambda, 5.277, 3)
         self.assertAlmostEqual(theta * 180 / np.pi, 35.264, 3)
 
+    def test_laue_spot_table(self):
+        '''Compare the vectorized computation with the per reflection functions.'''
+        from pymicro.xray.detectors import Varian2520
+        ni = Lattice.from_symbol('Ni')
+        hkl = HklPlaneArray([[-1, -1, -1], [1, 1, 1], [2, 0, 4], [-1, 3, 1]], ni)
+        orientations = [Orientation.cube(), Orientation.from_euler([10., 20., 10.])]
+        detector = Varian2520()
+        detector.ref_pos = np.array([100., 0., 0.])
+        spots = laue_spot_table(orientations, hkl, detector)
+        self.assertEqual(spots.shape, (2, 4))
+        self.assertAlmostEqual(spots['energy'][0, 0], 5.277, 3)
+        self.assertAlmostEqual(spots['theta'][0, 0] * 180 / np.pi, 35.264, 3)
+        for n in range(len(hkl)):
+            (the_energy, theta) = select_lambda(hkl[n], orientations[1])
+            self.assertAlmostEqual(spots['energy'][1, n], the_energy)
+            K = diffracted_vector(hkl[n], orientations[1])
+            self.assertTrue(np.allclose(spots['K'][1, n], K))
+            if spots['hit'][1, n]:
+                (u, v) = detector.lab_to_pixel(detector.project_along_direction((0., 0., 0.), K))
+                self.assertAlmostEqual(spots['uv'][1, n, 0], u)
+                self.assertAlmostEqual(spots['uv'][1, n, 1], v)
+
+    def test_compute_Laue_pattern(self):
+        from pymicro.xray.detectors import RegArrayDetector2d
+        from pymicro.xray.dct import add_spots_to_image
+        ni = Lattice.from_symbol('Ni')
+        hkl = HklPlaneArray.generate(ni, max_miller=3)
+        detector = RegArrayDetector2d(size=(100, 80))
+        detector.ref_pos = np.array([100., 0., 0.])
+        detector.pixel_size = 0.5
+        orientation = Orientation.from_euler([10., 20., 30.])
+        pattern = compute_Laue_pattern(orientation, detector, hkl, r_spot=5)
+        # the spots centered just outside the detector are partly visible
+        spots = laue_spot_table(orientation, hkl, detector, margin=1.e6)[0]
+        spots = spots[spots['hit']]
+        self.assertTrue(np.any(~detector.is_on_detector(spots['uv'][:, 0], spots['uv'][:, 1]) &
+                               detector.is_on_detector(spots['uv'][:, 0], spots['uv'][:, 1], margin=5)))
+        expected = np.zeros(detector.size)
+        add_spots_to_image(expected, spots['uv'], np.ones((11, 11)))
+        self.assertTrue(np.array_equal(pattern > 0, expected > 0))
+
+    def test_laue_angle_table(self):
+        ni = Lattice.from_symbol('Ni')
+        (hkl, angles, pairs) = laue_angle_table(ni, max_miller=2, use_cache=False)
+        self.assertEqual(len(angles), len(hkl) * (len(hkl) - 1) // 2)
+        self.assertTrue(np.all(np.diff(angles) >= 0))
+        (p1, p2) = (hkl[pairs[-1, 0]], hkl[pairs[-1, 1]])
+        self.assertAlmostEqual(angles[-1], 90.)
+        self.assertAlmostEqual(np.dot(p1.normal(), p2.normal()), 0.)
+        # round trip through the disk cache
+        from pymicro.xray import laue
+        os.environ['PYMICRO_CACHE_DIR'] = self.tmp_dir
+        try:
+            laue._laue_angle_tables.clear()
+            laue_angle_table(ni, max_miller=2)
+            self.assertEqual(len(os.listdir(self.tmp_dir)), 1)
+            laue._laue_angle_tables.clear()
+            (other_hkl, other_angles, other_pairs) = laue_angle_table(ni, max_miller=2)
+            self.assertTrue(np.array_equal(other_hkl.miller_indices(), hkl.miller_indices()))
+            self.assertTrue(np.array_equal(other_angles, angles))
+            self.assertTrue(np.array_equal(other_pairs, pairs))
+        finally:
+            del os.environ['PYMICRO_CACHE_DIR']
+
+    def test_index_laue_pattern(self):
+        import time
+        from pymicro.xray.detectors import RegArrayDetector2d
+        np.random.seed(7)
+        ni = Lattice.from_symbol('Ni')
+        detector = RegArrayDetector2d(size=(1950, 1500))
+        detector.ref_pos = np.array([100., 0., 0.])
+        detector.pixel_size = 0.127
+        orientation = Orientation.from_euler([32., 51., 17.])
+        spots = laue_spot_table(orientation, HklPlaneArray.generate(ni, max_miller=3, first_order=True), detector)[0]
+        # Friedel pairs give the same spot
+        uv = np.unique(np.round(spots['uv'][spots['hit']], 6), axis=0)
+        np.random.shuffle(uv)
+        uv += np.random.normal(scale=0.5, size=uv.shape)
+        t_start = time.time()
+        solutions = index_laue_pattern(uv, detector, ni)
+        self.assertTrue(time.time() - t_start < 2.)
+        (found, n_indexed, rms) = solutions[0]
+        self.assertEqual(n_indexed, len(uv))
+        self.assertTrue(rms < 1.)
+        self.assertTrue(np.degrees(found.disorientation(orientation)[0]) < 0.05)
+
+    def test_laue_sweep(self):
+        from pymicro.xray.detectors import RegArrayDetector2d
+        ni = Lattice.from_symbol('Ni')
+        hkl = HklPlaneArray.generate(ni, max_miller=3)
+        detector = RegArrayDetector2d(size=(512, 512))
+        detector.ref_pos = np.array([100., 0., 0.])
+        detector.pixel_size = 0.4
+        orientations = [Orientation.from_euler([45., 10. + i, 0.]) for i in range(6)]
+        distances = np.linspace(80., 120., 6)
+        spot_lists = laue_sweep(orientations, detector, hkl, distances=distances, chunk_size=4)
+        self.assertEqual(len(spot_lists), 6)
+        for i in [0, 5]:
+            detector.ref_pos = np.array([distances[i], 0., 0.])
+            spots = laue_spot_table(orientations[i], hkl, detector)[0]
+            self.assertTrue(np.all(spot_lists[i]['hkl_index'] == np.where(spots['hit'])[0]))
+            self.assertTrue(np.allclose(spot_lists[i]['uv'], spots['uv'][spots['hit']]))
+        # image stack in a memory mapped file
+        npy_path = os.path.join(self.tmp_dir, 'sweep.npy')
+        stack = laue_sweep(orientations, detector, hkl, output=npy_path, r_spot=0)
+        self.assertEqual(stack.shape, (6, 512, 512))
+        # each spot adds 1 to the image (if the closest pixel is on the detector)
+        uv = np.rint(laue_sweep(orientations[2:3], detector, hkl)[0]['uv'])
+        self.assertEqual(stack[2].sum(), np.sum(np.all(uv < 512, axis=1)))
+        del stack
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+import numpy as np
+from pymicro.xray.detectors import RegArrayDetector2d
+from pymicro.xray.calibration import calibrant_d_spacings, ring_two_thetas, scattering_angles, \
+    extract_ring_points, calibrate
+
+
+class CalibrationTests(unittest.TestCase):
+    def setUp(self):
+        print 'testing the calibration module'
+        # simulated CeO2 powder pattern at 30 keV on a tilted detector
+        self.detector = self.new_detector()
+        self.detector.ref_pos = np.array([150., 0., 0.])
+        (self.detector.ucen, self.detector.vcen) = (210.3, 190.7)
+        self.detector.set_tilts([0., 2., -1.5])
+        self.rings = ring_two_thetas(calibrant_d_spacings('CeO2'), 30.)
+        (tth, eta) = scattering_angles(self.detector)
+        np.random.seed(0)
+        self.image = 10 + np.random.normal(0., 1., self.detector.size)
+        for two_theta in self.rings:
+            self.image += 100 * np.exp(-0.5 * ((tth - two_theta) / 0.04) ** 2)
+
+    @staticmethod
+    def new_detector():
+        detector = RegArrayDetector2d(size=(400, 400))
+        detector.pixel_size = 0.2
+        return detector
+
+    def test_calibrant_d_spacings(self):
+        a = 0.543102
+        d = calibrant_d_spacings('Si', d_min=0.1)
+        # (200) and (222) are forbidden for the diamond structure
+        self.assertTrue(np.allclose(d[:4], a / np.sqrt([3, 8, 11, 16])))
+        self.assertAlmostEqual(calibrant_d_spacings('LaB6')[0], 0.415692)
+        self.assertTrue(np.allclose(calibrant_d_spacings('CeO2')[:3], 0.541165 / np.sqrt([3, 4, 8])))
+        self.assertRaises(ValueError, calibrant_d_spacings, 'Au')
+
+    def test_extract_ring_points(self):
+        points = extract_ring_points(self.image, self.detector, self.rings, n_sectors=36)
+        self.assertTrue(len(points) > 100)
+        # the points are on the rings
+        p = self.detector.pixel_to_lab(points['uv'][:, 0], points['uv'][:, 1])
+        two_theta = np.degrees(np.arccos(p[:, 0] / np.linalg.norm(p, axis=1)))
+        self.assertTrue(np.all(np.abs(two_theta - points['two_theta']) < 0.02))
+
+    def test_calibrate(self):
+        detector = self.new_detector()
+        detector.ref_pos = np.array([148., 0., 0.])
+        (detector.ucen, detector.vcen) = (207., 194.)
+        (points, residuals) = calibrate(detector, self.image, 'CeO2', lambda_keV=30.)
+        self.assertTrue(np.sqrt(np.mean(residuals ** 2)) < 0.005)
+        self.assertAlmostEqual(detector.ref_pos[0], 150., 1)
+        self.assertAlmostEqual(detector.ucen, 210.3, 1)
+        self.assertAlmostEqual(detector.vcen, 190.7, 1)
+        self.assertTrue(np.allclose(detector.tilts, [0., 2., -1.5], atol=0.02))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from pymicro.crystal.lattice import Lattice, HklPlaneArray
+from pymicro.crystal.microstructure import Orientation, Grain
+from pymicro.xray.detectors import RegArrayDetector2d
+from pymicro.xray.dct import dct_spot_table, dct_projection, simulate_dct_scan, add_spots_to_image, add_to_image
+
+
+class DctTests(unittest.TestCase):
+    def setUp(self):
+        print 'testing the dct module'
+        self.ni = Lattice.from_symbol('Ni')
+        self.hkl = HklPlaneArray.generate(self.ni, max_miller=2)
+        self.grains = [Grain(5, Orientation.from_euler([45., 30., 10.])),
+                       Grain(7, Orientation.from_euler([12., 84., 55.]))]
+        self.grains[1].position = np.array([0.1, -0.2, 0.05])
+        self.detector = RegArrayDetector2d(size=(2048, 2048))
+        self.detector.ref_pos = np.array([5., 0., 0.])
+        self.detector.pixel_size = 0.0014
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_dct_spot_table(self):
+        spots = dct_spot_table(self.grains, self.hkl, 40., detector=self.detector)
+        self.assertEqual(len(spots), 2 * len(self.hkl))
+        self.assertEqual(list(np.unique(spots['grain_id'])), [5, 7])
+        for i in [0, 17, len(self.hkl) + 3]:
+            row = spots[i]
+            grain = self.grains[i // len(self.hkl)]
+            plane = self.hkl[i % len(self.hkl)]
+            self.assertTrue(np.all(plane.miller_indices() == row['hkl']))
+            (w1, w2) = grain.dct_omega_angles(plane, 40.)
+            self.assertAlmostEqual(row['omega'][0], w1)
+            self.assertAlmostEqual(row['omega'][1], w2)
+            self.assertAlmostEqual(row['two_theta'], 2 * np.degrees(plane.bragg_angle(40.)))
+            # compare the spot position with the detector projection
+            omega = np.radians(w1)
+            R = np.array([[np.cos(omega), -np.sin(omega), 0], [np.sin(omega), np.cos(omega), 0], [0, 0, 1]])
+            K = np.array([40. / 1.2398, 0., 0.]) + R.dot(grain.orientation_matrix().T.dot(plane.scattering_vector()))
+            if K[0] > 0:
+                p = self.detector.project_along_direction(R.dot(grain.position), K)
+                (u, v) = self.detector.lab_to_pixel(p)
+                self.assertAlmostEqual(row['uv'][0, 0], u)
+                self.assertAlmostEqual(row['uv'][0, 1], v)
+
+    def test_dct_spot_table_invalid(self):
+        # at low energy the high order reflections cannot diffract
+        spots = dct_spot_table(self.grains, self.hkl, 8., detector=self.detector)
+        self.assertTrue(np.any(~spots['valid']))
+        self.assertTrue(np.all(np.isnan(spots['omega'][~spots['valid']])))
+
+    def test_simulate_dct_scan(self):
+        data = np.zeros((30, 30, 10), dtype=np.uint8)
+        data[5:12, 10:20, 2:8] = 5
+        data[18:25, 3:9, 1:9] = 7
+        detector = RegArrayDetector2d(size=(256, 256))
+        detector.ref_pos = np.array([3., 0., 0.])
+        detector.pixel_size = 0.01
+        omegas = np.arange(0., 40., 2.)
+        frames = simulate_dct_scan(self.grains, data, omegas, 30., detector, self.hkl, include_direct_beam=False)
+        self.assertEqual(frames.shape, (len(omegas), 256, 256))
+        # without direct beam, the frames contain the diffraction spots only
+        self.assertTrue(frames.sum() > 0)
+        self.assertTrue(np.all(frames >= 0))
+        # frames streamed to a memory mapped file
+        npy_path = os.path.join(self.tmp_dir, 'scan.npy')
+        stack = simulate_dct_scan(self.grains, data, omegas, 30., detector, self.hkl, output=npy_path,
+                                  include_direct_beam=False, chunk_size=4)
+        self.assertTrue(np.allclose(stack, frames))
+        del stack
+        # image sequence computed by a pool of processes
+        edf_pattern = os.path.join(self.tmp_dir, 'dct_%04d.edf')
+        simulate_dct_scan(self.grains, data, omegas, 30., detector, self.hkl, output=edf_pattern,
+                          include_direct_beam=False, n_processes=2, chunk_size=5)
+        from pymicro.file.file_utils import edf_read
+        for i in [0, 7, len(omegas) - 1]:
+            self.assertTrue(np.allclose(edf_read(edf_pattern % i), frames[i]))
+
+    def test_simulate_dct_scan_direct_beam(self):
+        data = np.zeros((30, 30, 10), dtype=np.uint8)
+        data[5:12, 10:20, 2:8] = 5
+        data[18:25, 3:9, 1:9] = 7
+        data[13:17, 12:18, 3:7] = 9
+        grains = self.grains + [Grain(9, Orientation.from_euler([0., 0., 0.]))]
+        detector = RegArrayDetector2d(size=(256, 256))
+        detector.ref_pos = np.array([3., 0., 0.])
+        detector.pixel_size = 0.01
+        # center the scan on a spot of grain 7 hitting the detector
+        from scipy import ndimage
+        coms = np.array(ndimage.measurements.center_of_mass(data > 0, data, [5, 7, 9]))
+        positions = detector.pixel_size * (coms - 0.5 * np.array(data.shape))
+        spots = dct_spot_table(grains, self.hkl, 30., detector=detector, positions=positions, grain_ids=[5, 7, 9])
+        uv = spots['uv'][:, 0]
+        i = np.where((spots['grain_id'] == 7) & spots['valid'] & np.all(np.isfinite(uv), axis=1))[0][0]
+        step = 0.5
+        omegas = spots['omega'][i, 0] + step * np.arange(-2, 3)
+        frames = simulate_dct_scan(grains, data, omegas, 30., detector, self.hkl, include_direct_beam=True,
+                                   cache_step=0, n_processes=2, chunk_size=2)
+        # diffracting grains of the middle frame
+        dif_grains = []
+        for row in spots[spots['valid']]:
+            for which in range(2):
+                delta = np.mod(row['omega'][which] - omegas[2] + 180., 360.) - 180.
+                if abs(delta) < 0.5 * step and np.all(np.isfinite(row['uv'][which])):
+                    dif_grains.append((row['grain_id'], tuple(row['hkl'])))
+        self.assertTrue((7, tuple(spots['hkl'][i])) in dif_grains)
+        orientations = dict([(grain.id, grain.orientation) for grain in grains])
+        expected = dct_projection(orientations, data, dif_grains, omegas[2], 30., detector, self.ni,
+                                  include_direct_beam=True, verbose=False)
+        self.assertTrue(np.allclose(frames[2], expected, atol=1.e-5))
+
+    def test_add_spots_to_image(self):
+        image = np.zeros((20, 10))
+        spots = np.arange(12).reshape((1, 3, 4)) * np.ones((3, 1, 1))
+        # one spot inside, one partly outside (near the origin) and one completely outside
+        n = add_spots_to_image(image, [(5, 5), (0, 1), (30, 5)], spots, weights=[1., 2., 1.])
+        self.assertEqual(n, 12 + 6)
+        self.assertTrue(np.allclose(image[4:7, 3:7], spots[0]))
+        self.assertTrue(np.allclose(image[0:2, 0:3], 2 * spots[0][1:, 1:]))
+        self.assertAlmostEqual(image.sum(), spots[0].sum() + 2 * spots[0][1:, 1:].sum())
+        # single inset, integer image saturation
+        image = np.zeros((10, 10), dtype=np.uint8)
+        add_to_image(image, 200 * np.ones((3, 3), dtype=np.uint8), (0, 0))
+        add_to_image(image, 200 * np.ones((3, 3), dtype=np.uint8), (1, 1))
+        self.assertEqual(image[0, 0], 255)
+        self.assertEqual(image[2, 2], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import numpy as np
+from pymicro.xray.detectors import RegArrayDetector2d, Xpad
+
+
+class DetectorsTests(unittest.TestCase):
+    def setUp(self):
+        print 'testing the detectors module'
+        self.detector = RegArrayDetector2d(size=(300, 200))
+        self.detector.ref_pos = np.array([100., 2., -1.])
+        self.detector.pixel_size = 0.2
+
+    def test_vectorized_geometry(self):
+        np.random.seed(0)
+        origins = np.random.normal(scale=0.5, size=(50, 3))
+        directions = np.random.normal(size=(50, 3))
+        directions[:, 0] = np.abs(directions[:, 0]) + 1.
+        directions[0] = [0., 1., 0.]  # parallel to the detector
+        p = self.detector.project_along_direction(origins, directions)
+        self.assertTrue(np.all(np.isnan(p[0])))
+        (u, v) = self.detector.lab_to_pixel(p)
+        for i in range(1, 50):
+            pi = self.detector.project_along_direction(origins[i], directions[i])
+            self.assertTrue(np.allclose(p[i], pi))
+            (ui, vi) = self.detector.lab_to_pixel(pi)
+            self.assertAlmostEqual(u[i], ui)
+            self.assertAlmostEqual(v[i], vi)
+        self.assertTrue(np.allclose(self.detector.pixel_to_lab(u[1:], v[1:]), p[1:]))
+        # mask of the beams hitting the detector, the beams going backward never hit
+        (uv, mask) = self.detector.project_to_pixels(origins, directions)
+        self.assertFalse(mask[0])
+        (u, v) = (u[1:], v[1:])
+        self.assertTrue(np.all(mask[1:] == ((u >= 0) & (u < 300) & (v >= 0) & (v < 200))))
+        (uv, mask) = self.detector.project_to_pixels(origins, -directions)
+        self.assertFalse(np.any(mask))
+        self.assertTrue(np.all(np.isnan(uv)))
+
+    def test_lab_coordinates(self):
+        xyz = self.detector.lab_coordinates()
+        self.assertEqual(xyz.shape, (300, 200, 3))
+        self.assertTrue(np.allclose(xyz[12, 34], self.detector.pixel_to_lab(12, 34)))
+        self.assertTrue(self.detector.lab_coordinates() is xyz)
+        # the map is updated when the detector moves
+        self.detector.ref_pos = np.array([50., 0., 0.])
+        self.assertTrue(np.allclose(self.detector.lab_coordinates()[12, 34], self.detector.pixel_to_lab(12, 34)))
+
+    def test_tilts(self):
+        u_dir, v_dir = self.detector.u_dir, self.detector.v_dir
+        self.detector.set_tilts([0., 0., 90.])
+        # 90 degrees around Z: -Y becomes X
+        self.assertTrue(np.allclose(self.detector.u_dir, [1., 0., 0.]))
+        self.assertTrue(np.allclose(self.detector.v_dir, v_dir))
+        self.detector.set_tilts([0., 10., 0.])
+        self.assertAlmostEqual(np.degrees(np.arccos(np.dot(self.detector.w_dir, [1., 0., 0.]))), 10.)
+        # the reference pixel stays at the same position and the projection is consistent
+        self.assertTrue(np.allclose(self.detector.pixel_to_lab(self.detector.ucen, self.detector.vcen),
+                                    self.detector.ref_pos))
+        p = self.detector.pixel_to_lab(20., 150.)
+        (u, v) = self.detector.lab_to_pixel(self.detector.project_along_direction((0., 0., 0.), p))
+        self.assertAlmostEqual(u, 20.)
+        self.assertAlmostEqual(v, 150.)
+        self.detector.set_tilts([0., 0., 0.])
+        self.assertTrue(np.all(self.detector.u_dir == u_dir))
+
+    def test_xpad_correct_geometry(self):
+        xpad = Xpad()
+        np.random.seed(1)
+        data = np.random.rand(240, 560)
+        corrected = xpad.correct_geometry(data)
+        self.assertEqual(corrected.shape, (243, 578))
+        f = xpad.factorIdoublePixel
+        # regular pixels are copied, accounting for the gaps between the chips and modules
+        self.assertAlmostEqual(corrected[0, 0], data[0, 0])
+        self.assertAlmostEqual(corrected[10, 84], data[10, 81])
+        self.assertAlmostEqual(corrected[130, 84], data[127, 81])
+        # double pixels are split and the pixels in the gaps are interpolated
+        self.assertAlmostEqual(corrected[10, 79], data[10, 79] / f)
+        self.assertAlmostEqual(corrected[10, 80], data[10, 79] / f)
+        self.assertAlmostEqual(corrected[10, 81], (data[10, 78] + data[10, 80]) / 2 / f)
+        # double lines at the junction of the modules
+        self.assertAlmostEqual(corrected[120, 5], data[119, 5] / f)
+        self.assertAlmostEqual(corrected[121, 5], (data[119, 5] + data[120, 5]) / 2 / f)
+        self.assertAlmostEqual(corrected[122, 5], data[120, 5] / f)
+        # a stack of frames is corrected at once
+        stack = xpad.correct_geometry(np.array([data, 2 * data]))
+        self.assertEqual(stack.shape, (2, 243, 578))
+        self.assertTrue(np.allclose(stack[1], 2 * corrected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import numpy as np
+from pymicro.xray.fitting import Gaussian, Voigt, profile_model, fit_profiles
+
+
+class FittingTests(unittest.TestCase):
+    def setUp(self):
+        print 'testing the fitting module'
+        self.x = np.linspace(-5., 5., 101)
+        np.random.seed(0)
+
+    def test_profile_derivatives(self):
+        for (profile, p) in [('Gaussian', [0.3, 0.8, 1.2]), ('Lorentzian', [0.3, 0.8, 1.2]),
+                             ('PseudoVoigt', [0.3, 0.8, 1.2, 0.4]), ('Voigt', [0.3, 0.8, 0.5, 1.2])]:
+            params = np.array([p + [0.5, 0.1]])
+            (f, J) = profile_model(self.x, params, profile, n_background=2, jacobian=True)
+            for i in range(params.shape[1]):
+                h = 1.e-6 * np.eye(params.shape[1])[i]
+                df = (profile_model(self.x, params + h, profile, n_background=2)[0] -
+                      profile_model(self.x, params - h, profile, n_background=2)[0]) / 2.e-6
+                self.assertTrue(np.allclose(J[0, :, i], df[0], atol=1.e-6))
+        # the predefined functions share the same expressions
+        v = Voigt(0.3, 0.8, 0.5, 1.2)
+        self.assertTrue(np.allclose(v(self.x), profile_model(self.x, [0.3, 0.8, 0.5, 1.2], 'Voigt')[0][0]))
+
+    def test_fit_profiles(self):
+        # a raster scan of 20 x 30 profiles with a shifting peak on a linear background
+        positions = 0.5 * np.sin(np.arange(600) / 50.)
+        true = np.array([[x0, 0.6, 10., 0.3, 1., 0.05] for x0 in positions])
+        profiles = profile_model(self.x, true, 'PseudoVoigt', n_background=2)[0]
+        profiles += np.random.normal(0., 0.05, profiles.shape)
+        (params, cost, converged) = fit_profiles(self.x, profiles, profile='PseudoVoigt', n_background=2)
+        self.assertTrue(np.all(converged))
+        self.assertTrue(np.allclose(params[:, 0], positions, atol=0.01))
+        self.assertTrue(np.allclose(cost / len(self.x), 0.05 ** 2, rtol=0.5))
+        # warm start along the rows, split between several processes
+        (params2, cost2, converged2) = fit_profiles(self.x, profiles, profile='PseudoVoigt', n_background=2,
+                                                    row_length=30, n_processes=2)
+        self.assertTrue(np.all(converged2))
+        self.assertTrue(np.allclose(params2, params, atol=1.e-3))
+        # two Gaussian peaks, compare with the single profile fit
+        init = [-1.2, 0.5, 3., 1.2, 0.5, 2.]
+        y = profile_model(self.x, [-1., 0.6, 3., 1.5, 0.4, 2.], 'Gaussian', n_peaks=2)[0][0]
+        (params, cost, converged) = fit_profiles(self.x, y, init=init, n_peaks=2)
+        self.assertTrue(np.allclose(params[0], [-1., 0.6, 3., 1.5, 0.4, 2.]))
+        g = Gaussian(-1.2, 0.5, 3.)
+        g.fit(profile_model(self.x, [-1., 0.6, 3.], 'Gaussian')[0][0], self.x)
+        self.assertAlmostEqual(g.fwhm(), 2 * 0.6 * np.sqrt(np.log(2)))
+        self.assertRaises(ValueError, fit_profiles, self.x, y, n_peaks=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from pymicro.xray.detectors import RegArrayDetector2d
+from pymicro.xray.integration import AzimuthalIntegrator
+
+
+class IntegrationTests(unittest.TestCase):
+    def setUp(self):
+        print 'testing the integration module'
+        self.cache_dir = tempfile.mkdtemp()
+        os.environ['PYMICRO_CACHE_DIR'] = self.cache_dir
+        self.detector = RegArrayDetector2d(size=(200, 150))
+        self.detector.calib = 5.
+        self.detector.compute_TwoTh_Psi_arrays()
+        np.random.seed(13)
+        self.detector.corr_data = np.random.rand(200, 150) * 100
+
+    def tearDown(self):
+        del os.environ['PYMICRO_CACHE_DIR']
+        shutil.rmtree(self.cache_dir)
+
+    def test_integrate(self):
+        integrator = AzimuthalIntegrator.from_detector(self.detector)
+        (two_theta_values, intensity, counts) = integrator.integrate(self.detector.corr_data, n_bins=150,
+                                                                     two_theta_range=(2., 17.))
+        # compare with the detector method
+        (tt, it, ct) = self.detector.azimuthal_regroup(two_theta_mini=2., two_theta_maxi=17., two_theta_step=0.1)
+        self.assertTrue(np.allclose(two_theta_values, tt))
+        self.assertTrue(np.allclose(counts, ct))
+        self.assertTrue(np.allclose(intensity, it))
+        # the lookup matrix is stored on the disk and reused
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        other = AzimuthalIntegrator.from_detector(self.detector)
+        self.assertTrue(np.allclose(other.integrate(self.detector.corr_data, 150, (2., 17.))[1], intensity))
+
+    def test_integrate_stack(self):
+        mask = np.zeros((200, 150), dtype=bool)
+        mask[:, :20] = True
+        integrator = AzimuthalIntegrator(self.detector.two_thetas, self.detector.psis, mask=mask, use_cache=False)
+        frames = np.random.rand(4, 200, 150)
+        (two_theta_values, intensity, counts) = integrator.integrate(frames, n_bins=50, psi_range=(10., 120.))
+        self.assertEqual(intensity.shape, (4, 50))
+        for i in range(4):
+            self.assertTrue(np.allclose(integrator.integrate(frames[i], 50, psi_range=(10., 120.))[1], intensity[i],
+                                        equal_nan=True))
+        # masked pixels and pixels outside of the psi range do not contribute
+        valid = ~mask & (self.detector.psis >= 10.) & (self.detector.psis <= 120.)
+        self.assertEqual(counts.sum(), np.sum(valid))
+        self.assertAlmostEqual(np.nansum(intensity[0] * counts), frames[0][valid].sum())
+
+    def test_cake(self):
+        integrator = AzimuthalIntegrator.from_detector(self.detector, use_cache=False)
+        # without pixel splitting, a single 2theta bin gives the same profile as sagital_regroup
+        (psi_values, it, ct) = self.detector.sagital_regroup(two_theta_mini=5., two_theta_maxi=15., psi_min=0.,
+                                                             psi_max=180., psi_step=5.)
+        (two_theta_values, psis, cake, counts) = integrator.cake(self.detector.corr_data, n_two_theta=1, n_psi=36,
+                                                                 two_theta_range=(5., 15.), psi_range=(0., 180.),
+                                                                 split_pixels=False)
+        self.assertTrue(np.allclose(psis, psi_values))
+        # the pixels at psi = 180 are in the last bin of the cake
+        self.assertTrue(np.allclose(counts[:-1, 0], ct[:-1]))
+        self.assertTrue(np.allclose(cake[:-1, 0], it[:-1]))
+        # with pixel splitting, a uniform image gives a uniform cake
+        (two_theta_values, psis, cake, counts) = integrator.cake(np.ones((200, 150)), n_two_theta=40, n_psi=30)
+        self.assertEqual(cake.shape, (30, 40))
+        self.assertTrue(np.allclose(cake[np.isfinite(cake)], 1.))
+        # each pixel is distributed over the bins (except at the edges of the ranges)
+        self.assertTrue(counts.sum() <= np.sum(np.isfinite(self.detector.psis)))
+        self.assertTrue(counts.sum() > 0.99 * np.sum(np.isfinite(self.detector.psis)))
+        # a stack of frames is regrouped at once
+        frames = np.random.rand(3, 200, 150)
+        cakes = integrator.cake(frames, n_two_theta=40, n_psi=30)[2]
+        self.assertEqual(cakes.shape, (3, 30, 40))
+        self.assertTrue(np.allclose(cakes[1], integrator.cake(frames[1], n_two_theta=40, n_psi=30)[2], equal_nan=True))
+
+    def test_split_pixels(self):
+        integrator = AzimuthalIntegrator.from_detector(self.detector, use_cache=False)
+        # bins much narrower than the pixels
+        (tt, intensity, counts) = integrator.integrate(self.detector.corr_data, n_bins=1000, two_theta_range=(5., 15.))
+        (tt, intensity_split, counts_split) = integrator.integrate(self.detector.corr_data, n_bins=1000,
+                                                                   two_theta_range=(5., 15.), split_pixels=True)
+        # without splitting some bins are empty, with splitting the pixel counts vary smoothly
+        self.assertTrue(np.any(counts == 0))
+        self.assertTrue(np.all(counts_split > 0))
+        self.assertTrue(np.std(np.diff(counts_split)) < 0.1 * np.std(np.diff(counts)))
+        # the total intensity is conserved (except at the edges of the range)
+        self.assertAlmostEqual(np.sum(intensity_split * counts_split) / np.nansum(intensity * counts), 1., 2)
+
+    def test_corrections(self):
+        integrator = AzimuthalIntegrator.from_detector(self.detector, use_cache=False)
+        two_theta = np.radians(self.detector.two_thetas)
+        solid_angle = integrator.solid_angle()
+        self.assertTrue(integrator.solid_angle() is solid_angle)
+        self.assertAlmostEqual(solid_angle.max(), 1.)
+        self.assertTrue(np.allclose(integrator.polarization(0.), 0.5 * (1 + np.cos(two_theta) ** 2)))
+        # for a fully polarized beam, there is no intensity in the polarization plane at 2theta = 90
+        polarization = integrator.polarization(1.)
+        psi = np.radians(self.detector.psis)
+        self.assertTrue(np.allclose(polarization[np.isfinite(psi)], (1 - np.cos(psi) ** 2 * np.sin(two_theta) ** 2)
+                                    [np.isfinite(psi)]))
+        absorption = integrator.absorption(mu_air=1.e-3, distance=200.)
+        self.assertTrue(np.allclose(absorption, np.exp(-0.2 / np.cos(two_theta))))
+        # the corrections are removed from the integrated intensity
+        correction = solid_angle * polarization * absorption
+        (tt, intensity, counts) = integrator.integrate(50. * correction, n_bins=100, correction=correction)
+        self.assertTrue(np.allclose(intensity[np.isfinite(intensity)], 50.))
+
+    def test_corrections_tilted_detector(self):
+        from pymicro.xray.calibration import scattering_angles
+        detector = RegArrayDetector2d(size=(200, 150))
+        detector.pixel_size = 0.2
+        detector.ref_pos = np.array([100., 5., -3.])
+        (detector.ucen, detector.vcen) = (60., 90.)
+        for tilts in [(0., 0., 0.), (4., 25., -10.)]:
+            detector.set_tilts(tilts)
+            (detector.two_thetas, detector.psis) = scattering_angles(detector)
+            integrator = AzimuthalIntegrator.from_detector(detector, use_cache=False)
+            self.assertTrue(integrator.lab_coordinates is not None)
+            if np.any(tilts):
+                # the scattering angles computed without the tilts do not match the corrections
+                detector.compute_TwoTh_Psi_arrays()
+                self.assertRaises(ValueError, AzimuthalIntegrator.from_detector, detector)
+                (detector.two_thetas, detector.psis) = scattering_angles(detector)
+            # solid angle of the pixels relative to a pixel at normal incidence
+            (u, v) = np.meshgrid(np.arange(200), np.arange(150), indexing='ij')
+            r = detector.pixel_to_lab(u.ravel(), v.ravel())
+            n = np.cross(detector.u_dir, detector.v_dir)
+            distance = abs(np.dot(detector.ref_pos, n))
+            cos_alpha = np.abs(np.dot(r, n)) / np.linalg.norm(r, axis=1)
+            omega = cos_alpha / np.sum(r ** 2, axis=1) * distance ** 2
+            self.assertTrue(np.allclose(integrator.solid_angle(), omega.reshape((200, 150)), rtol=1.e-5))
+            absorption = integrator.absorption(mu_air=1.e-3, mu_filter=0.5, filter_thickness=0.1)
+            expected = np.exp(-1.e-3 * np.linalg.norm(r, axis=1) - 0.05 / cos_alpha).reshape((200, 150))
+            self.assertTrue(np.allclose(absorption, expected, rtol=1.e-5))
+            if not np.any(tilts):
+                # a detector perpendicular to the beam gives the 2theta formulas
+                cos_2theta = np.cos(np.radians(detector.two_thetas))
+                self.assertTrue(np.allclose(integrator.solid_angle(), cos_2theta ** 3, rtol=1.e-5))
+            else:
+                self.assertFalse(np.allclose(integrator.solid_angle(), np.cos(np.radians(detector.two_thetas)) ** 3,
+                                             rtol=1.e-2))
+
+
+if __name__ == '__main__':
+    unittest.main()
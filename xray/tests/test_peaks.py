@@ -0,0 +1,77 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from pymicro.xray.fitting import profile_model, fit_profiles
+from pymicro.xray.peaks import find_peaks, seed_parameters, estimate_background, find_spots
+
+
+class PeaksTests(unittest.TestCase):
+    def setUp(self):
+        print 'testing the peaks module'
+        np.random.seed(0)
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_find_peaks(self):
+        x = np.linspace(2., 8., 600)
+        true = np.array([[3.5 + 0.01 * j, 0.05, 20., 5.2, 0.08, 10., 2., 0.1] for j in range(50)])
+        profiles = profile_model(x, true, 'Gaussian', n_peaks=2, n_background=2)[0]
+        profiles += np.random.normal(0., 0.3, profiles.shape)
+        peaks = find_peaks(profiles, x)
+        self.assertEqual(len(peaks), 100)
+        self.assertTrue(np.all(np.bincount(peaks['profile']) == 2))
+        self.assertTrue(np.allclose(peaks['position'][::2], true[:, 0], atol=0.005))
+        self.assertTrue(np.allclose(peaks['hwhm'][::2], 0.05 * np.sqrt(np.log(2)), rtol=0.3))
+        self.assertTrue(np.allclose(peaks['height'][::2], 20., rtol=0.1))
+        self.assertEqual(len(find_peaks(profiles, x, max_peaks=1)), 50)
+        # the peaks seed the fit of the profiles
+        init = seed_parameters(peaks, len(profiles), 'Gaussian', n_peaks=2, n_background=2)
+        (params, cost, converged) = fit_profiles(x, profiles, init, 'Gaussian', n_peaks=2, n_background=2)
+        self.assertTrue(np.all(converged))
+        self.assertTrue(np.allclose(params[:, [0, 3]], true[:, [0, 3]], atol=0.005))
+        # a profile without enough peaks is not fitted
+        init = seed_parameters(peaks, len(profiles), 'Gaussian', n_peaks=3)
+        self.assertTrue(np.all(np.isnan(init)))
+
+    def test_find_spots(self):
+        frames = np.random.poisson(20, (12, 128, 150)).astype(np.float32)
+        (uu, vv) = np.mgrid[:128, :150]
+        for k in range(len(frames)):
+            for (u0, v0) in [(30.3, 70.6), (100.2 - k, 31.1)]:
+                frames[k] += 300 * np.exp(-((uu - u0) ** 2 + (vv - v0) ** 2) / (2 * 1.5 ** 2))
+        (background, noise) = estimate_background(frames)
+        self.assertEqual(background.shape, frames.shape)
+        self.assertTrue(np.allclose(background, 20., atol=1.))
+        spots = find_spots(frames)
+        self.assertEqual(len(spots), 24)
+        self.assertTrue(np.all(np.bincount(spots['frame']) == 2))
+        first = spots[spots['frame'] == 0]
+        self.assertTrue(np.allclose(np.sort(first['uv'], axis=0), [[30.3, 31.1], [100.2, 70.6]], atol=0.1))
+        self.assertTrue(np.allclose(spots['intensity'], 300 * 2 * np.pi * 1.5 ** 2, rtol=0.1))
+        # frames read from a file by several processes
+        npy_path = os.path.join(self.tmp_dir, 'frames.npy')
+        np.save(npy_path, frames)
+        other = find_spots(npy_path, n_processes=2, chunk_size=5)
+        self.assertTrue(np.allclose(other['uv'], spots['uv']))
+        # frames read from an open HDF5 source by several processes
+        import h5py
+        from pymicro.file.file_utils import HDF5FrameSource
+        h5_path = os.path.join(self.tmp_dir, 'frames.h5')
+        with h5py.File(h5_path, 'w') as f:
+            f['scan/data'] = frames
+        with HDF5FrameSource(h5_path) as source:
+            other = find_spots(source, n_processes=2, chunk_size=2)
+            self.assertEqual(len(other), len(spots))
+            self.assertTrue(np.allclose(other['uv'], spots['uv']))
+            # the source can still be used
+            self.assertTrue(np.array_equal(source[11], frames[11]))
+        other = find_spots(h5_path, n_processes=2, chunk_size=2)
+        self.assertTrue(np.allclose(other['uv'], spots['uv']))
+
+
+if __name__ == '__main__':
+    unittest.main()
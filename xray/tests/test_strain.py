@@ -0,0 +1,61 @@
+import unittest
+import numpy as np
+from pymicro.crystal.lattice import Lattice, HklPlaneArray
+from pymicro.crystal.microstructure import Orientation
+from pymicro.xray.strain import lattice_strains, scattering_directions, fit_strain, tensor_from_components, \
+    tensor_components, rotate_stiffness, strain_to_stress, strain_map
+
+
+class StrainTests(unittest.TestCase):
+    def setUp(self):
+        print 'testing the strain module'
+        np.random.seed(0)
+        self.hkl = HklPlaneArray.generate(Lattice.from_symbol('Ni'), max_miller=3, first_order=True,
+                                          include_friedel_pair=False)
+        self.strain = tensor_from_components(np.random.normal(0., 1.e-3, (50, 6)))
+        two_theta = np.random.uniform(5., 20., (50, len(self.hkl)))
+        eta = np.random.uniform(0., 360., (50, len(self.hkl)))
+        self.directions = scattering_directions(two_theta, eta)
+        eps = np.einsum('pri,pij,prj->pr', self.directions, self.strain, self.directions)
+        self.d = self.hkl.interplanar_spacings() * (1 + eps)
+
+    def test_fit_strain(self):
+        (strain, errors) = fit_strain(lattice_strains(self.d, self.hkl), self.directions)
+        self.assertTrue(np.allclose(strain, self.strain))
+        # from the scattering angles with missing measurements
+        two_theta = 2 * np.degrees(np.arcsin(1.2398 / 40. / (2 * self.d)))
+        two_theta[0, :-5] = np.nan
+        two_theta[1, :3] = np.nan
+        strains = lattice_strains(two_theta, self.hkl, lambda_keV=40.)
+        (strain, errors) = fit_strain(strains + np.random.normal(0., 1.e-5, strains.shape), self.directions)
+        self.assertTrue(np.all(np.isnan(strain[0])))
+        # the errors are larger along the beam, the scattering vectors being almost perpendicular to it
+        diff = tensor_components(strain[1:] - self.strain[1:])
+        self.assertTrue(np.all(np.abs(diff) < 5 * errors[1:]))
+        self.assertTrue(np.all(errors[1:, 1:] < 2.e-5))
+
+    def test_stress(self):
+        C = np.zeros((6, 6))
+        C[:3, :3] = 120.
+        C[range(3), range(3)] = 250.
+        C[range(3, 6), range(3, 6)] = 130.
+        o = Orientation.from_euler([30., 50., 70.])
+        # the stiffness is invariant by the cubic symmetry and the rotations can be combined
+        self.assertTrue(np.allclose(rotate_stiffness(C, Orientation.from_euler([90., 0., 0.]).orientation_matrix()),
+                                    C))
+        R = o.orientation_matrix()
+        self.assertTrue(np.allclose(rotate_stiffness(rotate_stiffness(C, R), R.T), C))
+        (strain, errors, stress) = strain_map(self.d, self.directions, self.hkl, stiffness=C,
+                                              orientations=[o] * len(self.d))
+        # compare with the stress computed in the crystal frame
+        g = o.orientation_matrix()
+        strain_crystal = np.einsum('ia,pab,jb->pij', g, self.strain, g)
+        stress_crystal = strain_to_stress(strain_crystal, C)
+        self.assertTrue(np.allclose(np.einsum('ai,pab,bj->pij', g, stress_crystal, g), stress))
+        # hydrostatic strain
+        stress = strain_to_stress(1.e-3 * np.eye(3), C, o)
+        self.assertTrue(np.allclose(stress[0], 1.e-3 * (250. + 2 * 120.) * np.eye(3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import numpy as np
+from pymicro.xray.xray_utils import radiograph, radiographs, iter_radiographs, attenuation_table, mass_attenuation, \
+    attenuation_coefficient, path_lengths, transmission
+
+
+class XrayUtilsTests(unittest.TestCase):
+    def setUp(self):
+        print 'testing the xray_utils module'
+        np.random.seed(13)
+        self.data = np.random.rand(31, 24, 6)
+        self.omegas = np.array([0., 23., 90., 212.5])
+
+    def test_radiographs(self):
+        from skimage.transform import radon
+        projections = radiographs(self.data, self.omegas)
+        self.assertEqual(projections.shape, (44, 6, 4))
+        self.assertEqual(projections.dtype, np.float32)
+        for z in range(self.data.shape[2]):
+            sinogram = radon(self.data[:, :, z], -self.omegas, circle=False)
+            self.assertTrue(np.allclose(projections[:, z, :], sinogram, atol=1.e-4))
+
+    def test_iter_radiographs(self):
+        projections = radiographs(self.data, self.omegas)
+        for n_threads in [2, 3]:
+            # the last batch of projection matrices is incomplete with 3 threads
+            for i, projection in enumerate(iter_radiographs(self.data, self.omegas, n_threads=n_threads, slab_size=4)):
+                self.assertTrue(np.allclose(projection, projections[:, :, i]))
+        # a single radiograph is computed without any thread pool
+        projection = radiograph(self.data, self.omegas[1])
+        self.assertEqual(projection.dtype, np.float32)
+        self.assertTrue(np.allclose(projection, projections[:, :, 1]))
+
+
+class AttenuationTests(unittest.TestCase):
+    def test_mass_attenuation(self):
+        (energy, mu_rho) = attenuation_table('Al')
+        self.assertTrue(np.allclose(mass_attenuation('Al', energy[10:20]), mu_rho[10:20]))
+        # log-log interpolation between two tabulated points
+        e = np.sqrt(energy[30] * energy[31])
+        self.assertAlmostEqual(mass_attenuation('Al', e), np.sqrt(mu_rho[30] * mu_rho[31]))
+        # XCOM tables are given in MeV
+        self.assertAlmostEqual(attenuation_table('Pb')[0][0], 1.)
+        # the jump at the lead K edge (88.0045 keV) is preserved by the interpolation
+        (energy, mu_rho) = attenuation_table('Pb')
+        k = np.where(np.diff(energy) == 0)[0][-1]
+        self.assertAlmostEqual(energy[k], 88.0045)
+        mu = mass_attenuation('Pb', [energy[k] - 1.e-6, energy[k] + 1.e-6])
+        self.assertAlmostEqual(mu[0] / mu_rho[k], 1., 4)
+        self.assertAlmostEqual(mu[1] / mu_rho[k + 1], 1., 4)
+        self.assertRaises(ValueError, mass_attenuation, 'Al', 500.)
+        self.assertRaises(ValueError, attenuation_table, 'Xx')
+
+    def test_compound(self):
+        energy = np.array([[20., 40.], [60., 80.]])
+        mu = mass_attenuation({'Ti': 0.9, 'Al': 0.06, 'V': 0.04}, energy)
+        self.assertEqual(mu.shape, (2, 2))
+        expected = 0.9 * mass_attenuation('Ti', energy) + 0.06 * mass_attenuation('Al', energy) + \
+                   0.04 * mass_attenuation('V', energy)
+        self.assertTrue(np.allclose(mu, expected))
+        self.assertTrue(np.allclose(attenuation_coefficient({'Al': 1.}, energy, rho=2.7),
+                                    attenuation_coefficient('Al', energy) * 2.7 / 2.6941))
+        self.assertRaises(ValueError, attenuation_coefficient, {'Al': 1.}, 20.)
+
+    def test_path_lengths(self):
+        labels = np.zeros((20, 16, 10), dtype=np.uint8)
+        labels[5:15, 4:12, 2:8] = 1
+        lengths = path_lengths(labels, direction=(1., 0., 0.), detector_size=(24, 12))
+        self.assertEqual(lengths.shape, (24, 12, 2))
+        # the projection along X is in (Y, Z) form
+        self.assertTrue(np.allclose(lengths[:, :, 1], 10. * np.pad(np.ones((8, 6)), ((8, 8), (3, 3)), 'constant')))
+        self.assertTrue(np.allclose(lengths.sum(axis=2)[4:20, 1:11], 20.))
+        # the intersection lengths of the central ray are exact whatever the direction
+        center = 0.5 * np.array(labels.shape)
+        for direction in [(1., 1., 0.), (0., 0., 1.), (0.3, -0.5, 0.8), (-0.7, 0.2, 0.1)]:
+            d = np.array(direction) / np.linalg.norm(direction)
+            lengths = path_lengths(labels, direction=direction, detector_size=(1, 1))
+            for (label, low, high) in [(0, np.zeros(3), labels.shape), (1, (5, 4, 2), (15, 12, 8))]:
+                with np.errstate(divide='ignore'):
+                    t = (np.array([low, high]) - center) / d
+                expected = max(0., np.min(np.max(t, axis=0)) - np.max(np.min(t, axis=0)))
+                if label == 0:
+                    expected -= lengths[0, 0, 1]
+                self.assertAlmostEqual(lengths[0, 0, label], expected)
+        self.assertAlmostEqual(path_lengths(labels, (1., 1., 0.), detector_size=(1, 1))[0, 0, 1], 8 * np.sqrt(2))
+
+    def test_transmission(self):
+        labels = np.zeros((10, 10, 10), dtype=np.int32)
+        labels[2:8, :, :] = 1
+        labels[8:, :, :] = 2
+        phases = {1: 'Al', 2: ({'Fe': 0.7, 'Cr': 0.2, 'Ni': 0.1}, 7.9)}
+        T = transmission(labels, phases, 40., pixel_size=0.1, detector_size=(10, 10))
+        mu_al = 0.1 * attenuation_coefficient('Al', 40.)
+        mu_steel = 0.1 * attenuation_coefficient({'Fe': 0.7, 'Cr': 0.2, 'Ni': 0.1}, 40., 7.9)
+        self.assertTrue(np.allclose(T, np.exp(-0.6 * mu_al - 0.2 * mu_steel)))
+        # polychromatic beam
+        energies = np.array([30., 40., 60.])
+        weights = np.array([1., 2., 1.])
+        T = transmission(labels, phases, energies, detector_size=(10, 10))
+        self.assertEqual(T.shape, (10, 10, 3))
+        T_poly = transmission(labels, phases, energies, spectrum=weights, detector_size=(10, 10))
+        self.assertTrue(np.allclose(T_poly, np.dot(T, weights) / 4.))
+        self.assertRaises(ValueError, transmission, labels, phases, energies, spectrum=[1., 2.])
+
+
+if __name__ == '__main__':
+    unittest.main()
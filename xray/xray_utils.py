@@ -1,6 +1,7 @@
 import os, numpy as np
-from matplotlib import pyplot as plt
-from skimage.transform import radon
+from pymicro.lazy import lazy_import
+
+plt = lazy_import('matplotlib.pyplot')
 
 densities = {'Li': 0.533,  # Z = 3
              'Be': 1.8450,  # Z = 4
@@ -22,6 +23,38 @@ densities = {'Li': 0.533,  # Z = 3
              'Pb': 11.330,  # Z = 82
              }
 
+# Cromer-Mann coefficients (a1, b1, a2, b2, a3, b3, a4, b4, c) of the atomic scattering factors
+# from the International Tables for Crystallography, vol. C, table 6.1.1.4 (b in angstrom^2)
+cromer_mann = {'Li': (1.1282, 3.9546, 0.7508, 1.0524, 0.6175, 85.3905, 0.4653, 168.261, 0.0377),
+               'Be': (1.5919, 43.6427, 1.1278, 1.8623, 0.5391, 103.483, 0.7029, 0.5420, 0.0385),
+               'B': (2.0545, 23.2185, 1.3326, 1.0210, 1.0979, 60.3498, 0.7068, 0.1403, -0.1932),
+               'C': (2.3100, 20.8439, 1.0200, 10.2075, 1.5886, 0.5687, 0.8650, 51.6512, 0.2156),
+               'O': (3.0485, 13.2771, 2.2868, 5.7011, 1.5463, 0.3239, 0.8670, 32.9089, 0.2508),
+               'Mg': (5.4204, 2.8275, 2.1735, 79.2611, 1.2269, 0.3808, 2.3073, 7.1937, 0.8584),
+               'Al': (6.4202, 3.0387, 1.9002, 0.7426, 1.5936, 31.5472, 1.9646, 85.0886, 1.1151),
+               'Si': (6.2915, 2.4386, 3.0353, 32.3337, 1.9891, 0.6785, 1.5410, 81.6937, 1.1407),
+               'Ti': (9.7595, 7.8508, 7.3558, 0.5000, 1.6991, 35.6338, 1.9021, 116.105, 1.2807),
+               'V': (10.2971, 6.8657, 7.3511, 0.4385, 2.0703, 26.8938, 2.0571, 102.478, 1.2199),
+               'Cr': (10.6406, 6.1038, 7.3537, 0.3920, 3.3240, 20.2626, 1.4922, 98.7399, 1.1832),
+               'Mn': (11.2819, 5.3409, 7.3573, 0.3432, 3.0193, 17.8674, 2.2441, 83.7543, 1.0896),
+               'Fe': (11.7695, 4.7611, 7.3573, 0.3072, 3.5222, 15.3535, 2.3045, 76.8805, 1.0369),
+               'Co': (12.2841, 4.2791, 7.3409, 0.2784, 4.0034, 13.5359, 2.3488, 71.1692, 1.0118),
+               'Ni': (12.8376, 3.8785, 7.2920, 0.2565, 4.4438, 12.1763, 2.3800, 66.3421, 1.0341),
+               'Cu': (13.3380, 3.5828, 7.1676, 0.2470, 5.6158, 11.3966, 1.6735, 64.8126, 1.1910),
+               'Zn': (14.0743, 3.2655, 7.0318, 0.2333, 5.1652, 10.3163, 2.4100, 58.7097, 1.3041),
+               'Ga': (15.2354, 3.0669, 6.7006, 0.2412, 4.3591, 10.7805, 2.9623, 61.4135, 1.7189),
+               'Ge': (16.0816, 2.8509, 6.3747, 0.2516, 3.7068, 11.4468, 3.6830, 54.7625, 2.1313),
+               'Zr': (17.8765, 1.27618, 10.9480, 11.9160, 5.41732, 0.117622, 3.65721, 87.6627, 2.06929),
+               'Nb': (17.6142, 1.18865, 12.0144, 11.7660, 4.04183, 0.204785, 3.53346, 69.7957, 3.75591),
+               'Mo': (3.7025, 0.2772, 17.2356, 1.0958, 12.8876, 11.0040, 3.7429, 61.6584, 4.3875),
+               'Ag': (19.2808, 0.6446, 16.6885, 7.4726, 4.8045, 24.6605, 1.0463, 99.8156, 5.1790),
+               'La': (20.5780, 2.94817, 19.5990, 0.244475, 11.3727, 18.7726, 3.28719, 133.124, 2.14678),
+               'Ce': (21.1671, 2.77393, 19.7695, 0.226836, 11.8513, 17.6083, 3.33049, 127.113, 1.86264),
+               'W': (29.0818, 1.72029, 15.4300, 9.2259, 14.4327, 0.321703, 5.11982, 57.0560, 9.8875),
+               'Au': (16.8819, 0.4611, 18.5913, 8.6216, 25.5582, 1.4826, 5.8600, 36.3956, 12.0658),
+               'Pb': (31.0617, 0.6902, 13.0637, 2.3576, 18.4420, 8.6180, 5.9696, 47.2579, 13.4118),
+               }
+
 
 def lambda_keV_to_nm(lambda_keV):
     '''Change the unit of wavelength from keV to nm.
@@ -59,6 +92,264 @@ def lambda_angstrom_to_keV(lambda_angstrom):
     return 12.398 / lambda_angstrom
 
 
+def atomic_scattering_factor(element, s):
+    '''Compute the X-ray atomic scattering factor of a given element.
+
+    The atomic scattering factor is evaluated with the Cromer-Mann
+    analytical approximation:
+
+    .. math::
+
+      f(s) = \\sum_{i=1}^4 a_i\\exp(-b_i s^2) + c
+
+    with :math:`s=\\sin\\theta/\\lambda` expressed in angstrom^-1.
+
+    :param str element: the chemical symbol of the element (e.g. 'Al').
+    :param s: the value(s) of :math:`\\sin\\theta/\\lambda` in angstrom^-1 (scalar or numpy array).
+    :raise ValueError: if the element is not tabulated.
+    :returns: the atomic scattering factor (in electron units) with the same shape as s.
+    '''
+    if element not in cromer_mann:
+        raise ValueError('no tabulated scattering factor for element %s' % element)
+    coefs = cromer_mann[element]
+    s2 = np.asarray(s, dtype=np.float64) ** 2
+    f = coefs[8] * np.ones_like(s2)
+    for i in range(4):
+        f += coefs[2 * i] * np.exp(-coefs[2 * i + 1] * s2)
+    return f
+
+
+# cache of the tabulated mass attenuation coefficients, element -> (log energy, log mu_rho)
+_attenuation_tables = {}
+
+
+def attenuation_elements():
+    '''List the elements for which the mass attenuation coefficient is tabulated.
+
+    :returns: a sorted list of the chemical symbols.
+    '''
+    path = os.path.join(os.path.dirname(__file__), 'data')
+    return sorted([os.path.splitext(f)[0] for f in os.listdir(path) if f.endswith('.txt')])
+
+
+def attenuation_table(element):
+    '''Get the tabulated mass attenuation coefficient of an element.
+
+    The table is read from the data folder only once and then kept in
+    memory. Both the NIST FFAST (energy in keV) and XCOM (energy in MeV)
+    file formats are supported, the unit being read from the header. The
+    absorption edges appear as two consecutive points at (nearly) the same
+    energy.
+
+    :param str element: the chemical symbol of the element (e.g. 'Al').
+    :raise ValueError: if the element is not tabulated.
+    :returns tuple (energy, mu_rho): two arrays with the energies in keV and the mass attenuation coefficients
+        in cm^2/g.
+    '''
+    if element not in _attenuation_tables:
+        file_path = os.path.join(os.path.dirname(__file__), 'data', '%s.txt' % element)
+        if not os.path.exists(file_path):
+            raise ValueError('no tabulated attenuation for element %s, available elements are %s'
+                             % (element, ', '.join(attenuation_elements())))
+        with open(file_path) as f:
+            header = f.readline()
+        table = np.genfromtxt(file_path, usecols=(0, 1), comments='#')
+        energy = table[:, 0] * (1000. if 'MeV' in header else 1.)
+        order = np.argsort(energy, kind='mergesort')
+        _attenuation_tables[element] = (np.log(energy[order]), np.log(table[order, 1]))
+    (log_energy, log_mu_rho) = _attenuation_tables[element]
+    return np.exp(log_energy), np.exp(log_mu_rho)
+
+
+def _mass_fractions(material):
+    '''Return the mass fractions of a material given as an element or a dictionary of mass fractions.'''
+    if isinstance(material, dict):
+        total = float(sum(material.values()))
+        return dict([(element, fraction / total) for (element, fraction) in material.items()])
+    return {material: 1.}
+
+
+def mass_attenuation(material, energy):
+    '''Compute the mass attenuation coefficient of a material.
+
+    The tabulated values are interpolated linearly in log-log scale. For a
+    compound, the mass attenuation coefficients of the elements are
+    weighted by their mass fractions:
+
+    .. math::
+
+      \\mu_\\rho = \\sum_i w_i\\mu_{\\rho,i}
+
+    :param material: the chemical symbol of an element (e.g. 'Al') or a dictionary of the mass fractions of the
+        elements of a compound (e.g. {'Ti': 0.9, 'Al': 0.06, 'V': 0.04}), the fractions are normalized.
+    :param energy: the X-ray energy in keV (scalar or numpy array).
+    :raise ValueError: if an energy is outside the tabulated range.
+    :returns: the mass attenuation coefficient in cm^2/g with the same shape as energy.
+    '''
+    log_energy = np.log(np.asarray(energy, dtype=np.float64))
+    mu_rho = np.zeros_like(log_energy)
+    for (element, fraction) in _mass_fractions(material).items():
+        attenuation_table(element)
+        (log_e, log_mu) = _attenuation_tables[element]
+        if np.any(log_energy < log_e[0]) or np.any(log_energy > log_e[-1]):
+            raise ValueError('energy out of the tabulated range [%.3f, %.1f] keV for element %s'
+                             % (np.exp(log_e[0]), np.exp(log_e[-1]), element))
+        mu_rho += fraction * np.exp(np.interp(log_energy, log_e, log_mu))
+    return mu_rho
+
+
+def attenuation_coefficient(material, energy, rho=None):
+    '''Compute the linear attenuation coefficient of a material.
+
+    :param material: an element or a compound (see :py:func:`mass_attenuation`).
+    :param energy: the X-ray energy in keV (scalar or numpy array).
+    :param float rho: the density of the material in g/cm^3 (tabulated for pure elements if None).
+    :raise ValueError: if the density is not given and not tabulated.
+    :returns: the linear attenuation coefficient in cm^-1 with the same shape as energy.
+    '''
+    if rho is None:
+        if isinstance(material, dict) or material not in densities:
+            raise ValueError('the density of material %s is not tabulated and must be given' % (material,))
+        rho = densities[material]
+    return rho * mass_attenuation(material, energy)
+
+
+def _tabulated_energies(material):
+    '''Return the sorted energies (in keV) of the tables of all the elements of a material in their common range.'''
+    tables = [attenuation_table(element)[0] for element in _mass_fractions(material)]
+    (e_min, e_max) = (max([e[0] for e in tables]), min([e[-1] for e in tables]))
+    energy = np.unique(np.concatenate(tables))
+    return energy[(energy >= e_min) & (energy <= e_max)]
+
+
+def path_lengths(labels, direction=(1., 0., 0.), detector_size=None):
+    '''Compute the path lengths of parallel X-ray beams through each phase of a labelled volume.
+
+    The volume is in (XYZ) form and the voxel of indices (i, j, k) occupies
+    the cube [i, i + 1) x [j, j + 1) x [k, k + 1). The rays are parallel to
+    the beam direction and go through the pixel centers of a detector
+    perpendicular to it and centered on the volume. The detector axes are
+    :math:`v`, the projection of Z (of X if the beam is along Z) on the
+    detector plane, and :math:`u=v\\times d`, so that a beam along X gives
+    projections in (Y, Z) form.
+
+    The exact intersection lengths of each ray with the voxels are computed
+    with the method of Siddon: the ray parameters of the crossings with all
+    the planes of the grid are sorted, each interval between two successive
+    crossings lying in a single voxel. All the rays of a chunk are processed
+    at once to limit memory usage.
+
+    :param labels: a 3D array of non negative integer labels.
+    :param direction: the beam direction (normalized), along X by default.
+    :param tuple detector_size: the number of pixels (nu, nv) of the detector, the pixel size being the voxel size
+        (by default the detector covers the projection of the whole volume).
+    :raise ValueError: if the labels are not a 3D array of non negative integers.
+    :returns: a (nu, nv, n_labels) array of the path lengths in voxel unit, with n_labels = labels.max() + 1.
+    '''
+    labels = np.asarray(labels)
+    if labels.ndim != 3 or not np.issubdtype(labels.dtype, np.integer):
+        raise ValueError('the labels must be a 3D array of integers')
+    if labels.min() < 0:
+        raise ValueError('the labels must not be negative')
+    d = np.asarray(direction, dtype=np.float64)
+    d = d / np.linalg.norm(d)
+    ref = np.array([0., 0., 1.]) if abs(d[2]) < 0.999 else np.array([1., 0., 0.])
+    v = ref - np.dot(ref, d) * d
+    v /= np.linalg.norm(v)
+    u = np.cross(v, d)
+    shape = np.array(labels.shape)
+    center = 0.5 * shape
+    radius = 0.5 * np.linalg.norm(shape)
+    if detector_size is None:
+        n = int(np.ceil(2 * radius))
+        detector_size = (n, n)
+    radius += 1.
+    (nu, nv) = detector_size
+    (a, b) = np.meshgrid(np.arange(nu) - 0.5 * nu + 0.5, np.arange(nv) - 0.5 * nv + 0.5, indexing='ij')
+    # the rays start outside the volume: p = origin + t * d with t in [0, 2 * radius]
+    origins = center - radius * d + a.reshape((-1, 1)) * u + b.reshape((-1, 1)) * v
+    n_labels = labels.max() + 1
+    flat_labels = labels.ravel()
+    n_rays = len(origins)
+    n_planes = np.sum(shape + 1) + 2
+    lengths = np.zeros((n_rays, n_labels))
+    chunk_size = max(1, 2 ** 20 // n_planes)
+    for start in range(0, n_rays, chunk_size):
+        stop = min(start + chunk_size, n_rays)
+        o = origins[start:stop]
+        # ray parameters of the crossings with the planes x = i, y = j and z = k
+        t = [np.zeros((stop - start, 1)), np.full((stop - start, 1), 2 * radius)]
+        for axis in range(3):
+            planes = np.arange(shape[axis] + 1)
+            if abs(d[axis]) > 1.e-12:
+                t.append(np.clip((planes - o[:, axis:axis + 1]) / d[axis], 0., 2 * radius))
+            else:
+                t.append(np.zeros((stop - start, len(planes))))
+        t = np.sort(np.concatenate(t, axis=1), axis=1)
+        dt = np.diff(t, axis=1)
+        mid = 0.5 * (t[:, 1:] + t[:, :-1])
+        ijk = np.floor(o[:, np.newaxis, :] + mid[:, :, np.newaxis] * d).astype(int)
+        inside = np.all((ijk >= 0) & (ijk < shape), axis=-1) & (dt > 0)
+        rays = np.broadcast_to(np.arange(stop - start)[:, np.newaxis], inside.shape)[inside]
+        voxels = np.ravel_multi_index(tuple(ijk[inside].T), labels.shape)
+        lengths[start:stop] = np.bincount(rays * n_labels + flat_labels[voxels], weights=dt[inside],
+                                          minlength=(stop - start) * n_labels).reshape((stop - start, n_labels))
+    return lengths.reshape((nu, nv, n_labels))
+
+
+def transmission(labels, phases, energy, direction=(1., 0., 0.), spectrum=None, pixel_size=1., detector_size=None):
+    '''Compute the X-ray transmission through a phase labelled volume.
+
+    The path lengths :math:`L_p` through each phase are computed with
+    :py:func:`path_lengths` and Beer-Lambert law is applied for each
+    energy:
+
+    .. math::
+
+      I/I_0 = \\exp(-\\sum_p\\mu_p(E)L_p)
+
+    With a polychromatic beam, the transmission is averaged over the
+    spectrum. This can be used to simulate radiographs or to choose the
+    energy and the sample orientation before a scan::
+
+      labels = np.zeros((100, 100, 50), dtype=np.uint8)
+      labels[20:80, 20:80, :] = 1
+      labels[40:60, 40:60, 10:40] = 2
+      phases = {1: 'Al', 2: ({'Fe': 0.7, 'Cr': 0.2, 'Ni': 0.1}, 7.9)}
+      T = transmission(labels, phases, 40., direction=(1., 1., 0.), pixel_size=0.01)
+
+    :param labels: a 3D array of non negative integer labels in (XYZ) form.
+    :param dict phases: a dictionary giving the material of each label, either an element or a tuple (material,
+        rho) with the material an element or a dictionary of mass fractions and rho the density in g/cm^3; the
+        labels not in the dictionary are considered as void.
+    :param energy: the X-ray energy in keV (scalar or numpy array).
+    :param direction: the beam direction, along X by default (see :py:func:`path_lengths`).
+    :param spectrum: the weights of each energy of a polychromatic beam (None by default).
+    :param float pixel_size: the voxel size in mm (1 by default).
+    :param tuple detector_size: the number of pixels (nu, nv) of the detector (see :py:func:`path_lengths`).
+    :raise ValueError: if the spectrum does not match the energies.
+    :returns: the transmission, a (nu, nv) array for a single energy or a spectrum, or a (nu, nv, n_energies)
+        array otherwise.
+    '''
+    energies = np.atleast_1d(np.asarray(energy, dtype=np.float64))
+    lengths = pixel_size * path_lengths(labels, direction, detector_size)
+    # linear attenuation coefficients in mm^-1 for each label
+    mu = np.zeros((lengths.shape[2], len(energies)))
+    for (label, phase) in phases.items():
+        (material, rho) = phase if isinstance(phase, tuple) else (phase, None)
+        if label < len(mu):
+            mu[label] = 0.1 * attenuation_coefficient(material, energies, rho)
+    trans = np.exp(-np.dot(lengths, mu))
+    if spectrum is not None:
+        weights = np.atleast_1d(np.asarray(spectrum, dtype=np.float64))
+        if weights.shape != energies.shape:
+            raise ValueError('the spectrum must have one weight per energy (%d)' % len(energies))
+        return np.dot(trans, weights) / weights.sum()
+    if np.ndim(energy) == 0:
+        return trans[:, :, 0]
+    return trans
+
+
 def plot_xray_trans(mat='Al', ts=[1.0], rho=None, energy_lim=(1, 100), legfmt='%.1f', display=True):
     '''Plot the transmitted intensity of a X-ray beam through a given material.
 
@@ -71,29 +362,29 @@ def plot_xray_trans(mat='Al', ts=[1.0], rho=None, energy_lim=(1, 100), legfmt='%
       I/I_0 = \exp(-\mu_\rho*\rho*t)
 
     The tabulated data is stored in ascii files in the data folder. It has been retrieved
-    from NIST `http://physics.nist.gov/cgi-bin/ffast/ffast.pl`
-    The density is also tabulated and can be left blanked unless a specific value is to be used.
+    from NIST `http://physics.nist.gov/cgi-bin/ffast/ffast.pl` and is read only once (see
+    :py:func:`attenuation_table`).
+    The density is also tabulated and can be left blanked unless a specific value is to be used
+    (it must be given for a compound).
 
-    :param string mat: A string representing the material (e.g. 'Al')
+    :param mat: A string representing the material (e.g. 'Al') or a dictionary of the mass fractions of
+        a compound (see :py:func:`mass_attenuation`)
     :param list ts: a list of thickness values of the material in mm ([1.0] by default)
     :param float rho: density of the material in g/cm^3 (None by default)
     :param tuple energy_lim: energy bounds in keV for the plot (1, 100 by default)
     :param string legfmt: string to format the legend plot
     :param bool display: display or save an image of the plot (False by default)
     '''
-    path = os.path.dirname(__file__)
-    print path
-    mu_rho = np.genfromtxt(os.path.join(path, 'data', mat + '.txt'), usecols=(0, 1), comments='#')
-    energy = mu_rho[:, 0]
-    # look up density
-    if rho is None:
-        rho = densities[mat]
+    energy = _tabulated_energies(mat)
+    mu = attenuation_coefficient(mat, energy, rho)
+    name = mat if not isinstance(mat, dict) else '-'.join(sorted(mat))
     legstr = '%%s %s mm' % legfmt
     for t in ts:
         # apply Beer-Lambert
-        trans = 100 * np.exp(-mu_rho[:, 1] * rho * t / 10)
-        plt.plot(energy, trans, '-', linewidth=3, markersize=10, label=legstr % (mat, t))
+        trans = 100 * np.exp(-mu * t / 10)
+        plt.plot(energy, trans, '-', linewidth=3, markersize=10, label=legstr % (name, t))
     # bound the energy to (1, 100)
+    energy_lim = list(energy_lim)
     if energy_lim[0] < 1:
         energy_lim[0] = 1
     if energy_lim[1] > 100:
@@ -106,35 +397,151 @@ def plot_xray_trans(mat='Al', ts=[1.0], rho=None, energy_lim=(1, 100), legfmt='%
     if display:
         plt.show()
     else:
-        plt.savefig('xray_trans_' + mat + '.png')
+        plt.savefig('xray_trans_' + name + '.png')
 
 def radiograph(data, omega):
-    """Compute a single radiograph of a 3D object using the radon transform.
+    """Compute a single radiograph of a 3D object.
+
+    The projection is computed directly in the calling thread with a sparse
+    projection matrix (see :py:func:`~pymicro.xray.xray_utils._projection_matrix`),
+    this is the function to use when the projections are computed one by
+    one (like in a DCT scan simulation).
 
     :param np.array data: an array representing the 3D object in (XYZ) form.
     :param omega: the rotation angle value in degrees.
     :returns projection: a 2D array in (Y, Z) form.
     """
-    projection = radiographs(data, [omega])
-    return projection[:, :, 0]
+    assert data.ndim == 3
+    width = int(np.ceil(max(data.shape[0], data.shape[1]) * 2 ** 0.5))
+    P = _projection_matrix(data.shape[:2], omega, width)
+    columns = np.asarray(data.reshape((data.shape[0] * data.shape[1], data.shape[2])), dtype=np.float32)
+    return P.dot(columns)
+
+
+def _projection_matrix(shape, omega, width, block_size=256):
+    """Build the sparse matrix projecting a 2D slice along the X axis after a rotation of omega around Z.
+
+    The rotation is carried out with a bilinear interpolation using the same
+    conventions as the radon transform of the skimage package: the slice is
+    (virtually) padded to a square of side `width` and rotated around the
+    pixel (shape[0] // 2, shape[1] // 2). Since the rotation and the sum
+    along the rays are linear, they combine into a single sparse matrix
+    which can be applied to all the Z slices of a volume at once.
+
+    :param tuple shape: the (nx, ny) shape of the slice.
+    :param float omega: the rotation angle in degrees.
+    :param int width: the width of the projection.
+    :param int block_size: the number of rows of the rotated image processed at once to limit memory usage.
+    :returns: a (width, nx * ny) scipy.sparse.csr_matrix.
+    """
+    from scipy import sparse
+    (nx, ny) = shape
+    omegar = np.radians(omega)
+    (c, s) = (np.cos(omegar), np.sin(omegar))
+    center = width // 2
+    cols = np.arange(width) - center
+    P = sparse.csr_matrix((width, nx * ny), dtype=np.float32)
+    for start in range(0, width, block_size):
+        rows = np.arange(start, min(start + block_size, width)) - center
+        rr, cc = np.meshgrid(rows, cols, indexing='ij')
+        # position of each pixel of the rotated image in the input slice
+        x = c * rr + s * cc + nx // 2
+        y = -s * rr + c * cc + ny // 2
+        x0 = np.floor(x).astype(int)
+        y0 = np.floor(y).astype(int)
+        (fx, fy) = (x - x0, y - y0)
+        out_cols = np.broadcast_to(np.arange(width), rr.shape)
+        data, i_in, i_out = [], [], []
+        for (dx, dy, w) in [(0, 0, (1 - fx) * (1 - fy)), (1, 0, fx * (1 - fy)),
+                            (0, 1, (1 - fx) * fy), (1, 1, fx * fy)]:
+            (xi, yi) = (x0 + dx, y0 + dy)
+            inside = (xi >= 0) & (xi < nx) & (yi >= 0) & (yi < ny) & (w > 0)
+            data.append(w[inside])
+            i_in.append(xi[inside] * ny + yi[inside])
+            i_out.append(out_cols[inside])
+        P = P + sparse.csr_matrix((np.concatenate(data), (np.concatenate(i_out), np.concatenate(i_in))),
+                                  shape=(width, nx * ny), dtype=np.float32)
+    return P
+
+
+def iter_radiographs(data, omegas, n_threads=1, slab_size=32):
+    """Iterate over the radiographs of a 3D object.
+
+    This generator yields the projections one at a time so that the memory
+    needed does not depend on the number of angles. For each angle, the
+    rotation around the Z axis and the sum along X are expressed as a sparse
+    matrix (see :py:func:`~pymicro.xray.xray_utils._projection_matrix`) which
+    is applied to all the Z slices at once. The projections follow the same
+    conventions as :py:func:`~pymicro.xray.xray_utils.radiographs`.
+
+    ::
+
+      for omega, proj in zip(omegas, iter_radiographs(data, omegas)):
+          edf_write(proj, 'proj_%05.1f.edf' % omega, type=np.float32)
+
+    Most of the time is spent building the projection matrices. With
+    several threads, the matrices of `n_threads` consecutive angles are
+    built concurrently (numpy releases the GIL in most of the computations)
+    and the sparse product is split in slabs of Z slices; the projections
+    are still yielded in the order of the angles.
+
+    :param np.array data: an array representing the 3D object in (XYZ) form.
+    :param omegas: an array of the rotation values in degrees.
+    :param int n_threads: the number of threads used to build the projection matrices and compute the sparse
+        products (1 by default).
+    :param int slab_size: the number of Z slices projected in a single task with several threads (32 by default).
+    :returns: a generator of 2D float32 arrays in (Y, Z) form.
+    """
+    from multiprocessing.pool import ThreadPool
+    assert data.ndim == 3
+    width = int(np.ceil(max(data.shape[0], data.shape[1]) * 2 ** 0.5))
+    nz = data.shape[2]
+    # each row of this 2D view holds the Z column of one (x, y) position, converted only once
+    columns = np.asarray(data.reshape((data.shape[0] * data.shape[1], nz)), dtype=np.float32)
+    if n_threads <= 1:
+        for omega in omegas:
+            P = _projection_matrix(data.shape[:2], omega, width)
+            yield P.dot(columns)
+        return
+    z_ranges = [(z, min(z + slab_size, nz)) for z in range(0, nz, slab_size)]
+    pool = ThreadPool(n_threads)
+
+    def project_slab(P, z_range):
+        return P.dot(columns[:, z_range[0]:z_range[1]])
+
+    try:
+        omegas = list(omegas)
+        # only n_threads matrices are kept in memory at once
+        for start in range(0, len(omegas), n_threads):
+            matrices = pool.map(lambda omega: _projection_matrix(data.shape[:2], omega, width),
+                                omegas[start:start + n_threads])
+            for P in matrices:
+                projection = np.empty((width, nz), dtype=np.float32)
+                slabs = pool.map(lambda z_range: project_slab(P, z_range), z_ranges)
+                for z_range, slab in zip(z_ranges, slabs):
+                    projection[:, z_range[0]:z_range[1]] = slab
+                yield projection
+    finally:
+        pool.close()
+
 
-def radiographs(data, omegas):
-    """Compute the radiographs of a 3D object using the radon transform.
+def radiographs(data, omegas, n_threads=1):
+    """Compute the radiographs of a 3D object.
 
     The object is represented by a 3D numpy array in (XYZ) form and a series of projection at each omega angle
-    are computed assuming the rotation is along Z in the middle of the data set. Internally this function uses
-    the radon transform from the skimage package.
+    are computed assuming the rotation is along Z in the middle of the data set. The projections are
+    equivalent to the radon transform from the skimage package applied to each Z slice, but a whole volume
+    is projected at once for each angle (see :py:func:`~pymicro.xray.xray_utils.iter_radiographs`).
 
     :param np.array data: an array representing the 3D object in (XYZ) form.
     :param omegas: an array of the rotation values in degrees.
-    :returns projections: a 3D array in (Y, Z, omega) form.
+    :param int n_threads: the number of threads used to compute the projections (1 by default).
+    :returns projections: a 3D float32 array in (Y, Z, omega) form.
     """
     assert data.ndim == 3
-    if type(omegas) is list:
-        omegas = np.array(omegas)
-    width = np.ceil(max(data.shape[0], data.shape[1]) * 2 ** 0.5)
-    projections = np.zeros((width, np.shape(data)[2], len(omegas)), dtype=np.float)
-    for z in range(np.shape(data)[2]):
-        a = radon(data[:, :, z], -omegas)  # - 90  # the 90 seems to come from the radon function itself
-        projections[:, z, :] = a[:, :]
+    omegas = np.atleast_1d(omegas)
+    width = int(np.ceil(max(data.shape[0], data.shape[1]) * 2 ** 0.5))
+    projections = np.zeros((width, np.shape(data)[2], len(omegas)), dtype=np.float32)
+    for i, projection in enumerate(iter_radiographs(data, omegas, n_threads=n_threads)):
+        projections[:, :, i] = projection
     return projections